@@ -0,0 +1,118 @@
+"""Per-route concurrency limits with a fast 503 when a route is saturated.
+
+Slow, LLM-bound views are wrapped with ``admission.limit('chat')``; at most
+``max_concurrent`` of them run at once per process and further requests wait
+up to ``max_wait`` seconds for a slot before being turned away with
+``503 Retry-After``.  Cheap routes are never gated, so they keep getting
+served while the LLM routes are busy.  For streamed responses the slot is
+held until the stream is closed.
+
+Views that only sometimes need the model (e.g. an analysis that is usually
+served from cache) wrap the model instead with ``GatedModel``: only the model
+call takes a slot, and it raises ``Busy`` when none frees up in time.
+"""
+
+import functools
+import threading
+
+from flask import jsonify, make_response
+
+
+class Busy(Exception):
+    """No slot of the gate freed up within its ``max_wait``."""
+
+
+class Gate:
+    def __init__(self, name: str, max_concurrent: int, max_wait: float, retry_after: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def acquire(self) -> bool:
+        if not self._slots.acquire(timeout=self.max_wait):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def busy(self) -> Busy:
+        return Busy(f'{self.name}: all {self.max_concurrent} slots in use')
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'maxConcurrent': self.max_concurrent,
+                'inFlight': self.in_flight,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
+
+
+class Admission:
+    def __init__(self):
+        self.gates = {}
+
+    def add_gate(self, name: str, max_concurrent: int, max_wait: float = 0.5, retry_after: int = 5) -> Gate:
+        gate = Gate(name, max_concurrent, max_wait, retry_after)
+        self.gates[name] = gate
+        return gate
+
+    def limit(self, name: str):
+        """Decorator admitting at most the gate's ``max_concurrent`` calls of a view."""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                gate = self.gates[name]
+                if not gate.acquire():
+                    response = jsonify({"error": "The service is busy. Please try again shortly."})
+                    response.status_code = 503
+                    response.headers['Retry-After'] = str(gate.retry_after)
+                    return response
+                try:
+                    response = make_response(view(*args, **kwargs))
+                except BaseException:
+                    gate.release()
+                    raise
+                if response.is_streamed:
+                    response.call_on_close(gate.release)
+                else:
+                    gate.release()
+                return response
+            return wrapper
+        return decorator
+
+    def stats(self) -> dict:
+        return {name: gate.stats() for name, gate in self.gates.items()}
+
+
+class GatedModel:
+    """Model wrapper holding a slot of ``gate`` for each (non-streamed) ``generate_content`` call."""
+
+    def __init__(self, model, gate: Gate):
+        self.model = model
+        self.gate = gate
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, prompt, **kwargs):
+        if not self.gate.acquire():
+            raise self.gate.busy()
+        try:
+            return self.model.generate_content(prompt, **kwargs)
+        finally:
+            self.gate.release()
@@ -0,0 +1,233 @@
+"""Clinician analysis of a patient's chat, cached and updated incrementally.
+
+The last analysis lives at ``analysis/<uid>`` (unchanged shape, read by the
+dashboard) and its fingerprint at ``analysis_meta/<uid>``:
+
+    analysis_meta/<uid> = {
+        "turns": 42,          # turns covered by the stored analysis
+        "metrics": {...},     # chat_metrics state over those turns
+        "hash": "...",        # chained sha256 over those turns
+        "lastKey": "-N...",   # key of the last covered turn under chats/<uid>
+        "lastHash": "...",    # hash of that turn alone
+        "mode": "full" | "incremental",
+        "triage": {...},      # triage_summary() of the stored analysis
+        "updated": <server timestamp>
+    }
+
+Because chat storage is append-only, only turns after ``lastKey`` need to be
+read to tell whether the stored analysis is still current.  If nothing was
+added it is returned as is; if turns were appended, the model gets the
+previous analysis plus the new turns instead of the whole transcript.
+
+The model only writes the summary, highlights and critical flags.  The chart
+fields are computed locally by ``chat_metrics`` from a counter state kept in
+``analysis_meta/<uid>/metrics`` and extended with each batch of new turns, so
+they are still returned when the model call fails.
+"""
+
+import copy
+import hashlib
+import json
+import time
+from string import Template
+from typing import List, Optional, Tuple
+
+import chat_metrics
+import chat_store
+
+ANALYSIS_NODE = 'analysis'
+META_NODE = 'analysis_meta'
+
+EMPTY_ANALYSIS = {
+    "summary": "No chat history.",
+    "moodTimeline": {"labels": [], "data": []},
+    "activity": {"labels": [], "data": []},
+    "urgencyDistribution": {"labels": ["Low", "Medium", "High"], "data": [0, 0, 0]},
+    "emotionRadar": {"labels": ["Joy", "Anger", "Sadness", "Anxiety", "Surprise"], "data": [0, 0, 0, 0, 0]},
+    "highlights": [],
+    "criticalFlags": [],
+    "keywords": [],
+    "emojiCloud": []
+}
+
+ANALYSIS_FIELDS = ('user', 'ai', 'timestamp')
+# Written by the model; the chart fields come from chat_metrics
+NARRATIVE_FIELDS = ('summary', 'highlights', 'criticalFlags')
+UNAVAILABLE_SUMMARY = "The AI summary is unavailable right now. The charts below are up to date."
+
+
+def turn_hash(turn: dict) -> str:
+    canonical = json.dumps([turn.get('user'), turn.get('ai')], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def chain_hash(previous: str, turns: List[dict]) -> str:
+    """Extend a chained content hash with ``turns``; ``''`` starts a new chain."""
+    digest = previous
+    for turn in turns:
+        digest = hashlib.sha256((digest + turn_hash(turn)).encode('ascii')).hexdigest()
+    return digest
+
+
+def fingerprint(items: List[Tuple[str, dict]], previous: Optional[dict] = None) -> dict:
+    """Fingerprint of ``previous`` extended with ``items`` (``[(key, turn)]``)."""
+    previous = previous or {}
+    turns = [t for _, t in items]
+    if not items:
+        return dict(previous)
+    return {
+        'turns': previous.get('turns', 0) + len(items),
+        'hash': chain_hash(previous.get('hash', ''), turns),
+        'lastKey': items[-1][0],
+        'lastHash': turn_hash(turns[-1]),
+    }
+
+
+def render_prompt(template: str, chat_json: str) -> str:
+    # An empty template means the instructions are the model's system instruction
+    if not template:
+        return f"Patient chat history (JSON):\n{chat_json}"
+    if '$CHAT' in template or '${CHAT}' in template:
+        return Template(template).safe_substitute(CHAT=chat_json)
+    return f"{template}\n\nPatient chat history (JSON):\n{chat_json}"
+
+
+def full_prompt(template: str, turns: List[dict]) -> str:
+    chat_json = json.dumps([chat_store.clean_turn(t, ANALYSIS_FIELDS) for t in turns], ensure_ascii=False)
+    return render_prompt(template, chat_json)
+
+
+def incremental_prompt(template: str, previous: dict, new_turns: List[dict]) -> str:
+    chat_json = json.dumps([chat_store.clean_turn(t, ANALYSIS_FIELDS) for t in new_turns], ensure_ascii=False)
+    return (
+        f"{render_prompt(template, chat_json)}\n\n"
+        "The chat history above contains only the turns added since the previous analysis.\n"
+        f"Previous analysis (JSON):\n{json.dumps(previous, ensure_ascii=False)}\n\n"
+        "Return the complete updated analysis JSON object for the whole conversation, "
+        "in the same structure, merging the new turns into the previous analysis."
+    )
+
+
+def parse_analysis(text: str) -> dict:
+    raw = text.strip()
+    # Remove accidental code fences
+    if raw.startswith('```'):
+        raw = raw.strip('`')
+        raw = raw.replace('json', '', 1).strip()
+    return json.loads(raw)
+
+
+def narrative(data: Optional[dict]) -> dict:
+    """The model-written fields of an analysis."""
+    data = data or {}
+    return {field: data.get(field, EMPTY_ANALYSIS[field]) for field in NARRATIVE_FIELDS}
+
+
+def _severity(flag: dict) -> float:
+    value = flag.get('severity')
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def triage_summary(data: dict) -> dict:
+    """The few numbers the cohort triage view sorts by, small enough to keep in the meta record."""
+    urgency = data.get('urgencyDistribution') or {}
+    shares = dict(zip(urgency.get('labels') or [], urgency.get('data') or []))
+    flags = [f for f in data.get('criticalFlags') or [] if isinstance(f, dict)]
+    worst = max(flags, key=_severity, default=None)
+    mood = (data.get('moodTimeline') or {}).get('data') or []
+    return {
+        'high': shares.get('High', 0),
+        'medium': shares.get('Medium', 0),
+        'flags': len(flags),
+        'maxSeverity': _severity(worst) if worst else 0,
+        'topFlag': (worst.get('category') or '') if worst else '',
+        'mood': mood[-1] if mood else None,
+        'summary': str(data.get('summary') or '')[:300],
+    }
+
+
+def _narrate(model, prompt: str) -> Tuple[Optional[dict], Optional[str]]:
+    """``(fields, None)``, or ``(None, error name)`` when the call fails or returns broken JSON."""
+    try:
+        response = model.generate_content(prompt)
+        return narrative(parse_analysis(response.text)), None
+    except Exception as e:
+        return None, type(e).__name__
+
+
+def _store(ref, uid: str, data: dict, fp: dict, mode: str, metrics: dict) -> None:
+    meta = dict(fp, mode=mode, metrics=metrics, triage=triage_summary(data),
+                updated=chat_store.SERVER_TIMESTAMP)
+    ref.update({f'{ANALYSIS_NODE}/{uid}': data, f'{META_NODE}/{uid}': meta})
+
+
+def _finish(ref, uid: str, story: Optional[dict], error: Optional[str], metrics: dict, fp: dict,
+            mode: str, new_turns: int, previous: Optional[dict] = None) -> Tuple[dict, dict]:
+    info = {'mode': mode, 'turns': fp['turns'], 'newTurns': new_turns}
+    charts = chat_metrics.render(metrics)
+    if story is not None:
+        data = dict(story, **charts)
+        _store(ref, uid, data, fp, mode, metrics)
+        return data, info
+    # Charts do not need the model: return them with the last narrative (plus locally detected
+    # urgent messages) and leave the fingerprint alone so the model is asked again next time
+    story = narrative(previous) if previous else dict(narrative(None), summary=UNAVAILABLE_SUMMARY)
+    seen = {flag.get('message') for flag in story['criticalFlags'] if isinstance(flag, dict)}
+    story['criticalFlags'] = story['criticalFlags'] + [
+        flag for flag in chat_metrics.urgent_flags(metrics) if flag['message'] not in seen]
+    info.update(mode='metrics', narrativeError=error)
+    return dict(story, **charts), info
+
+
+def _full_run(ref, model, uid: str, template: str) -> Tuple[dict, dict]:
+    items = chat_store.ordered_items(ref.child(chat_store.CHATS_NODE).child(uid).get())
+    if not items:
+        return copy.deepcopy(EMPTY_ANALYSIS), {'mode': 'empty', 'turns': 0, 'newTurns': 0}
+    turns = [t for _, t in items]
+    metrics = chat_metrics.update_state(None, turns)
+    story, error = _narrate(model, full_prompt(template, turns))
+    return _finish(ref, uid, story, error, metrics, fingerprint(items), 'full', len(items))
+
+
+def analyze(ref, model, uid: str, template: str = '', refresh: bool = False) -> Tuple[dict, dict]:
+    """Return ``(analysis, info)``; ``info['mode']`` is cache, incremental, full, metrics or empty.
+
+    ``template`` holds the analyst instructions when the model does not
+    already carry them as its system instruction.  ``metrics`` means the
+    model call failed and only the charts are current.
+    """
+    started = time.perf_counter()
+    data, info = _analyze(ref, model, uid, template, refresh)
+    info['elapsedMs'] = round((time.perf_counter() - started) * 1000, 1)
+    return data, info
+
+
+def _analyze(ref, model, uid: str, template: str, refresh: bool) -> Tuple[dict, dict]:
+    meta = None if refresh else ref.child(META_NODE).child(uid).get()
+    if not meta or not meta.get('lastKey'):
+        return _full_run(ref, model, uid, template)
+
+    last_key = meta['lastKey']
+    chats = ref.child(chat_store.CHATS_NODE).child(uid)
+    items = chat_store.ordered_items(chats.order_by_key().start_at(last_key).get())
+    if not items or items[0][0] != last_key or turn_hash(items[0][1]) != meta.get('lastHash'):
+        # The covered history changed underneath us; start over
+        return _full_run(ref, model, uid, template)
+
+    previous = ref.child(ANALYSIS_NODE).child(uid).get()
+    if not previous:
+        return _full_run(ref, model, uid, template)
+    new_items = items[1:]
+    if not new_items:
+        return previous, {'mode': 'cache', 'turns': meta.get('turns', 0), 'newTurns': 0}
+
+    metrics = meta.get('metrics')
+    if not metrics or metrics.get('version') != chat_metrics.SCORING_VERSION:
+        # Analysed before metrics were kept, or scored differently: count the covered turns once
+        covered = chat_store.ordered_items(chats.order_by_key().end_at(last_key).get())
+        metrics = chat_metrics.update_state(None, [t for _, t in covered])
+    new_turns = [t for _, t in new_items]
+    metrics = chat_metrics.update_state(metrics, new_turns)
+    story, error = _narrate(model, incremental_prompt(template, narrative(previous), new_turns))
+    return _finish(ref, uid, story, error, metrics, fingerprint(new_items, meta), 'incremental',
+                   len(new_items), previous)
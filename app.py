@@ -1,38 +1,98 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-import firebase_admin
-from firebase_admin import credentials, auth as admin_auth, db
+import time
+# Import and client setup costs are reported on the first request and at /metrics
+_import_started = time.perf_counter()
+
+from flask import Flask, Blueprint, render_template, request, redirect, url_for, session, jsonify, Response, stream_with_context
 import requests
+import os
 import re
+import sys
 import html
-import json
-from config import firebase_config, firebase_admin_config, gemini_api_key, flask_secret_key
-from string import Template
-import google.generativeai as genai
+import datetime
+import hashlib
+import secrets
+from config import firebase_config, flask_secret_key
+from config import chat_storage_mode, chat_history_page_size, chat_context_turns
+from config import chat_context_token_budget, chat_summary_batch
+from config import analysis_workers, analysis_queue_size, analysis_job_max_wait, cohort_workers, cohort_max_runs
+from config import auth_cache_size, auth_refresh_ahead
+from config import identity_toolkit_url, securetoken_url
+from config import direct_messages_page_size
+from config import search_index_path, search_sync_interval, search_page_size
+from config import message_stream_max_clients, message_stream_max_seconds
+from config import llm_chat_concurrency, llm_analysis_concurrency, admission_max_wait
+from config import gemini_flash_rpm, gemini_flash_tpm, gemini_pro_rpm, gemini_pro_tpm
+from config import gemini_rate_state_dir, gemini_queue_timeout, gemini_max_retries
+from config import gemini_cache_ttl, log_token_usage
+from config import metrics_token, metrics_public, access_log_json, span_sample_rate
 import traceback
+import chat_store
+import clients
+import context_builder
+import sse
+import analysis
+import cohort
+import jobs
+import auth_cache
+import http_client
+import direct_messages
+import message_hub
+import roster
+import search_index
+import admission
+import llm_scheduler
+import prompts
+import telemetry
+
+# Latency histograms per route and per dependency call, served at /metrics
+app_telemetry = telemetry.Telemetry(sample_rate=span_sample_rate, access_log_enabled=access_log_json)
+
+# Firebase is initialised, and the SDK imported, on the first database or auth call in each process
+db_ref = clients.Lazy(lambda: app_telemetry.trace_ref(clients.reference('/')))
 
-# Initialize Firebase Admin SDK
-cred = credentials.Certificate(firebase_admin_config)
-firebase_admin.initialize_app(cred, {
-    'databaseURL': firebase_config['databaseURL']
-})
+# Static prompts go out as system instructions (context-cached when enabled) and are
+# reloaded when the files change. The models only configure Gemini on their first call.
+chat_prompt = prompts.PromptFile(os.path.join(clients.BASE_DIR, 'system_prompt.md'),
+                                 fallback="You are a helpful assistant.")
+analysis_prompt = prompts.PromptFile(
+    os.path.join(clients.BASE_DIR, 'analysis_prompt.md'),
+    fallback="Analyze the patient's chat history and return the analysis as a single JSON object.")
+flash_chat_model = prompts.InstructedModel('gemini-2.5-flash', chat_prompt, cache_ttl=gemini_cache_ttl)
+flash_model = prompts.InstructedModel('gemini-2.5-flash')
+pro_model = prompts.InstructedModel('gemini-2.5-pro', analysis_prompt, cache_ttl=gemini_cache_ttl)
+if log_token_usage:
+    prompts.enable_usage_log()
 
-# Get a reference to the database service
-db_ref = db.reference('/')
+# All model calls share per-model quotas; patient chats are served before summaries and analyses
+llm = llm_scheduler.Scheduler(queue_timeout=gemini_queue_timeout, max_retries=gemini_max_retries)
+llm.set_limits(flash_model.model_name, gemini_flash_rpm, gemini_flash_tpm, state_dir=gemini_rate_state_dir)
+llm.set_limits(pro_model.model_name, gemini_pro_rpm, gemini_pro_tpm, state_dir=gemini_rate_state_dir)
+chat_model = llm.wrap(app_telemetry.trace_model(flash_chat_model), llm_scheduler.INTERACTIVE)
+summary_model = llm.wrap(app_telemetry.trace_model(flash_model), llm_scheduler.BACKGROUND)
+analysis_model = llm.wrap(app_telemetry.trace_model(pro_model), llm_scheduler.ANALYSIS)
 
-# Configure Gemini
-genai.configure(api_key=gemini_api_key)
-flash_model = genai.GenerativeModel('gemini-2.5-flash')
-pro_model = genai.GenerativeModel('gemini-2.5-pro')
+# Routes are registered on each app made by create_app()
+views = Blueprint('views', __name__)
 
-app = Flask(__name__)
-app.secret_key = flask_secret_key
+# Concurrency limits for the slow LLM-bound routes
+admission_control = admission.Admission()
+admission_control.add_gate('chat', llm_chat_concurrency, max_wait=admission_max_wait)
+analysis_gate = admission_control.add_gate('analysis', llm_analysis_concurrency, max_wait=admission_max_wait,
+                                           retry_after=15)
+admission_control.add_gate('cohort', cohort_max_runs, max_wait=0, retry_after=60)
 
-# Load the system prompt from the file
-try:
-    with open('system_prompt.md', 'r') as f:
-        system_prompt = f.read()
-except FileNotFoundError:
-    system_prompt = "You are a helpful assistant." # Fallback prompt
+# Doctors' full-text search; written through on every stored turn and message. Opened in each
+# process on first use, since an SQLite connection must not cross a fork.
+search = clients.Lazy(lambda: search_index.SearchIndex(search_index_path, sync_interval=search_sync_interval),
+                      'search_index')
+
+def index_safely(method, *args):
+    """Call ``search.<method>(*args)``. Search indexing must never fail the write it follows (even when
+    the index cannot be opened); a missed item is caught up later."""
+    try:
+        getattr(search, method)(*args)
+    except Exception:
+        app_telemetry.record_exception()
 
 # Security helper functions
 def sanitize_input(text):
@@ -57,18 +117,22 @@ def validate_password(password):
 
 def is_doctor_linked_to_patient(doctor_uid, patient_uid):
     try:
-        patient_data = db_ref.child("users").child(patient_uid).get()
-        if not patient_data:
+        # linkedDoctorUID is authoritative; the roster entry may be stale
+        linked = roster.linked_doctor(db_ref, patient_uid)
+        if linked is not None:
+            return linked == doctor_uid
+        # Patients who signed up with an invite code before the index are linked when it is built
+        if db_ref.child("doctors").child(doctor_uid).child(roster.BUILT_FLAG).get():
             return False
-        return patient_data.get('linkedDoctorUID') == doctor_uid
+        return patient_uid in roster.build_roster(db_ref, doctor_uid)
     except Exception:
         return False
 
-@app.route('/')
+@views.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/patient/signup', methods=['GET', 'POST'])
+@views.route('/patient/signup', methods=['GET', 'POST'])
 def patient_signup():
     if request.method == 'POST':
         email = sanitize_input(request.form.get('email', ''))
@@ -86,47 +150,119 @@ def patient_signup():
         if not is_valid:
             return password_msg, 400
         
+        admin_auth = clients.auth()
         try:
-            user = admin_auth.create_user(email=email, password=password)
+            with app_telemetry.span('auth', 'create_user'):
+                user = admin_auth.create_user(email=email, password=password)
             uid = user.uid
             data = { "fullname": fullname, "username": username, "email": email, "phone": phone, "invite_code": invite_code }
+            # User record and roster entry land in one multi-path update
+            updates = {f"users/{uid}": data}
             doctors_ref = db_ref.child("doctors").order_by_child("inviteCode").equal_to(invite_code).get()
             if doctors_ref:
                 doctor_uid = list(doctors_ref.keys())[0]
                 data['linkedDoctorUID'] = doctor_uid
-            db_ref.child("users").child(uid).set(data)
-            return redirect(url_for('patient_login'))
+                updates[f"doctors/{doctor_uid}/{roster.ROSTER_CHILD}/{uid}"] = roster.roster_entry(data)
+            db_ref.update(updates)
+            return redirect(url_for('views.patient_login'))
         except admin_auth.EmailAlreadyExistsError:
             return "An account with this email already exists. Please log in.", 409
         except Exception as e:
-            traceback.print_exc()
+            app_telemetry.record_exception()
             return "An unexpected error occurred during registration. Please try again.", 500
     return render_template('patient_signup.html')
 
 def sign_in_with_firebase(email, password):
-    rest_api_url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={firebase_config['apiKey']}"
+    rest_api_url = f"{identity_toolkit_url}/v1/accounts:signInWithPassword?key={firebase_config['apiKey']}"
     payload = {"email": email, "password": password, "returnSecureToken": True}
-    response = requests.post(rest_api_url, json=payload)
+    with app_telemetry.span('auth', 'sign_in'):
+        response = http_client.get_client().post(rest_api_url, json=payload)
+    response.raise_for_status()
+    return response.json()
+
+def refresh_firebase_token(refresh_token):
+    rest_api_url = f"{securetoken_url}/v1/token?key={firebase_config['apiKey']}"
+    payload = {"grant_type": "refresh_token", "refresh_token": refresh_token}
+    with app_telemetry.span('auth', 'refresh_token'):
+        response = http_client.get_client().post(rest_api_url, data=payload)
     response.raise_for_status()
     return response.json()
 
-@app.route('/patient/login', methods=['GET', 'POST'])
+# Decoded ID-token claims, reused until each token's exp
+token_cache = auth_cache.TokenCache(
+    app_telemetry.traced('auth', 'verify_id_token', lambda token: clients.auth().verify_id_token(token)),
+    maxsize=auth_cache_size)
+
+# Refresh tokens never leave the server: the session cookie only carries a random id, and the
+# token is kept at auth_sessions/<sha256(id)> (closed to clients by the database rules)
+AUTH_SESSIONS_NODE = 'auth_sessions'
+
+def auth_session_ref(sid):
+    return db_ref.child(AUTH_SESSIONS_NODE).child(hashlib.sha256(sid.encode('ascii')).hexdigest())
+
+def start_session(user, role):
+    end_session()
+    sid = secrets.token_urlsafe(32)
+    if user.get('refreshToken'):
+        auth_session_ref(sid).set({'refreshToken': user['refreshToken'], 'role': role,
+                                   'created': chat_store.SERVER_TIMESTAMP})
+    session['user'] = user['idToken']
+    session['sid'] = sid
+    session['token_expires'] = time.time() + int(user.get('expiresIn', 3600))
+    session['role'] = role
+
+def end_session():
+    """Clear the session cookie and drop its stored refresh token."""
+    sid = session.get('sid')
+    session.clear()
+    if sid:
+        try:
+            auth_session_ref(sid).delete()
+        except Exception:
+            app_telemetry.record_exception()
+
+def verify_session_token():
+    """Claims for the session's ID token, refreshing the token shortly before it expires."""
+    token = session['user']
+    if 'refresh_token' in session:
+        # Cookies from before refresh tokens moved server-side
+        session.pop('refresh_token')
+    if session.get('sid') and session.get('token_expires', 0) - time.time() < auth_refresh_ahead:
+        try:
+            stored_ref = auth_session_ref(session['sid'])
+            stored = stored_ref.get() or {}
+            if stored.get('refreshToken'):
+                refreshed = refresh_firebase_token(stored['refreshToken'])
+                token_cache.discard(token)
+                token = refreshed['id_token']
+                session['user'] = token
+                session['token_expires'] = time.time() + int(refreshed.get('expires_in', 3600))
+                if refreshed.get('refresh_token') not in (None, stored['refreshToken']):
+                    stored_ref.update({'refreshToken': refreshed['refresh_token']})
+        except requests.exceptions.RequestException:
+            # Keep using the current token; verification fails once it has actually expired
+            traceback.print_exc()
+    return token_cache.verify(token)
+
+@views.route('/patient/login', methods=['GET', 'POST'])
 def patient_login():
     if request.method == 'POST':
         email = sanitize_input(request.form.get('username', ''))
         password = request.form.get('password', '')
         try:
             user = sign_in_with_firebase(email, password)
-            session['user'] = user['idToken']
-            session['role'] = 'patient'
-            return redirect(url_for('patient_dashboard'))
+            start_session(user, 'patient')
+            return redirect(url_for('views.patient_dashboard'))
         except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code in http_client.RETRY_STATUSES:
+                return "The sign-in service is unavailable. Please try again.", 503
             return "Invalid credentials", 401
         except Exception as e:
+            app_telemetry.record_exception()
             return "An error occurred during login. Please try again.", 500
     return render_template('patient_login.html')
 
-@app.route('/doctor/login', methods=['GET', 'POST'])
+@views.route('/doctor/login', methods=['GET', 'POST'])
 def doctor_login():
     if request.method == 'POST':
         email = sanitize_input(request.form.get('username', ''))
@@ -136,119 +272,405 @@ def doctor_login():
             doctor_ref = db_ref.child("doctors").order_by_child("email").equal_to(email).get()
             if not doctor_ref:
                 return "Not a doctor account", 403
-            session['user'] = user['idToken']
-            session['role'] = 'doctor'
-            return redirect(url_for('doctor_dashboard'))
+            start_session(user, 'doctor')
+            return redirect(url_for('views.doctor_dashboard'))
         except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code in http_client.RETRY_STATUSES:
+                return "The sign-in service is unavailable. Please try again.", 503
             return "Invalid credentials", 401
         except Exception as e:
+            app_telemetry.record_exception()
             return "An error occurred during login. Please try again.", 500
     return render_template('doctor_login.html')
 
-@app.route('/patient/dashboard')
+@views.route('/patient/dashboard')
 def patient_dashboard():
     if 'user' in session and session.get('role') == 'patient':
         return render_template('patient_dashboard.html')
-    return redirect(url_for('patient_login'))
+    return redirect(url_for('views.patient_login'))
 
-@app.route('/doctor/dashboard')
+@views.route('/doctor/dashboard')
 def doctor_dashboard():
     if 'user' in session and session.get('role') == 'doctor':
         try:
-            user_info = admin_auth.verify_id_token(session['user'])
+            user_info = verify_session_token()
             doctor_uid = user_info['uid']
-            # Primary: patients explicitly linked to this doctor
-            patients = db_ref.child("users").order_by_child("linkedDoctorUID").equal_to(doctor_uid).get() or {}
-
-            # Fallback: if no explicit linkage yet, link via invite code match
-            if not patients:
-                invite_code = db_ref.child("doctors").child(doctor_uid).child("inviteCode").get()
-                if invite_code:
-                    via_code = db_ref.child("users").order_by_child("invite_code").equal_to(invite_code).get() or {}
-                    # Backfill linkage so future queries are fast and authorization works
-                    for uid in via_code.keys():
-                        try:
-                            db_ref.child("users").child(uid).update({"linkedDoctorUID": doctor_uid})
-                        except Exception:
-                            pass
-                    if via_code:
-                        patients = via_code
+            # Maintained roster index; built once for doctors that predate it
+            patients = roster.get_roster(db_ref, doctor_uid)
             return render_template('doctor_dashboard.html', patients=patients)
         except Exception as e:
-            session.clear()
-            return redirect(url_for('doctor_login'))
-    return redirect(url_for('doctor_login'))
+            end_session()
+            return redirect(url_for('views.doctor_login'))
+    return redirect(url_for('views.doctor_login'))
 
-@app.route('/logout')
+@views.route('/logout')
 def logout():
-    session.clear()
-    return redirect(url_for('index'))
+    end_session()
+    return redirect(url_for('views.index'))
 
-@app.route('/chat', methods=['POST'])
+def llm_overloaded_response(error):
+    response = jsonify({"error": "The assistant is busy. Please try again shortly."})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(error.retry_after))
+    return response
+
+@views.route('/chat', methods=['POST'])
+@admission_control.limit('chat')
 def chat():
     if 'user' not in session or session.get('role') != 'patient':
         return jsonify({"error": "Unauthorized"}), 401
     try:
         user_message = sanitize_input(request.json.get('message', ''))
-        user_info = admin_auth.verify_id_token(session['user'])
+        user_info = verify_session_token()
         uid = user_info['uid']
-        chat_history = db_ref.child("chats").child(uid).get() or []
-        # Construct a more sophisticated prompt using the system prompt
-        prompt = f"{system_prompt}\n\nHere is the conversation history (if any):\n{json.dumps(chat_history, indent=2)}\n\nPatient's new message: \"{user_message}\"\n\nAI:"
-        response = flash_model.generate_content(prompt)
+        # Rolling summary + the most recent turns that fit the budget
+        prompt, context_info = context_builder.build_chat_context(
+            db_ref, uid, user_message,
+            max_turns=chat_context_turns, token_budget=chat_context_token_budget)
+        response = chat_model.generate_content(prompt)
         ai_message = response.text
-        chat_history.append({"user": user_message, "ai": ai_message})
-        db_ref.child("chats").child(uid).set(chat_history)
+        ordinal = chat_store.append_turn(db_ref, uid, user_message, ai_message, mode=chat_storage_mode)
+        index_safely('add_chat_turn', uid, ordinal, user_message, ai_message)
+        context_builder.schedule_fold(db_ref, summary_model, uid, context_info, ordinal,
+                                      max_turns=chat_context_turns, fold_batch=chat_summary_batch)
+        # Context sizes are for clinicians (see /chat/context-stats), not part of the patient's reply
         return jsonify({"response": ai_message})
+    except llm_scheduler.Overloaded as e:
+        return llm_overloaded_response(e)
     except Exception as e:
+        app_telemetry.record_exception()
         return jsonify({"error": "An error occurred. Please try again."}), 500
 
-@app.route('/analyze-chats/<patient_uid>')
+@views.route('/chat/stream', methods=['POST'])
+@admission_control.limit('chat')
+def chat_stream():
+    """Same as /chat, but relays the model output as SSE ``chunk`` events.
+
+    The turn is stored once the stream finishes, followed by a ``done`` event;
+    failures are reported as an ``error`` event since headers are already sent.
+    """
+    if 'user' not in session or session.get('role') != 'patient':
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        user_message = sanitize_input(request.json.get('message', ''))
+        user_info = verify_session_token()
+        uid = user_info['uid']
+        prompt, context_info = context_builder.build_chat_context(
+            db_ref, uid, user_message,
+            max_turns=chat_context_turns, token_budget=chat_context_token_budget)
+    except Exception as e:
+        app_telemetry.record_exception()
+        return jsonify({"error": "An error occurred. Please try again."}), 500
+
+    def generate():
+        parts = []
+        try:
+            for chunk in chat_model.generate_content(prompt, stream=True):
+                text = chunk.text
+                if text:
+                    parts.append(text)
+                    yield sse.format_event({"text": text}, event='chunk')
+            ai_message = ''.join(parts)
+            ordinal = chat_store.append_turn(db_ref, uid, user_message, ai_message, mode=chat_storage_mode)
+            index_safely('add_chat_turn', uid, ordinal, user_message, ai_message)
+            context_builder.schedule_fold(db_ref, summary_model, uid, context_info, ordinal,
+                                          max_turns=chat_context_turns, fold_batch=chat_summary_batch)
+            yield sse.format_event({}, event='done')
+        except llm_scheduler.Overloaded as e:
+            yield sse.format_event({"error": "The assistant is busy. Please try again shortly.",
+                                    "retryAfter": e.retry_after}, event='error')
+        except Exception:
+            app_telemetry.record_exception()
+            yield sse.format_event({"error": "An error occurred. Please try again."}, event='error')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=sse.SSE_HEADERS)
+
+@views.route('/chat/context-stats')
+def chat_context_stats():
+    if 'user' not in session or session.get('role') != 'doctor':
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({
+        "maxTurns": chat_context_turns,
+        "tokenBudget": chat_context_token_budget,
+        "byHistoryLength": context_builder.prompt_stats.snapshot(),
+    })
+
+@views.route('/llm/stats')
+def llm_stats():
+    if 'user' not in session or session.get('role') != 'doctor':
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({
+        "scheduler": llm.stats(),
+        "usage": {
+            "chat": flash_chat_model.stats(),
+            "summary": flash_model.stats(),
+            "analysis": pro_model.stats(),
+        },
+    })
+
+# Only the Pro call of a synchronous analysis takes a slot; cached analyses are served regardless
+gated_analysis_model = admission.GatedModel(analysis_model, analysis_gate)
+
+@views.route('/analyze-chats/<patient_uid>')
 def analyze_chats(patient_uid):
     if 'user' not in session or session.get('role') != 'doctor':
         return jsonify({"error": "Unauthorized"}), 401
     try:
-        user_info = admin_auth.verify_id_token(session['user'])
+        user_info = verify_session_token()
+        doctor_uid = user_info['uid']
+        if not is_doctor_linked_to_patient(doctor_uid, patient_uid):
+            return jsonify({"error": "Access denied"}), 403
+        # Cached when the chat is unchanged, incremental when turns were only appended
+        refresh = request.args.get('refresh') == '1'
+        analysis_data, info = analysis.analyze(db_ref, gated_analysis_model, patient_uid, refresh=refresh)
+        response = jsonify(dict(analysis_data, meta=info))
+        response.headers['X-Analysis-Mode'] = info['mode']
+        if info.get('narrativeError') == admission.Busy.__name__:
+            # Charts and the last narrative only; the summary can be retried once a slot frees up
+            response.headers['Retry-After'] = str(analysis_gate.retry_after)
+        return response
+    except Exception as e:
+        app_telemetry.record_exception()
+        return jsonify({"error": "An error occurred during analysis."}), 500
+
+# How long another worker's claim on a patient's analysis is honoured
+ANALYSIS_JOB_CLAIM_TTL = 300
+
+def persist_analysis_job(job):
+    """Mirror job state into RTDB so any worker can answer status polls."""
+    record = job.to_dict(include_result=False)
+    if job.status == jobs.DONE and isinstance(job.result, dict):
+        record['resultMeta'] = job.result.get('meta')
+    db_ref.child("analysis_jobs").child(job.id).set(record)
+    if job.status not in jobs.ACTIVE_STATES:
+        claim_ref = db_ref.child("analysis_jobs_active").child(job.info['patientUid'])
+        claim = claim_ref.get() or {}
+        if claim.get('jobId') == job.id:
+            claim_ref.delete()
+    if job.duration is not None:
+        analysis_job_seconds.observe((job.status,), job.duration)
+
+def forget_analysis_job(job):
+    db_ref.child("analysis_jobs").child(job.id).delete()
+
+def sweep_analysis_jobs():
+    """Delete mirrored jobs and claims that no live worker will expire, e.g. those of a restarted worker."""
+    now = time.time()
+    # Past the keep time, counted from the end of a run or, for a job whose worker died, its creation
+    cutoff = now - analysis_jobs.keep_finished - ANALYSIS_JOB_CLAIM_TTL
+    records = db_ref.child("analysis_jobs").order_by_child('created').end_at(cutoff).get() or {}
+    stale = {f'analysis_jobs/{job_id}': None for job_id, record in records.items()
+             if analysis_jobs.get(job_id) is None and (record.get('finished') or record.get('created') or 0) < cutoff}
+    claims = db_ref.child("analysis_jobs_active").order_by_child('expires').end_at(now).get() or {}
+    stale.update({f'analysis_jobs_active/{patient_uid}': None for patient_uid in claims})
+    if stale:
+        db_ref.update(stale)
+
+analysis_jobs = jobs.JobQueue(max_workers=analysis_workers, max_queued=analysis_queue_size,
+                              on_update=persist_analysis_job, on_expire=forget_analysis_job,
+                              name='analysis', sweep=sweep_analysis_jobs)
+analysis_job_seconds = app_telemetry.add_histogram(
+    'analysis_job_duration_seconds', 'Run time of analysis jobs by outcome.', ('status',),
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300))
+
+def analysis_job_response(record, result=None):
+    body = {k: record.get(k) for k in ('jobId', 'status', 'created', 'started', 'finished')}
+    if record.get('status') == jobs.ERROR:
+        body['error'] = "An error occurred during analysis."
+    if result is not None:
+        body['result'] = result
+    return jsonify(body)
+
+@views.route('/analyze-chats/<patient_uid>/jobs', methods=['POST'])
+def submit_analysis_job(patient_uid):
+    if 'user' not in session or session.get('role') != 'doctor':
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        user_info = verify_session_token()
         doctor_uid = user_info['uid']
         if not is_doctor_linked_to_patient(doctor_uid, patient_uid):
             return jsonify({"error": "Access denied"}), 403
-        chat_history = db_ref.child("chats").child(patient_uid).get()
-        if not chat_history:
-            return jsonify({
-                "summary": "No chat history.",
-                "moodTimeline": {"labels": [], "data": []},
-                "activity": {"labels": [], "data": []},
-                "urgencyDistribution": {"labels": ["Low", "Medium", "High"], "data": [0,0,0]},
-                "emotionRadar": {"labels": ["Joy","Anger","Sadness","Anxiety","Surprise"], "data": [0,0,0,0,0]},
-                "highlights": [],
-                "criticalFlags": [],
-                "keywords": [],
-                "emojiCloud": []
-            })
-
-        chat_history_json = json.dumps(chat_history, ensure_ascii=False)
-        # Use the system prompt for analysis
-        prompt_tpl = Template(system_prompt)
-        prompt = prompt_tpl.substitute(CHAT=chat_history_json)
-        response = pro_model.generate_content(prompt)
-        raw = response.text.strip()
-        # Remove accidental code fences
-        if raw.startswith('```'):
-            raw = raw.strip('`')
-            raw = raw.replace('json', '', 1).strip()
-        analysis_data = json.loads(raw)
-        db_ref.child("analysis").child(patient_uid).set(analysis_data)
-        return jsonify(analysis_data)
+        refresh = request.args.get('refresh') == '1'
+        # Another worker may already be analysing this patient (best-effort, claim expires)
+        claim_ref = db_ref.child("analysis_jobs_active").child(patient_uid)
+        claim = claim_ref.get() or {}
+        # A running refresh also answers a plain request, but not the other way round
+        if claim.get('expires', 0) > time.time() and analysis_jobs.get(claim.get('jobId')) is None \
+                and (claim.get('refresh') or not refresh):
+            record = db_ref.child("analysis_jobs").child(claim['jobId']).get()
+            if record and record.get('status') in jobs.ACTIVE_STATES:
+                return analysis_job_response(record), 202
+
+        def run():
+            data, info = analysis.analyze(db_ref, analysis_model, patient_uid, refresh=refresh)
+            return dict(data, meta=info)
+
+        # A refresh must not be answered by a plain job that may reuse the stale analysis
+        key = f'{patient_uid}:refresh' if refresh else patient_uid
+        job, created = analysis_jobs.submit(key, run, info={'patientUid': patient_uid, 'refresh': refresh})
+        if created:
+            claim_ref.set({'jobId': job.id, 'refresh': refresh, 'expires': time.time() + ANALYSIS_JOB_CLAIM_TTL})
+        return analysis_job_response(job.to_dict(include_result=False)), 202
+    except jobs.QueueFull:
+        return jsonify({"error": "Too many analyses in progress. Please try again shortly."}), 503, {"Retry-After": "10"}
     except Exception as e:
-        traceback.print_exc()
+        app_telemetry.record_exception()
         return jsonify({"error": "An error occurred during analysis."}), 500
 
-@app.route('/send-direct-message/<patient_uid>', methods=['POST'])
+@views.route('/analysis-jobs/<job_id>')
+def get_analysis_job(job_id):
+    if 'user' not in session or session.get('role') != 'doctor':
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        user_info = verify_session_token()
+        doctor_uid = user_info['uid']
+        wait = max(0.0, min(request.args.get('wait', 0, type=float), analysis_job_max_wait))
+        job = analysis_jobs.get(job_id)
+        if job is not None:
+            if not is_doctor_linked_to_patient(doctor_uid, job.info['patientUid']):
+                return jsonify({"error": "Access denied"}), 403
+            analysis_jobs.wait(job_id, wait)
+            return analysis_job_response(job.to_dict(include_result=False), job.result if job.status == jobs.DONE else None)
+
+        # Job owned by another worker: answer from its mirrored record right away; the client polls again
+        record = db_ref.child("analysis_jobs").child(job_id).get()
+        if not record:
+            return jsonify({"error": "Job not found"}), 404
+        patient_uid = record.get('info', {}).get('patientUid')
+        if not is_doctor_linked_to_patient(doctor_uid, patient_uid):
+            return jsonify({"error": "Access denied"}), 403
+        result = None
+        if record.get('status') == jobs.DONE:
+            result = dict(db_ref.child("analysis").child(patient_uid).get() or {}, meta=record.get('resultMeta'))
+        return analysis_job_response(record, result)
+    except Exception as e:
+        app_telemetry.record_exception()
+        return jsonify({"error": "An error occurred while fetching the job."}), 500
+
+@views.route('/analysis-jobs/stats')
+def analysis_job_stats():
+    if 'user' not in session or session.get('role') != 'doctor':
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(analysis_jobs.stats())
+
+@views.route('/doctor/cohort-analysis')
+@admission_control.limit('cohort')
+def cohort_analysis():
+    """SSE: analyse every patient on the roster, one event per patient, then the triage view."""
+    if 'user' not in session or session.get('role') != 'doctor':
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        user_info = verify_session_token()
+        doctor_uid = user_info['uid']
+        patients = roster.linked_roster(db_ref, doctor_uid, roster.get_roster(db_ref, doctor_uid))
+    except Exception:
+        app_telemetry.record_exception()
+        return jsonify({"error": "An error occurred during analysis."}), 500
+    refresh = request.args.get('refresh') == '1'
+
+    def generate():
+        started = time.perf_counter()
+        yield sse.format_event({'total': len(patients), 'workers': cohort_workers}, event='start')
+        entries = []
+        # Patients whose chat is unchanged are skipped; the rest share the Pro quota at analysis priority
+        for entry in cohort.analyze_roster(db_ref, analysis_model, list(patients), workers=cohort_workers,
+                                           refresh=refresh):
+            entries.append(entry)
+            name = (patients.get(entry['uid']) or {}).get('fullname') or entry['uid']
+            yield sse.format_event(dict(entry, name=name, done=len(entries), total=len(patients)),
+                                   event='patient')
+        yield sse.format_event({
+            'triage': cohort.triage_rows(entries, patients),
+            'counts': cohort.counts(entries),
+            'elapsedMs': round((time.perf_counter() - started) * 1000, 1),
+        }, event='done')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=sse.SSE_HEADERS)
+
+@views.route('/doctor/triage')
+def doctor_triage():
+    """Triage view from the stored analyses only (e.g. pre-warmed by cohort_analysis.py)."""
+    if 'user' not in session or session.get('role') != 'doctor':
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        user_info = verify_session_token()
+        doctor_uid = user_info['uid']
+        patients = roster.linked_roster(db_ref, doctor_uid, roster.get_roster(db_ref, doctor_uid))
+        entries = cohort.stored_roster(db_ref, list(patients))
+        return jsonify({'triage': cohort.triage_rows(entries, patients), 'counts': cohort.counts(entries)})
+    except Exception:
+        app_telemetry.record_exception()
+        return jsonify({"error": "An error occurred while building the triage view."}), 500
+
+def parse_day(value, end=False):
+    """``YYYY-MM-DD`` (UTC) as epoch ms: the start of that day, or the start of the next with ``end``."""
+    if not value:
+        return None
+    day = datetime.datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+    if end:
+        day += datetime.timedelta(days=1)
+    return int(day.timestamp() * 1000)
+
+@views.route('/doctor/search')
+def doctor_search():
+    """Search the doctor's patients' chats and messages: q, kind, patient, from, to, page, pageSize."""
+    if 'user' not in session or session.get('role') != 'doctor':
+        return jsonify({"error": "Unauthorized"}), 401
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('kind') or None
+    if kind and kind not in search_index.KINDS:
+        return jsonify({"error": "kind must be chat or message"}), 400
+    try:
+        since = parse_day(request.args.get('from'))
+        until = parse_day(request.args.get('to'), end=True)
+    except ValueError:
+        return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+    page = max(1, request.args.get('page', 1, type=int))
+    page_size = max(1, min(request.args.get('pageSize', 20, type=int), search_page_size))
+    if not search_index.build_match(query):
+        return jsonify({"error": "Enter at least one word to search for"}), 400
+    try:
+        started = time.perf_counter()
+        user_info = verify_session_token()
+        doctor_uid = user_info['uid']
+        patients = roster.get_roster(db_ref, doctor_uid)
+        scope = list(patients)
+        patient_uid = request.args.get('patient')
+        if patient_uid:
+            if patient_uid not in roster.linked_roster(db_ref, doctor_uid, patients, [patient_uid]):
+                return jsonify({"error": "Access denied"}), 403
+            scope = [patient_uid]
+        # Catch up on writes made by other workers; a no-op for recently synced patients
+        synced = search.refresh(db_ref, scope)
+        while True:
+            results, total = search.search(scope, query, kind=kind, since_ms=since, until_ms=until,
+                                           limit=page_size, offset=(page - 1) * page_size)
+            # Only the patients on this page are checked; search again without any stale roster entries
+            linked = roster.linked_roster(db_ref, doctor_uid, patients, [r['patientUid'] for r in results])
+            if len(linked) == len(patients):
+                break
+            patients = linked
+            scope = [uid for uid in scope if uid in patients]
+        for result in results:
+            result['name'] = (patients.get(result['patientUid']) or {}).get('fullname') or result['patientUid']
+        return jsonify({
+            "results": results,
+            "total": total,
+            "page": page,
+            "pageSize": page_size,
+            "synced": synced,
+            "tookMs": round((time.perf_counter() - started) * 1000, 1),
+        })
+    except Exception:
+        app_telemetry.record_exception()
+        return jsonify({"error": "An error occurred while searching."}), 500
+
+@views.route('/send-direct-message/<patient_uid>', methods=['POST'])
 def send_direct_message(patient_uid):
     if 'user' not in session or session.get('role') != 'doctor':
         return jsonify({"error": "Unauthorized"}), 401
     try:
-        user_info = admin_auth.verify_id_token(session['user'])
+        user_info = verify_session_token()
         doctor_uid = user_info['uid']
         if not is_doctor_linked_to_patient(doctor_uid, patient_uid):
             return jsonify({"error": "Access denied"}), 403
@@ -256,84 +678,252 @@ def send_direct_message(patient_uid):
         if not message:
             return jsonify({"error": "Message cannot be empty"}), 400
         message_data = {"from": doctor_uid, "message": message, "timestamp": {".sv": "timestamp"}}
-        db_ref.child("direct_messages").child(patient_uid).push(message_data)
+        key = direct_messages.send(db_ref, patient_uid, message_data)
+        index_safely('add_message', patient_uid, key, doctor_uid, message)
         return jsonify({"success": True})
     except Exception as e:
+        app_telemetry.record_exception()
         return jsonify({"error": "An error occurred while sending the message."}), 500
 
-@app.route('/send-message-to-doctor', methods=['POST'])
+@views.route('/send-message-to-doctor', methods=['POST'])
 def send_message_to_doctor():
     if 'user' not in session or session.get('role') != 'patient':
         return jsonify({"error": "Unauthorized"}), 401
     try:
-        user_info = admin_auth.verify_id_token(session['user'])
+        user_info = verify_session_token()
         patient_uid = user_info['uid']
         message = sanitize_input(request.json.get('message', ''))
         if not message:
             return jsonify({"error": "Message cannot be empty"}), 400
         # Lookup linked doctor
-        user_record = db_ref.child("users").child(patient_uid).get() or {}
-        doctor_uid = user_record.get('linkedDoctorUID')
+        doctor_uid = db_ref.child("users").child(patient_uid).child("linkedDoctorUID").get()
         if not doctor_uid:
             return jsonify({"error": "No linked doctor found for this patient."}), 400
         # Store message in the same thread under patient's node
-        db_ref.child("direct_messages").child(patient_uid).push({
+        key = direct_messages.send(db_ref, patient_uid, {
             'from': patient_uid,
             'message': message,
             'timestamp': {'.sv': 'timestamp'}
         })
+        index_safely('add_message', patient_uid, key, patient_uid, message)
         return jsonify({"success": True})
     except Exception:
+        app_telemetry.record_exception()
         return jsonify({"error": "An error occurred while sending the message."}), 500
-@app.route('/get-direct-messages')
+def direct_messages_response(patient_uid):
+    """Thread slice for ?since=<push-id|timestamp>&limit=N, with ETag/304 support."""
+    since = request.args.get('since') or None
+    limit = request.args.get('limit', direct_messages_page_size, type=int)
+    limit = max(1, min(limit, direct_messages_page_size))
+    message_list, cursor = direct_messages.fetch_messages(db_ref, patient_uid, since=since, limit=limit)
+    response = jsonify(message_list)
+    if cursor:
+        response.headers['X-Cursor'] = cursor
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(direct_messages.etag_for(patient_uid, since, message_list), weak=True)
+    return response.make_conditional(request)
+
+# Seconds between SSE heartbeats on idle message streams
+MESSAGE_STREAM_HEARTBEAT = 15
+
+# One RTDB listener per process, fanned out to the open message streams
+direct_message_hub = message_hub.MessageHub(
+    clients.Lazy(lambda: db_ref.child(direct_messages.LATEST_NODE)), max_subscribers=message_stream_max_clients,
+    backfill=lambda thread_id, since: direct_messages.fetch_messages(
+        db_ref, thread_id, since=since, limit=direct_messages_page_size)[0])
+
+def direct_message_stream(patient_uid):
+    """SSE stream of new messages in a thread, resuming after Last-Event-ID."""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    try:
+        subscription = direct_message_hub.subscribe(patient_uid)
+    except Exception:
+        # The RTDB listener could not be opened; the browser polls instead, as when the hub is full
+        app_telemetry.record_exception()
+        return jsonify({"error": "Live updates are unavailable; falling back to polling."}), 503, {"Retry-After": "30"}
+    if subscription is None:
+        return jsonify({"error": "Live updates are busy; falling back to polling."}), 503, {"Retry-After": "30"}
+    try:
+        backlog = []
+        if last_event_id:
+            backlog, _ = direct_messages.fetch_messages(db_ref, patient_uid, since=last_event_id,
+                                                        limit=direct_messages_page_size)
+    except Exception:
+        subscription.close()
+        raise
+
+    def generate():
+        try:
+            yield sse.retry(3000)
+            sent = set()
+            for msg in backlog:
+                sent.add(msg['id'])
+                yield sse.format_event(msg, event='message', event_id=msg['id'])
+            # Streams are recycled so a gthread worker is never held indefinitely
+            deadline = time.time() + message_stream_max_seconds
+            while time.time() < deadline:
+                msg = subscription.get(timeout=MESSAGE_STREAM_HEARTBEAT)
+                if msg is None:
+                    yield sse.comment()
+                elif msg['id'] not in sent:
+                    yield sse.format_event(msg, event='message', event_id=msg['id'])
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=sse.SSE_HEADERS)
+
+@views.route('/direct-messages/stream')
+def stream_direct_messages():
+    if 'user' not in session or session.get('role') != 'patient':
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        user_info = verify_session_token()
+        return direct_message_stream(user_info['uid'])
+    except Exception as e:
+        app_telemetry.record_exception()
+        return jsonify({"error": "An error occurred while fetching messages."}), 500
+
+@views.route('/doctor/messages/<patient_uid>/stream')
+def stream_patient_thread(patient_uid):
+    if 'user' not in session or session.get('role') != 'doctor':
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        user_info = verify_session_token()
+        doctor_uid = user_info['uid']
+        if not is_doctor_linked_to_patient(doctor_uid, patient_uid):
+            return jsonify({"error": "Access denied"}), 403
+        return direct_message_stream(patient_uid)
+    except Exception as e:
+        app_telemetry.record_exception()
+        return jsonify({"error": "An error occurred while fetching messages."}), 500
+
+@views.route('/get-direct-messages')
 def get_direct_messages():
     if 'user' not in session or session.get('role') != 'patient':
         return jsonify({"error": "Unauthorized"}), 401
     try:
-        user_info = admin_auth.verify_id_token(session['user'])
+        user_info = verify_session_token()
         patient_uid = user_info['uid']
-        # Be defensive: result can be dict keyed by push-id or a list
-        raw = db_ref.child("direct_messages").child(patient_uid).get()
-        message_list = []
-        if isinstance(raw, dict):
-            for _, msg in raw.items():
-                if isinstance(msg, dict):
-                    msg.setdefault('timestamp', 0)
-                    message_list.append(msg)
-        elif isinstance(raw, list):
-            for msg in raw:
-                if isinstance(msg, dict):
-                    msg.setdefault('timestamp', 0)
-                    message_list.append(msg)
-        # Sort ascending by timestamp
-        message_list.sort(key=lambda m: m.get('timestamp', 0))
-        return jsonify(message_list)
+        return direct_messages_response(patient_uid)
     except Exception as e:
+        app_telemetry.record_exception()
+        return jsonify({"error": "An error occurred while fetching messages."}), 500
+
+@views.route('/doctor/messages/<patient_uid>')
+def get_patient_thread(patient_uid):
+    if 'user' not in session or session.get('role') != 'doctor':
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        user_info = verify_session_token()
+        doctor_uid = user_info['uid']
+        if not is_doctor_linked_to_patient(doctor_uid, patient_uid):
+            return jsonify({"error": "Access denied"}), 403
+        return direct_messages_response(patient_uid)
+    except Exception as e:
+        app_telemetry.record_exception()
         return jsonify({"error": "An error occurred while fetching messages."}), 500
 
 
-@app.route('/chat/history')
+@views.route('/chat/history')
 def get_chat_history():
     if 'user' not in session or session.get('role') != 'patient':
         return jsonify({"error": "Unauthorized"}), 401
     try:
-        user_info = admin_auth.verify_id_token(session['user'])
+        user_info = verify_session_token()
         uid = user_info['uid']
-        chat_history = db_ref.child("chats").child(uid).get() or []
-        # Ensure array of {user, ai} objects
-        if isinstance(chat_history, dict):
-            # If stored as dict (by index), convert to list preserving order
-            chat_history = [chat_history[k] for k in sorted(chat_history.keys(), key=lambda x: int(x) if str(x).isdigit() else x)]
+        limit = request.args.get('limit', chat_history_page_size, type=int)
+        limit = max(1, min(limit, chat_history_page_size))
+        before = request.args.get('before') or None
+        # Newest page first; older pages are reached through the X-Next-Before cursor
+        chat_history, cursor = chat_store.turns_page(db_ref, uid, limit, before=before)
         # Sanitize to only allow 'user' and 'ai' keys
-        clean = []
-        for item in chat_history:
-            if isinstance(item, dict):
-                clean.append({k: item.get(k) for k in ['user', 'ai'] if k in item})
-        return jsonify(clean)
+        clean = [chat_store.clean_turn(item, ('user', 'ai')) for item in chat_history]
+        response = jsonify(clean)
+        if cursor:
+            response.headers['X-Next-Before'] = cursor
+        return response
     except Exception:
+        app_telemetry.record_exception()
         return jsonify({"error": "An error occurred while fetching chat history."}), 500
 
+# In-process stats, exported next to the latency histograms
+app_telemetry.add_collector(
+    'admission_in_flight', 'gauge', 'Requests holding an admission slot.', ('gate',),
+    lambda: [((name,), g['inFlight']) for name, g in admission_control.stats().items()])
+app_telemetry.add_collector(
+    'admission_rejected_total', 'counter', 'Requests turned away with 503 by admission control.', ('gate',),
+    lambda: [((name,), g['rejected']) for name, g in admission_control.stats().items()])
+app_telemetry.add_collector(
+    'analysis_jobs', 'gauge', 'Analysis jobs by state in this process (queued is the queue depth).', ('state',),
+    lambda: [((state,), analysis_jobs.stats()[state]) for state in ('queued', 'running')])
+app_telemetry.add_collector(
+    'analysis_jobs_total', 'counter', 'Analysis job submissions and outcomes in this process.', ('event',),
+    lambda: [((event,), analysis_jobs.stats()['counts'].get(event, 0))
+             for event in ('submitted', 'deduplicated', 'rejected', 'completed', 'failed')])
+app_telemetry.add_collector(
+    'message_stream_subscribers', 'gauge', 'Open direct-message SSE streams.', (),
+    lambda: [((), direct_message_hub.stats()['subscribers'])])
+app_telemetry.add_collector(
+    'search_index_documents', 'gauge', 'Chat turns and direct messages in the search index.', ('kind',),
+    lambda: [((kind,), n) for kind, n in search.stats()['documents'].items()])
+app_telemetry.add_collector(
+    'token_cache_requests_total', 'counter', 'ID-token verifications by cache result.', ('result',),
+    lambda: [(('hit',), token_cache.stats()['hits']), (('miss',), token_cache.stats()['misses'])])
+
+def llm_scheduler_samples(field):
+    for model_name, classes in llm.stats().items():
+        for priority, row in classes.items():
+            if priority != 'limits':
+                yield (model_name, priority), row[field]
+
+for field, kind, help_text in (('requests', 'counter', 'LLM calls started.'),
+                               ('retries', 'counter', 'LLM calls retried after 429/503.'),
+                               ('throttled', 'counter', 'LLM calls that found no quota in time.'),
+                               ('queued', 'gauge', 'LLM calls waiting for quota.')):
+    app_telemetry.add_collector(f'llm_scheduler_{field}' + ('_total' if kind == 'counter' else ''), kind,
+                                help_text, ('model', 'priority'),
+                                lambda field=field: llm_scheduler_samples(field))
+
+app_telemetry.add_collector(
+    'llm_tokens_total', 'counter', 'Tokens reported by the model, by use and kind.', ('use', 'kind'),
+    lambda: [((use, kind), model.stats()[key])
+             for use, model in (('chat', flash_chat_model), ('summary', flash_model), ('analysis', pro_model))
+             for kind, key in (('prompt', 'promptTokens'), ('cached', 'cachedTokens'), ('output', 'outputTokens'))])
+app_telemetry.add_collector(
+    'chat_prompt_tokens_max', 'gauge', 'Largest chat prompt by history length.', ('history',),
+    lambda: [((label,), b['maxTokens']) for label, b in context_builder.prompt_stats.snapshot().items()])
+app_telemetry.add_collector(
+    'startup_seconds', 'gauge', 'Time spent importing the app and creating each client in this process.',
+    ('phase',), lambda: [((phase,), seconds) for phase, seconds in clients.startup.items()])
+
+clients.record('app_import', time.perf_counter() - _import_started)
+_startup_reported = None
+
+def report_startup(response):
+    """Print the import and client setup costs once per process, after its first response."""
+    global _startup_reported
+    if _startup_reported != os.getpid():
+        _startup_reported = os.getpid()
+        clients.record('first_request', time.perf_counter() - _import_started)
+        print(f"startup pid={os.getpid()} {clients.report()}", file=sys.stderr, flush=True)
+    return response
+
+def create_app():
+    """The WSGI app. Cheap: Firebase, Gemini and the search index are created on first use."""
+    app = Flask(__name__)
+    app.secret_key = flask_secret_key
+    app_telemetry.init_app(app, token=metrics_token, public=metrics_public)
+    app.register_blueprint(views)
+    app.after_request(report_startup)
+    return app
+
+# The one app of each process, served with "gunicorn app:app" and used by benchmark.py and tests.
+# Call create_app() only for a separate app (e.g. a test with its own config): each call registers
+# the routes and the /metrics hooks again.
+app = create_app()
+
 if __name__ == '__main__':
-    import os
+    import config
+    config.validate()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,56 @@
+"""In-memory cache of verified Firebase ID-token claims.
+
+``verify_id_token`` checks the token signature against Google's public certs
+on every call.  Tokens are immutable and carry their own ``exp``, so once a
+token has been verified its decoded claims can be reused until it expires.
+"""
+
+import collections
+import threading
+import time
+from typing import Callable
+
+# Stop serving cached claims this many seconds before ``exp`` to absorb clock skew
+EXPIRY_MARGIN = 30
+
+
+class TokenCache:
+    """Bounded LRU of ``token -> claims``, each entry valid until the token's ``exp``."""
+
+    def __init__(self, verify: Callable[[str], dict], maxsize: int = 4096):
+        self._verify = verify
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, token: str) -> dict:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                expires, claims = entry
+                if expires > now:
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return dict(claims)
+                del self._entries[token]
+            self.misses += 1
+        claims = self._verify(token)
+        expires = claims.get('exp', 0) - EXPIRY_MARGIN
+        if expires > now:
+            with self._lock:
+                self._entries[token] = (expires, dict(claims))
+                self._entries.move_to_end(token)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return claims
+
+    def discard(self, token: str) -> None:
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,265 @@
+"""Throughput and latency of the hot routes, against in-process fakes.
+
+Drives the real Flask routes through test clients, one per worker thread,
+with Firebase and Gemini replaced by ``fakes`` (RTDB, admin_auth, a local
+Identity Toolkit server and a fake GenerativeModel with configurable latency
+and output size).  Every route is measured at each concurrency level and
+history length; results can be saved as a baseline and later runs compared
+against it.
+
+    python benchmark.py --concurrency 1,8,32 --history 0,200,1000 --requests 300
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --compare bench_baseline.json --tolerance 0.25
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import fakes
+
+ROUTES = ('login', 'chat', 'history', 'direct_messages', 'analyze', 'analyze_full', 'dashboard')
+PASSWORD = 'Bench-pass1'
+INVITE_CODE = 'BENCH1'
+DOCTOR_EMAIL = 'doctor@bench.test'
+HOUR_MS = 3600 * 1000
+SAMPLE_MESSAGES = (
+    "I couldn't sleep again last night and I feel anxious 😔",
+    "Today was a bit better, I went for a walk and felt calm.",
+    "Work is stressful and I keep worrying about everything.",
+    "I'm grateful my sister called, it made me happy 😊",
+)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class Bench:
+    def __init__(self, app_module, installed: fakes.Installed, patients: int, messages: int):
+        self.app_module = app_module
+        self.app = app_module.app
+        self.installed = installed
+        self.patients = patients
+        self.messages = messages
+        self.patient_uids = []
+        self.doctor_uid = None
+        auth = installed.auth
+        self.doctor_uid = auth.create_user(email=DOCTOR_EMAIL, password=PASSWORD).uid
+        for i in range(patients):
+            self.patient_uids.append(auth.create_user(email=self.patient_email(i), password=PASSWORD).uid)
+
+    @staticmethod
+    def patient_email(i: int) -> str:
+        return f'patient{i}@bench.test'
+
+    def seed(self, history: int) -> None:
+        """Reset the fake RTDB to one doctor, their patients, ``history`` turns and some messages each."""
+        import chat_store
+        import direct_messages
+        import roster
+
+        store = self.installed.store
+        with store._lock:
+            store.root = {}
+        ref = self.app_module.db_ref
+        now = int(time.time() * 1000)
+        # Keys follow the timestamps, as real push ids do, so ?since= cursors behave as in production
+        rng = random.Random(history)
+        doctor = {'email': DOCTOR_EMAIL, 'inviteCode': INVITE_CODE, roster.BUILT_FLAG: True,
+                  roster.ROSTER_CHILD: {}}
+        updates = {f'doctors/{self.doctor_uid}': doctor}
+        for i, uid in enumerate(self.patient_uids):
+            record = {'fullname': f'Patient {i}', 'email': self.patient_email(i), 'invite_code': INVITE_CODE}
+            updates[f'users/{uid}'] = dict(record, linkedDoctorUID=self.doctor_uid)
+            doctor[roster.ROSTER_CHILD][uid] = roster.roster_entry(record)
+            updates[f'direct_messages/{uid}'] = {
+                direct_messages.push_key(now - n * HOUR_MS, rng): {
+                    'from': self.doctor_uid, 'message': f'Check-in {n}', 'timestamp': now - n * HOUR_MS}
+                for n in range(self.messages)} or None
+        ref.update(updates)
+        for uid in self.patient_uids:
+            turns = [{'user': SAMPLE_MESSAGES[n % len(SAMPLE_MESSAGES)], 'ai': 'Thank you for sharing that.',
+                      'timestamp': now - (history - n) * HOUR_MS} for n in range(history)]
+            chat_store.replace_turns(ref, uid, turns)
+
+    def client(self, role: Optional[str] = None, index: int = 0):
+        client = self.app.test_client()
+        if role == 'patient':
+            email = self.patient_email(index % self.patients)
+            client.post('/patient/login', data={'username': email, 'password': PASSWORD})
+        elif role == 'doctor':
+            client.post('/doctor/login', data={'username': DOCTOR_EMAIL, 'password': PASSWORD})
+        return client
+
+    def scenario(self, route: str):
+        """``(role, request(client, worker_index))`` for a route."""
+        patient = lambda i: self.patient_uids[i % self.patients]
+        scenarios: Dict[str, tuple] = {
+            'login': (None, lambda c, i: c.post('/patient/login', data={
+                'username': self.patient_email(i % self.patients), 'password': PASSWORD})),
+            'chat': ('patient', lambda c, i: c.post('/chat', json={'message': SAMPLE_MESSAGES[i % 4]})),
+            'history': ('patient', lambda c, i: c.get('/chat/history')),
+            'direct_messages': ('patient', lambda c, i: c.get('/get-direct-messages')),
+            'analyze': ('doctor', lambda c, i: c.get(f'/analyze-chats/{patient(i)}')),
+            'analyze_full': ('doctor', lambda c, i: c.get(f'/analyze-chats/{patient(i)}?refresh=1')),
+            'dashboard': ('doctor', lambda c, i: c.get('/doctor/dashboard')),
+        }
+        return scenarios[route]
+
+    def run(self, route: str, concurrency: int, total: int) -> dict:
+        role, send = self.scenario(route)
+        clients = [self.client(role, i) for i in range(concurrency)]
+        latencies = []
+        statuses = collections.Counter()
+        lock = threading.Lock()
+        tickets = itertools.count()
+
+        def worker(index: int) -> None:
+            client = clients[index]
+            while next(tickets) < total:
+                started = time.perf_counter()
+                response = send(client, index)
+                response.get_data()
+                elapsed = time.perf_counter() - started
+                response.close()
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[response.status_code] += 1
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        latencies.sort()
+        ok = sum(n for status, n in statuses.items() if status < 400)
+        return {
+            'route': route,
+            'concurrency': concurrency,
+            'requests': len(latencies),
+            'errors': len(latencies) - ok,
+            'statuses': {str(k): v for k, v in sorted(statuses.items())},
+            'rps': round(len(latencies) / wall, 1) if wall else 0.0,
+            'meanMs': round(1000 * sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            'p50Ms': round(1000 * percentile(latencies, 0.50), 2),
+            'p95Ms': round(1000 * percentile(latencies, 0.95), 2),
+            'p99Ms': round(1000 * percentile(latencies, 0.99), 2),
+        }
+
+
+def result_key(result: dict) -> tuple:
+    return result['route'], result['concurrency'], result['history']
+
+
+def compare(results: List[dict], baseline: dict, tolerance: float) -> List[str]:
+    """Human-readable regressions: p95 up or throughput down by more than ``tolerance``."""
+    previous = {result_key(r): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        base = previous.get(result_key(result))
+        if not base:
+            continue
+        label = '{} c={} h={}'.format(*result_key(result))
+        if base['p95Ms'] and result['p95Ms'] > base['p95Ms'] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {base['p95Ms']}ms -> {result['p95Ms']}ms")
+        if base['rps'] and result['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {base['rps']}/s -> {result['rps']}/s")
+    return regressions
+
+
+def print_table(results: List[dict]) -> None:
+    header = f"{'route':<16}{'conc':>5}{'hist':>6}{'reqs':>6}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['route']:<16}{r['concurrency']:>5}{r['history']:>6}{r['requests']:>6}{r['errors']:>5}"
+              f"{r['rps']:>9}{r['p50Ms']:>9}{r['p95Ms']:>9}{r['p99Ms']:>9}")
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the hot routes against local fakes.')
+    parser.add_argument('--routes', default=','.join(ROUTES), help=f'Comma-separated subset of {", ".join(ROUTES)}')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 8, 32], help='Comma-separated worker counts')
+    parser.add_argument('--history', type=int_list, default=[0, 200], help='Comma-separated chat lengths (turns)')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route/concurrency/history')
+    parser.add_argument('--patients', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=50, help='Direct messages per patient')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='Seconds per fake model call')
+    parser.add_argument('--llm-output-chars', type=int, default=400)
+    parser.add_argument('--rtdb-latency', type=float, default=0.0, help='Seconds per fake RTDB operation')
+    parser.add_argument('--auth-latency', type=float, default=0.0, help='Seconds per fake auth call')
+    parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON to compare against; exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    routes = [r for r in args.routes.split(',') if r]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    installed = fakes.install(rtdb_latency=args.rtdb_latency, auth_latency=args.auth_latency,
+                              llm_latency=args.llm_latency, llm_output_chars=args.llm_output_chars)
+    # Measure the routes rather than the admission gates, unless the caller set them
+    os.environ.setdefault('LLM_CHAT_CONCURRENCY', str(max(args.concurrency)))
+    os.environ.setdefault('LLM_ANALYSIS_CONCURRENCY', str(max(args.concurrency)))
+    os.environ.setdefault('LOG_TOKEN_USAGE', '0')
+    os.environ.setdefault('SPAN_SAMPLE_RATE', '0')
+    import app as app_module
+
+    bench = Bench(app_module, installed, patients=args.patients, messages=args.messages)
+    results = []
+    for history in args.history:
+        for route in routes:
+            for concurrency in args.concurrency:
+                # Fresh data for every run so chat and analysis runs do not feed the next ones
+                bench.seed(history)
+                result = dict(bench.run(route, concurrency, args.requests), history=history)
+                results.append(result)
+                print(f"{route} c={concurrency} h={history}: {result['rps']} req/s, "
+                      f"p95 {result['p95Ms']} ms", file=sys.stderr)
+
+    print_table(results)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {k: v for k, v in vars(args).items() if k not in ('save_baseline', 'compare')},
+        'results': results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Baseline written to {args.save_baseline}')
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressions against', args.compare)
+            for line in regressions:
+                print('  ' + line)
+            return 1
+        print('No regressions against', args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,257 @@
+"""Chart metrics for the clinician dashboard, computed locally from chat turns.
+
+Only the patient's side of each turn is scored.  The metrics are kept as a
+small mergeable state (counters plus a capped timeline) that is extended
+with each batch of new turns, so an analysis never rescans the whole chat:
+
+    state = {
+        "version": 2,                         # SCORING_VERSION
+        "turns": 42,
+        "mood": [[label, score], ...],        # newest MAX_TIMELINE_POINTS
+        "activity": {"2024-05-01": 3, ...},   # patient messages per day (UTC)
+        "urgency": {"Low": 30, "Medium": 10, "High": 2},
+        "emotions": {"Joy": 4, ...},
+        "keywords": {"sleep": 7, ...},
+        "emojis": {"😔": 2, ...},
+        "urgent": [{"message": ..., "timestamp": ...}, ...]
+    }
+
+``render(state)`` turns it into the ``moodTimeline``, ``activity``,
+``urgencyDistribution``, ``emotionRadar``, ``keywords`` and ``emojiCloud``
+fields of the analysis payload.  Scoring is lexicon based: a word counts
+towards an emotion and the mood valence unless one of the two words before
+it is a negation.
+"""
+
+import copy
+import datetime
+import html
+import re
+from collections import Counter
+from typing import Iterable, List, Optional
+
+EMOTIONS = ('Joy', 'Anger', 'Sadness', 'Anxiety', 'Surprise')
+URGENCY_LEVELS = ('Low', 'Medium', 'High')
+CHART_FIELDS = ('moodTimeline', 'activity', 'urgencyDistribution', 'emotionRadar', 'keywords', 'emojiCloud')
+
+# Bumped when scoring changes; analysis recounts stored states of another version
+SCORING_VERSION = 2
+MAX_TIMELINE_POINTS = 200
+MAX_ACTIVITY_DAYS = 365
+MAX_URGENT_MESSAGES = 20
+TOP_KEYWORDS = 20
+TOP_EMOJIS = 20
+# Keyword counters are pruned back to KEEP_KEYWORDS entries once they pass MAX_KEYWORDS
+MAX_KEYWORDS = 1000
+KEEP_KEYWORDS = 500
+
+EMOTION_LEXICON = {
+    'Joy': {
+        'happy', 'glad', 'joy', 'great', 'good', 'better', 'calm', 'relaxed', 'grateful', 'thankful',
+        'excited', 'proud', 'hopeful', 'love', 'enjoy', 'enjoyed', 'fun', 'peaceful', 'content', 'relieved',
+        'smile', 'laugh', 'wonderful', 'amazing', 'fine',
+    },
+    'Anger': {
+        'angry', 'mad', 'furious', 'annoyed', 'irritated', 'frustrated', 'hate', 'rage', 'resent',
+        'unfair', 'pissed', 'fed', 'bitter', 'yelled', 'shouting',
+    },
+    'Sadness': {
+        'sad', 'down', 'depressed', 'unhappy', 'lonely', 'alone', 'empty', 'hopeless', 'crying', 'cry',
+        'cried', 'tears', 'miserable', 'grief', 'lost', 'hurt', 'worthless', 'tired', 'exhausted', 'numb',
+        'heartbroken', 'useless',
+    },
+    'Anxiety': {
+        'anxious', 'anxiety', 'worried', 'worry', 'nervous', 'scared', 'afraid', 'fear', 'panic',
+        'stressed', 'stress', 'overwhelmed', 'tense', 'restless', 'uneasy', 'dread', 'insomnia', 'shaking',
+    },
+    'Surprise': {
+        'surprised', 'shocked', 'unexpected', 'suddenly', 'wow', 'amazed', 'astonished', 'strange', 'weird',
+    },
+}
+WORD_EMOTIONS = {word: emotion for emotion, words in EMOTION_LEXICON.items() for word in words}
+NEGATIVE_EMOTIONS = {'Anger', 'Sadness', 'Anxiety'}
+NEGATIONS = {'not', 'no', 'never', "don't", "dont", "isn't", "wasn't", "can't", "cannot", "didn't", "hardly"}
+
+HIGH_URGENCY = (
+    'suicide', 'suicidal', 'kill myself', 'end my life', 'end it all', 'want to die', 'better off dead',
+    'hurt myself', 'harm myself', 'self harm', 'self-harm', 'cutting myself', 'overdose', "can't go on",
+    'no reason to live',
+)
+MEDIUM_URGENCY = (
+    'hopeless', 'worthless', 'panic attack', "can't sleep", 'cannot sleep', "can't cope", 'breaking down',
+    'falling apart', 'nobody cares', 'so alone', 'unsafe', 'scared of myself', 'not eating',
+)
+
+STOPWORDS = {
+    'the', 'and', 'for', 'are', 'but', 'not', 'you', 'all', 'any', 'can', 'had', 'her', 'was', 'one', 'our',
+    'out', 'has', 'him', 'his', 'how', 'man', 'new', 'now', 'old', 'see', 'two', 'way', 'who', 'did', 'its',
+    'let', 'put', 'say', 'she', 'too', 'use', 'that', 'with', 'have', 'this', 'will', 'your', 'from', 'they',
+    'know', 'want', 'been', 'good', 'much', 'some', 'time', 'very', 'when', 'come', 'here', 'just', 'like',
+    'long', 'make', 'many', 'more', 'only', 'over', 'such', 'take', 'than', 'them', 'well', 'were', 'what',
+    'about', 'would', 'there', 'their', 'which', 'could', 'other', 'these', 'then', 'into', 'also', 'been',
+    'because', 'really', 'feel', 'feeling', 'think', 'going', 'get', 'got', "i'm", "it's", "don't", 'dont',
+    'im', 'ive', "i've", "can't", 'cant', 'yes', 'yeah', 'okay', 'should', 'still', 'even', 'today', 'day',
+    'lot', 'thing', 'things', 'something', 'anything', 'being', 'after', 'before', 'again', 'myself',
+}
+
+WORD_RE = re.compile(r"[a-z][a-z']+")
+EMOJI_RE = re.compile(
+    '(?:[\U0001F1E6-\U0001F1FF]{2})'
+    '|(?:[\U0001F300-\U0001FAFF\u2600-\u27BF]\uFE0F?[\U0001F3FB-\U0001F3FF]?'
+    '(?:\u200D[\U0001F300-\U0001FAFF\u2600-\u27BF]\uFE0F?[\U0001F3FB-\U0001F3FF]?)*)'
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return WORD_RE.findall(text.lower())
+
+
+def extract_emojis(text: str) -> List[str]:
+    return EMOJI_RE.findall(text)
+
+
+def score_tokens(tokens: List[str]):
+    """``(mood, emotion_counts)``; mood is in [-1, 1], 0 when nothing matched."""
+    emotions = Counter()
+    positive = negative = 0
+    for i, token in enumerate(tokens):
+        emotion = WORD_EMOTIONS.get(token)
+        if emotion is None:
+            continue
+        negated = any(t in NEGATIONS for t in tokens[max(0, i - 2):i])
+        if negated:
+            # "not happy" lowers the mood but is not joy; "not worried" is mildly positive
+            if emotion == 'Joy':
+                negative += 1
+            elif emotion in NEGATIVE_EMOTIONS:
+                positive += 1
+            continue
+        emotions[emotion] += 1
+        if emotion == 'Joy':
+            positive += 1
+        elif emotion in NEGATIVE_EMOTIONS:
+            negative += 1
+    matched = positive + negative
+    return (round((positive - negative) / matched, 2) if matched else 0.0), emotions
+
+
+def urgency_level(text: str, mood: float) -> str:
+    lowered = text.lower()
+    if any(phrase in lowered for phrase in HIGH_URGENCY):
+        return 'High'
+    if mood <= -0.5 or any(phrase in lowered for phrase in MEDIUM_URGENCY):
+        return 'Medium'
+    return 'Low'
+
+
+def _when(timestamp) -> Optional[datetime.datetime]:
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        return datetime.datetime.fromtimestamp(timestamp / 1000, tz=datetime.timezone.utc)
+    if isinstance(timestamp, str):
+        try:
+            return datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    return None
+
+
+def empty_state() -> dict:
+    return {
+        'version': SCORING_VERSION,
+        'turns': 0,
+        'mood': [],
+        'activity': {},
+        'urgency': {level: 0 for level in URGENCY_LEVELS},
+        'emotions': {emotion: 0 for emotion in EMOTIONS},
+        'keywords': {},
+        'emojis': {},
+        'urgent': [],
+    }
+
+
+def _merge(target: dict, counts: Counter) -> None:
+    for key, count in counts.items():
+        target[key] = target.get(key, 0) + count
+
+
+def update_state(state: Optional[dict], turns: Iterable[dict]) -> dict:
+    """A new state covering ``state``'s turns plus ``turns``."""
+    base = empty_state()
+    for key, value in (state or {}).items():
+        base[key] = copy.deepcopy(value)
+    state = base
+
+    days = Counter()
+    keywords = Counter()
+    emojis = Counter()
+    emotions = Counter()
+    urgency = Counter()
+    for turn in turns:
+        state['turns'] += 1
+        text = str(turn.get('user') or '')
+        if not text:
+            continue
+        # Stored messages are HTML-escaped by the app ("can&#x27;t"); score what the patient typed
+        typed = html.unescape(text)
+        when = _when(turn.get('timestamp'))
+        tokens = tokenize(typed)
+        mood, turn_emotions = score_tokens(tokens)
+        level = urgency_level(typed, mood)
+        keywords.update(t for t in tokens if len(t) > 2 and t not in STOPWORDS)
+        emojis.update(extract_emojis(typed))
+        emotions.update(turn_emotions)
+        urgency[level] += 1
+        label = when.strftime('%Y-%m-%d %H:%M') if when else f"#{state['turns']}"
+        state['mood'].append([label, mood])
+        if when:
+            days[when.strftime('%Y-%m-%d')] += 1
+        if level == 'High':
+            state['urgent'].append({'message': text, 'timestamp': label})
+
+    _merge(state['activity'], days)
+    _merge(state['keywords'], keywords)
+    _merge(state['emojis'], emojis)
+    _merge(state['emotions'], emotions)
+    _merge(state['urgency'], urgency)
+
+    state['mood'] = state['mood'][-MAX_TIMELINE_POINTS:]
+    state['urgent'] = state['urgent'][-MAX_URGENT_MESSAGES:]
+    if len(state['activity']) > MAX_ACTIVITY_DAYS:
+        state['activity'] = dict(sorted(state['activity'].items())[-MAX_ACTIVITY_DAYS:])
+    if len(state['keywords']) > MAX_KEYWORDS:
+        state['keywords'] = dict(Counter(state['keywords']).most_common(KEEP_KEYWORDS))
+    return state
+
+
+def render(state: Optional[dict]) -> dict:
+    """The chart fields of the analysis payload."""
+    state = update_state(state, [])
+    urgency_total = sum(state['urgency'].values())
+    strongest = max(state['emotions'].values()) if state['emotions'] else 0
+    days = sorted(state['activity'].items())
+    return {
+        'moodTimeline': {
+            'labels': [label for label, _ in state['mood']],
+            'data': [score for _, score in state['mood']],
+        },
+        'activity': {'labels': [day for day, _ in days], 'data': [count for _, count in days]},
+        'urgencyDistribution': {
+            'labels': list(URGENCY_LEVELS),
+            'data': [round(100 * state['urgency'].get(level, 0) / urgency_total) if urgency_total else 0
+                     for level in URGENCY_LEVELS],
+        },
+        'emotionRadar': {
+            'labels': list(EMOTIONS),
+            # 0-10 relative to the strongest emotion
+            'data': [round(10 * state['emotions'].get(e, 0) / strongest) if strongest else 0 for e in EMOTIONS],
+        },
+        'keywords': [{'term': term, 'count': count}
+                     for term, count in Counter(state['keywords']).most_common(TOP_KEYWORDS)],
+        'emojiCloud': [{'emoji': emoji, 'count': count}
+                       for emoji, count in Counter(state['emojis']).most_common(TOP_EMOJIS)],
+    }
+
+
+def urgent_flags(state: Optional[dict]) -> List[dict]:
+    """High-urgency patient messages, as ``criticalFlags`` for when no model output is available."""
+    return [dict(entry, category='Urgent language', severity=80) for entry in (state or {}).get('urgent') or []]
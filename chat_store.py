@@ -0,0 +1,152 @@
+"""Storage helpers for patient chat turns kept under ``chats/<uid>``.
+
+In ``append`` mode every turn is written as its own child carrying an
+``ordinal`` and a server ``timestamp``, so a new message costs a constant
+amount of traffic no matter how long the conversation is.  ``chat_meta/<uid>``
+holds the turn counter used to hand out ordinals, and the child's key is
+derived from the ordinal (``t0000000042``), so key order is ordinal order even
+when two appends race.
+
+Histories written by older versions are plain lists (``chats/<uid>/0``,
+``chats/<uid>/1``...), and earlier appends used push ids (``-N...``).  RTDB
+orders integer keys first, then strings, and push ids sort before the
+``t`` keys, so all three shapes read back in chronological order with
+``order_by_key``; the first append for a legacy list stamps ordinals on its
+entries and seeds the counter (see ``ensure_migrated``).
+"""
+
+import threading
+from typing import List, Optional, Tuple
+
+CHATS_NODE = 'chats'
+META_NODE = 'chat_meta'
+SERVER_TIMESTAMP = {'.sv': 'timestamp'}
+TURN_FIELDS = ('user', 'ai', 'ordinal', 'timestamp')
+# Sorts after the integer keys of legacy lists and after push ids
+TURN_KEY_PREFIX = 't'
+
+# uids whose chat_meta is known to exist in this process
+_migrated = set()
+_migrated_lock = threading.Lock()
+
+
+def turn_key(ordinal: int) -> str:
+    return f'{TURN_KEY_PREFIX}{ordinal:010d}'
+
+
+def _key_order(key):
+    key = str(key)
+    if key.lstrip('-').isdigit():
+        return (0, int(key), key)
+    return (1, 0, key)
+
+
+def ordered_items(raw) -> List[Tuple[str, dict]]:
+    """Return ``[(key, turn)]`` in chronological order for a dict- or list-shaped node."""
+    if isinstance(raw, list):
+        items = [(str(i), item) for i, item in enumerate(raw)]
+    elif isinstance(raw, dict):
+        items = sorted(((str(k), v) for k, v in raw.items()), key=lambda kv: _key_order(kv[0]))
+    else:
+        return []
+    return [(k, v) for k, v in items if isinstance(v, dict)]
+
+
+def clean_turn(turn: dict, fields=TURN_FIELDS) -> dict:
+    return {k: turn[k] for k in fields if k in turn}
+
+
+def ensure_migrated(ref, uid: str) -> None:
+    """Make sure ``chat_meta/<uid>`` exists, stamping ordinals on a legacy list.
+
+    This reads the full history once per patient; afterwards the result is
+    remembered in-process.
+    """
+    with _migrated_lock:
+        if uid in _migrated:
+            return
+    meta_ref = ref.child(META_NODE).child(uid)
+    if not meta_ref.get():
+        items = ordered_items(ref.child(CHATS_NODE).child(uid).get())
+        updates = {}
+        for i, (key, turn) in enumerate(items):
+            if turn.get('ordinal') != i:
+                updates[f'{CHATS_NODE}/{uid}/{key}/ordinal'] = i
+        if updates:
+            ref.update(updates)
+        seed = {'count': len(items), 'format': 'append'}
+        # Only seed the counter if nobody else did in the meantime
+        meta_ref.transaction(lambda current: current or seed)
+    with _migrated_lock:
+        _migrated.add(uid)
+
+
+def append_turn(ref, uid: str, user_message: str, ai_message: str, mode: str = 'append') -> int:
+    """Store one ``{user, ai}`` turn and return its ordinal."""
+    if mode == 'legacy':
+        history = [clean_turn(t) for _, t in ordered_items(ref.child(CHATS_NODE).child(uid).get())]
+        ordinal = len(history)
+        history.append({'user': user_message, 'ai': ai_message, 'ordinal': ordinal})
+        ref.child(CHATS_NODE).child(uid).set(history)
+        ref.child(META_NODE).child(uid).update({'count': len(history), 'format': 'legacy'})
+        return ordinal
+
+    ensure_migrated(ref, uid)
+    count = ref.child(META_NODE).child(uid).child('count').transaction(lambda c: (c or 0) + 1)
+    ordinal = count - 1
+    ref.child(CHATS_NODE).child(uid).child(turn_key(ordinal)).set({
+        'user': user_message,
+        'ai': ai_message,
+        'ordinal': ordinal,
+        'timestamp': SERVER_TIMESTAMP,
+    })
+    return ordinal
+
+
+def replace_turns(ref, uid: str, turns: List[dict]) -> None:
+    """Overwrite a patient's history (and its counter) in one multi-path update."""
+    stored = []
+    for i, turn in enumerate(turns):
+        item = clean_turn(turn, ('user', 'ai'))
+        item['ordinal'] = i
+        item['timestamp'] = turn.get('timestamp', SERVER_TIMESTAMP)
+        stored.append(item)
+    ref.update({
+        f'{CHATS_NODE}/{uid}': stored or None,
+        f'{META_NODE}/{uid}': {'count': len(stored), 'format': 'append'},
+    })
+    with _migrated_lock:
+        _migrated.add(uid)
+
+
+def recent_turns(ref, uid: str, limit: int) -> List[dict]:
+    """Return the last ``limit`` turns, oldest first."""
+    if limit <= 0:
+        return []
+    raw = ref.child(CHATS_NODE).child(uid).order_by_key().limit_to_last(limit).get()
+    return [turn for _, turn in ordered_items(raw)]
+
+
+def turns_page(ref, uid: str, limit: int, before: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Return up to ``limit`` turns ending just before the ``before`` key.
+
+    The second element is the cursor to pass as ``before`` for the previous
+    page, or ``None`` once the start of the conversation has been reached.
+    """
+    query = ref.child(CHATS_NODE).child(uid).order_by_key()
+    if before is not None:
+        query = query.end_at(str(before))
+    # One extra row to detect more history, plus the ``before`` row itself
+    fetch = limit + 1 + (1 if before is not None else 0)
+    items = ordered_items(query.limit_to_last(fetch).get())
+    if before is not None:
+        items = [(k, v) for k, v in items if k != str(before)]
+    has_more = len(items) > limit
+    items = items[-limit:] if limit > 0 else []
+    cursor = items[0][0] if has_more and items else None
+    return [turn for _, turn in items], cursor
+
+
+def all_turns(ref, uid: str) -> List[dict]:
+    return [turn for _, turn in ordered_items(ref.child(CHATS_NODE).child(uid).get())]
+
@@ -0,0 +1,141 @@
+"""Firebase and Gemini clients, created on first use in each process.
+
+Importing the app only defines its routes.  The ``firebase_admin`` and
+``google.generativeai`` imports (about a second together), the credential
+check and client setup happen when a request first needs them, i.e. in the
+worker after gunicorn forks.  ``Lazy`` does the same for other per-process
+objects (the traced database reference, the search index): a forked child
+builds its own, since sockets, gRPC channels and SQLite connections must not
+be shared across ``fork``.
+
+``startup`` records how long the app import and each of these steps took,
+in seconds, in the order they happened; see ``report``.
+"""
+
+import contextlib
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+startup: Dict[str, float] = {}
+
+_lock = threading.RLock()
+_firebase_pid: Optional[int] = None
+_gemini_pid: Optional[int] = None
+
+
+def record(phase: str, seconds: float) -> None:
+    # The first measurement counts; e.g. an import repeated once it is cached costs nothing
+    startup.setdefault(phase, round(seconds, 4))
+
+
+@contextlib.contextmanager
+def timed(phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+def report() -> str:
+    """One line with the recorded phases, e.g. ``app_import=0.21s firebase_init=0.05s``."""
+    return ' '.join(f'{phase}={seconds:.3f}s' for phase, seconds in startup.items()) or 'nothing recorded'
+
+
+def import_sdks() -> None:
+    """Import the SDKs without creating any client.
+
+    gunicorn.conf.py calls this in the master when it preloads the app, so the
+    workers fork with the modules loaded, or else in a background thread of
+    each new worker, ahead of the first request that needs them.
+    """
+    with timed('firebase_import'):
+        import firebase_admin.auth  # noqa: F401
+        import firebase_admin.db  # noqa: F401
+    with timed('gemini_import'):
+        import google.generativeai  # noqa: F401
+
+
+def firebase():
+    """The ``firebase_admin`` module with this process's default app initialised."""
+    global _firebase_pid
+    if _firebase_pid != os.getpid():
+        with _lock:
+            if _firebase_pid != os.getpid():
+                with timed('firebase_import'):
+                    import firebase_admin
+                    from firebase_admin import credentials
+                with timed('firebase_init'):
+                    import config
+                    config.validate()
+                    if _firebase_pid is not None and firebase_admin._apps:
+                        # Inherited from the parent process along with its connections
+                        firebase_admin.delete_app(firebase_admin.get_app())
+                    firebase_admin.initialize_app(credentials.Certificate(config.firebase_admin_config), {
+                        'databaseURL': config.firebase_config['databaseURL']
+                    })
+                _firebase_pid = os.getpid()
+    import firebase_admin
+    return firebase_admin
+
+
+def auth():
+    """``firebase_admin.auth``, ready to use."""
+    firebase()
+    from firebase_admin import auth as admin_auth
+    return admin_auth
+
+
+def reference(path: str = '/'):
+    firebase()
+    from firebase_admin import db
+    return db.reference(path)
+
+
+def gemini():
+    """``google.generativeai``, configured with this process's API key and transport."""
+    global _gemini_pid
+    if _gemini_pid != os.getpid():
+        with _lock:
+            if _gemini_pid != os.getpid():
+                with timed('gemini_import'):
+                    import google.generativeai as genai
+                with timed('gemini_init'):
+                    import config
+                    config.validate()
+                    genai.configure(api_key=config.gemini_api_key, transport=config.gemini_transport)
+                _gemini_pid = os.getpid()
+    import google.generativeai as genai
+    return genai
+
+
+class Lazy:
+    """Stands in for the object ``factory`` returns, built on first attribute access in each process."""
+
+    def __init__(self, factory: Callable, phase: Optional[str] = None):
+        self._factory = factory
+        self._phase = phase
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    started = time.perf_counter()
+                    self._value = self._factory()
+                    if self._phase:
+                        record(self._phase, time.perf_counter() - started)
+                    self._pid = os.getpid()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __repr__(self) -> str:
+        return f'<Lazy {self._value!r}>' if self._pid == os.getpid() else '<Lazy (not created)>'
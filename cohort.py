@@ -0,0 +1,121 @@
+"""Batch analysis of a doctor's whole roster, and the triage view built from it.
+
+``analyze_roster`` runs ``analysis.analyze`` for every patient on a bounded
+thread pool and yields one entry per patient as each finishes:
+
+    {"uid": ..., "status": "skipped" | "analyzed" | "metrics" | "error",
+     "mode": ..., "newTurns": 3, "triage": {...}}
+
+A patient is skipped with two small reads when the stored analysis still
+covers the whole chat (``chat_meta/<uid>/count`` equals
+``analysis_meta/<uid>/turns``); the triage numbers then come from
+``analysis_meta/<uid>/triage``.  ``metrics`` means the model call failed and
+only the locally computed charts are current (see ``analysis``).
+
+``triage_rows`` orders the entries most urgent first: highest critical-flag
+severity, then number of flags, then share of high- and medium-urgency
+messages.  Patients without any analysis go last.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import analysis
+import chat_store
+
+SKIPPED = 'skipped'
+ANALYZED = 'analyzed'
+CHARTS_ONLY = 'metrics'
+FAILED = 'error'
+# Only from stored_roster: no stored analysis yet
+MISSING = 'missing'
+
+
+def stored_triage(ref, uid: str) -> Optional[dict]:
+    """The stored triage numbers if the analysis still covers every turn, else ``None``."""
+    count = ref.child(chat_store.META_NODE).child(uid).child('count').get()
+    if count is None:
+        return None
+    meta = ref.child(analysis.META_NODE).child(uid)
+    if meta.child('turns').get() != count:
+        return None
+    return meta.child('triage').get()
+
+
+def analyze_patient(ref, model, uid: str, refresh: bool = False) -> dict:
+    started = time.perf_counter()
+    entry = {'uid': uid}
+    try:
+        triage = None if refresh else stored_triage(ref, uid)
+        if triage is not None:
+            entry.update(status=SKIPPED, mode='cache', newTurns=0, triage=triage)
+        else:
+            data, info = analysis.analyze(ref, model, uid, refresh=refresh)
+            triage = analysis.triage_summary(data)
+            status = {'cache': SKIPPED, 'metrics': CHARTS_ONLY}.get(info['mode'], ANALYZED)
+            if info['mode'] == 'cache':
+                # Stored before triage numbers were kept; add them so the next run skips the patient early
+                ref.child(analysis.META_NODE).child(uid).child('triage').set(triage)
+            entry.update(status=status, mode=info['mode'], newTurns=info.get('newTurns', 0), triage=triage)
+    except Exception as e:
+        entry.update(status=FAILED, error=type(e).__name__)
+    entry['elapsedMs'] = round((time.perf_counter() - started) * 1000, 1)
+    return entry
+
+
+def analyze_roster(ref, model, patient_uids: Iterable[str], workers: int = 4,
+                   refresh: bool = False) -> Iterator[dict]:
+    """Yield ``analyze_patient`` entries in completion order, at most ``workers`` at a time."""
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='cohort')
+    try:
+        futures = [pool.submit(analyze_patient, ref, model, uid, refresh) for uid in patient_uids]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Drop the patients not started yet when the consumer goes away (e.g. the client disconnected)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def stored_roster(ref, patient_uids: Iterable[str], workers: int = 8) -> List[dict]:
+    """Entries from the stored triage numbers only, without running any analysis.
+
+    ``stale`` marks analyses that no longer cover the whole chat.
+    """
+    def read(uid: str) -> dict:
+        meta = ref.child(analysis.META_NODE).child(uid)
+        triage = meta.child('triage').get()
+        if not triage:
+            return {'uid': uid, 'status': MISSING, 'mode': 'missing'}
+        count = ref.child(chat_store.META_NODE).child(uid).child('count').get()
+        return {'uid': uid, 'status': SKIPPED, 'mode': 'cache', 'triage': triage,
+                'stale': count is not None and meta.child('turns').get() != count}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='cohort') as pool:
+        return list(pool.map(read, patient_uids))
+
+
+def _sort_key(row: dict):
+    triage = row.get('triage')
+    if not triage:
+        return (1, 0, 0, 0, 0, row['uid'])
+    return (0, -(triage.get('maxSeverity') or 0), -(triage.get('flags') or 0), -(triage.get('high') or 0),
+            -(triage.get('medium') or 0), row['uid'])
+
+
+def triage_rows(entries: Iterable[dict], patients: Optional[Dict[str, dict]] = None) -> List[dict]:
+    """Entries sorted most urgent first, with the patient's name from the roster when known."""
+    patients = patients or {}
+    rows = []
+    for entry in entries:
+        row = dict(entry, name=(patients.get(entry['uid']) or {}).get('fullname') or entry['uid'])
+        rows.append(row)
+    rows.sort(key=_sort_key)
+    return rows
+
+
+def counts(entries: Iterable[dict]) -> Dict[str, int]:
+    out = {SKIPPED: 0, ANALYZED: 0, CHARTS_ONLY: 0, FAILED: 0, MISSING: 0}
+    for entry in entries:
+        out[entry['status']] = out.get(entry['status'], 0) + 1
+    return out
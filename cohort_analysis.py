@@ -0,0 +1,120 @@
+"""Analyse every patient of one, several or all doctors outside the web app.
+
+Meant for overnight runs: stored analyses and their triage numbers are
+brought up to date, so dashboards open on current data and
+/doctor/triage has something to show.  Unchanged patients are skipped.
+
+    python cohort_analysis.py --doctor-email dr@example.com
+    python cohort_analysis.py --all-doctors --workers 8 --json triage.json
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import List, Optional
+
+import firebase_admin
+from firebase_admin import credentials, auth as admin_auth, db
+
+import cohort
+import llm_scheduler
+import prompts
+import roster
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def initialize_firebase_if_needed() -> None:
+    import config
+    from config import firebase_config, firebase_admin_config
+
+    config.validate()
+
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(firebase_admin_config)
+        firebase_admin.initialize_app(cred, {
+            'databaseURL': firebase_config['databaseURL']
+        })
+
+
+def build_analysis_model():
+    """The Pro model with the analyst instructions, behind the same quota as the web app."""
+    from config import gemini_pro_rpm, gemini_pro_tpm
+    from config import gemini_rate_state_dir, gemini_queue_timeout, gemini_max_retries, gemini_cache_ttl
+
+    # Gemini itself is configured on the first call (clients.gemini)
+    prompt = prompts.PromptFile(
+        os.path.join(BASE_DIR, 'analysis_prompt.md'),
+        fallback="Analyze the patient's chat history and return the analysis as a single JSON object.")
+    model = prompts.InstructedModel('gemini-2.5-pro', prompt, cache_ttl=gemini_cache_ttl)
+    # With GEMINI_RATE_STATE_DIR shared with the web workers, this job only uses quota they leave
+    scheduler = llm_scheduler.Scheduler(queue_timeout=gemini_queue_timeout, max_retries=gemini_max_retries)
+    scheduler.set_limits(model.model_name, gemini_pro_rpm, gemini_pro_tpm, state_dir=gemini_rate_state_dir)
+    return scheduler.wrap(model, llm_scheduler.ANALYSIS), model
+
+
+def resolve_doctors(args) -> List[str]:
+    if args.all_doctors:
+        return sorted((db.reference(roster.DOCTORS_NODE).get(shallow=True) or {}).keys())
+    uids = list(args.doctor_uid or [])
+    for email in args.doctor_email or []:
+        uids.append(admin_auth.get_user_by_email(email).uid)
+    return uids
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description='Batch-analyse doctors\' patients and store the triage view.')
+    parser.add_argument('--doctor-email', action='append', help='May be repeated')
+    parser.add_argument('--doctor-uid', action='append', help='May be repeated')
+    parser.add_argument('--all-doctors', action='store_true')
+    parser.add_argument('--workers', type=int, default=None, help='Patients analysed in parallel (COHORT_WORKERS)')
+    parser.add_argument('--refresh', action='store_true', help='Re-analyse everyone from scratch')
+    parser.add_argument('--json', metavar='PATH', help='Also write the triage rows per doctor to PATH')
+    args = parser.parse_args(argv)
+    if not (args.all_doctors or args.doctor_email or args.doctor_uid):
+        parser.error('pass --doctor-email, --doctor-uid or --all-doctors')
+
+    initialize_firebase_if_needed()
+    from config import cohort_workers
+    workers = args.workers or cohort_workers
+    model, pro_model = build_analysis_model()
+    ref = db.reference('/')
+
+    started = time.perf_counter()
+    report = {}
+    totals = {}
+    for doctor_uid in resolve_doctors(args):
+        patients = roster.linked_roster(ref, doctor_uid, roster.get_roster(ref, doctor_uid))
+        print(f'Doctor {doctor_uid}: {len(patients)} patients')
+        entries = []
+        for entry in cohort.analyze_roster(ref, model, list(patients), workers=workers, refresh=args.refresh):
+            entries.append(entry)
+            name = (patients.get(entry['uid']) or {}).get('fullname') or entry['uid']
+            print(f"  [{len(entries)}/{len(patients)}] {name}: {entry['status']} ({entry['elapsedMs']} ms)",
+                  flush=True)
+        rows = cohort.triage_rows(entries, patients)
+        report[doctor_uid] = rows
+        for status, n in cohort.counts(entries).items():
+            totals[status] = totals.get(status, 0) + n
+        for row in rows[:5]:
+            triage = row.get('triage') or {}
+            if triage.get('flags') or triage.get('high'):
+                print(f"  ! {row['name']}: {triage.get('flags', 0)} flags, max severity "
+                      f"{triage.get('maxSeverity', 0)}, {triage.get('high', 0)}% high urgency")
+
+    elapsed = time.perf_counter() - started
+    print(f'\nCohort analysis complete in {elapsed:.1f}s:')
+    print('  ' + (', '.join(f'{n} {status}' for status, n in totals.items() if n) or 'no patients'))
+    usage = pro_model.stats()
+    print(f"  Model calls: {usage['calls']}, prompt tokens: {usage['promptTokens']}, "
+          f"output tokens: {usage['outputTokens']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'  Triage written to {args.json}')
+    return 1 if totals.get(cohort.FAILED) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
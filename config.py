@@ -35,13 +35,102 @@ gemini_api_key = os.getenv("GEMINI_API_KEY")
 # Flask secret key
 flask_secret_key = os.getenv("FLASK_SECRET_KEY")
 
-# Validate required environment variables
+# Chat storage: "append" pushes one child per turn, "legacy" rewrites the whole list
+chat_storage_mode = os.getenv("CHAT_STORAGE_MODE", "append")
+# Turns returned per /chat/history page
+chat_history_page_size = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "100"))
+# /chat prompt context: at most this many verbatim turns within an approximate token budget;
+# older turns are folded into a rolling summary this many at a time
+chat_context_turns = int(os.getenv("CHAT_CONTEXT_TURNS", "20"))
+chat_context_token_budget = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "3000"))
+chat_summary_batch = int(os.getenv("CHAT_SUMMARY_BATCH", "10"))
+
+# Most direct messages returned by one /get-direct-messages (or doctor thread) request
+direct_messages_page_size = int(os.getenv("DIRECT_MESSAGES_PAGE_SIZE", "200"))
+
+# Live direct-message streams (SSE): concurrent streams per process, since each holds a
+# worker thread under gthread, and how long one stream lasts before the browser reconnects
+message_stream_max_clients = int(os.getenv("MESSAGE_STREAM_MAX_CLIENTS", "2"))
+message_stream_max_seconds = int(os.getenv("MESSAGE_STREAM_MAX_SECONDS", "300"))
+
+# Background analysis jobs: worker threads per process and how many may wait in the queue
+analysis_workers = int(os.getenv("ANALYSIS_WORKERS", "2"))
+analysis_queue_size = int(os.getenv("ANALYSIS_QUEUE_SIZE", "20"))
+# Longest (seconds) GET /analysis-jobs/<id>?wait=N blocks. Each waiting poll holds a gthread thread, so
+# this stays short and the browser polls again with backoff; gunicorn.conf.py raises it under gevent
+analysis_job_max_wait = float(os.getenv("ANALYSIS_JOB_MAX_WAIT", "1"))
+
+# Roster-wide analysis (/doctor/cohort-analysis and cohort_analysis.py): patients analysed in
+# parallel per run, and concurrent runs per process
+cohort_workers = int(os.getenv("COHORT_WORKERS", "4"))
+cohort_max_runs = int(os.getenv("COHORT_MAX_RUNS", "1"))
+
+# Full-text search over patients' chats and messages: SQLite file shared by the workers on a
+# host (":memory:" keeps one index per process), how often (seconds) a patient's index is caught
+# up with writes made elsewhere, and the largest page of results
+search_index_path = os.getenv("SEARCH_INDEX_PATH", ":memory:")
+search_sync_interval = float(os.getenv("SEARCH_SYNC_INTERVAL", "300"))
+search_page_size = int(os.getenv("SEARCH_PAGE_SIZE", "50"))
+
+# Verified ID-token claims kept in memory, and how many seconds before expiry a session token is refreshed
+auth_cache_size = int(os.getenv("AUTH_CACHE_SIZE", "4096"))
+auth_refresh_ahead = int(os.getenv("AUTH_REFRESH_AHEAD", "300"))
+
+# Outbound REST calls: base URLs (point them at a local stand-in for tests and benchmarks),
+# keep-alive pool size (match gunicorn --threads), timeouts in seconds and retries (POSTs only on
+# connection failures and 429, never after a read timeout)
+identity_toolkit_url = os.getenv("IDENTITY_TOOLKIT_URL", "https://identitytoolkit.googleapis.com").rstrip("/")
+securetoken_url = os.getenv("SECURETOKEN_URL", "https://securetoken.googleapis.com").rstrip("/")
+http_pool_size = int(os.getenv("HTTP_POOL_SIZE", "4"))
+http_connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+http_read_timeout = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+http_retries = int(os.getenv("HTTP_RETRIES", "2"))
+
+# Gemini transport ("grpc" or "rest"); gunicorn.conf.py picks "rest" under gevent so calls yield
+gemini_transport = os.getenv("GEMINI_TRANSPORT") or None
+
+# Admission control for LLM-bound routes: concurrent requests per process, and how long (seconds)
+# a request waits for a slot before getting 503 + Retry-After. Under gthread, gunicorn.conf.py derives
+# these, COHORT_MAX_RUNS and MESSAGE_STREAM_MAX_CLIENTS from WEB_THREADS so that together they stay
+# below it and cheap routes always have a thread left. The analysis limit covers only the Pro call.
+llm_chat_concurrency = int(os.getenv("LLM_CHAT_CONCURRENCY", "3"))
+llm_analysis_concurrency = int(os.getenv("LLM_ANALYSIS_CONCURRENCY", "1"))
+admission_max_wait = float(os.getenv("ADMISSION_MAX_WAIT", "0.5"))
+
+# Gemini quota: requests and tokens per minute per model (0 = unlimited). With GEMINI_RATE_STATE_DIR
+# set, the buckets live in files there and are shared by every worker process on the host.
+gemini_flash_rpm = int(os.getenv("GEMINI_FLASH_RPM", "0"))
+gemini_flash_tpm = int(os.getenv("GEMINI_FLASH_TPM", "0"))
+gemini_pro_rpm = int(os.getenv("GEMINI_PRO_RPM", "0"))
+gemini_pro_tpm = int(os.getenv("GEMINI_PRO_TPM", "0"))
+gemini_rate_state_dir = os.getenv("GEMINI_RATE_STATE_DIR") or None
+# Seconds a call may wait for quota before giving up, and retries on 429/503 answers
+gemini_queue_timeout = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "20"))
+gemini_max_retries = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+
+# Context cache for the static system instructions: TTL in seconds, renewed while in use (0 = off).
+# Gemini only caches prompts above a model-specific minimum size; smaller ones are sent as is.
+gemini_cache_ttl = int(os.getenv("GEMINI_CACHE_TTL", "0"))
+# Log prompt/cached/output token counts of every model call to stderr
+log_token_usage = os.getenv("LOG_TOKEN_USAGE", "1") == "1"
+
+# Instrumentation: /metrics needs "Authorization: Bearer <METRICS_TOKEN>" and is closed while the token
+# is unset, unless METRICS_PUBLIC=1 (local development only) or Flask runs in debug mode;
+# JSON access log lines on stdout; fraction of requests that keep detailed spans
+metrics_token = os.getenv("METRICS_TOKEN") or None
+metrics_public = os.getenv("METRICS_PUBLIC", "0") == "1"
+access_log_json = os.getenv("ACCESS_LOG_JSON", "0") == "1"
+span_sample_rate = float(os.getenv("SPAN_SAMPLE_RATE", "0.01"))
+
+# Required environment variables; checked by validate() before the first Firebase or Gemini client
+# is created (not on import, so the app can be imported without credentials)
 required_vars = [
     "FIREBASE_API_KEY", "FIREBASE_AUTH_DOMAIN", "FIREBASE_DATABASE_URL",
     "FIREBASE_PROJECT_ID", "FIREBASE_PRIVATE_KEY", "FIREBASE_CLIENT_EMAIL",
     "GEMINI_API_KEY", "FLASK_SECRET_KEY"
 ]
 
-missing_vars = [var for var in required_vars if not os.getenv(var)]
-if missing_vars:
-    raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
\ No newline at end of file
+def validate():
+    missing_vars = [var for var in required_vars if not os.getenv(var)]
+    if missing_vars:
+        raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
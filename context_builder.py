@@ -0,0 +1,216 @@
+"""Bounded prompt context for ``/chat`` with a rolling per-patient summary.
+
+Only the most recent turns that have not yet been summarized are sent
+verbatim, capped both by turn count and by an approximate token budget.
+Older turns are folded into ``chat_summaries/<uid>`` by a background job:
+
+    chat_summaries/<uid> = {
+        "summary": "...",      # running summary text
+        "through": 41,         # ordinal of the last folded turn
+        "throughKey": "-N...", # its key under chats/<uid>, used as a read cursor
+        "updated": <server timestamp>
+    }
+
+so the prompt stays roughly the same size however long the conversation gets.
+"""
+
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import chat_store
+
+SUMMARY_NODE = 'chat_summaries'
+# Upper bound on turns folded by a single summarization call
+MAX_FOLD_TURNS = 200
+# Conversation length buckets (in turns) used for prompt-size statistics
+LENGTH_BUCKETS = (10, 50, 200, 1000)
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a patient's conversation with a supportive "
+    "healthcare assistant. Merge the new turns into the existing summary. Keep what "
+    "matters for continuing the conversation: recurring feelings and symptoms, "
+    "important events, any risk indicators, and what the patient asked for. "
+    "Write plain prose, at most 200 words, with no preamble."
+)
+
+_fold_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='chat-summary')
+_folding = set()
+_folding_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token); no tokenizer round-trip."""
+    return (len(text) + 3) // 4
+
+
+def format_turns(turns: List[dict]) -> str:
+    lines = []
+    for turn in turns:
+        if turn.get('user'):
+            lines.append(f"Patient: {turn['user']}")
+        if turn.get('ai'):
+            lines.append(f"AI: {turn['ai']}")
+    return '\n'.join(lines)
+
+
+def _ordinal(turn: dict, default: int) -> int:
+    value = turn.get('ordinal')
+    return value if isinstance(value, int) else default
+
+
+def select_window(turns: List[dict], max_turns: int, token_budget: int) -> List[dict]:
+    """Pick the newest turns that fit both limits, returned oldest first."""
+    window = []
+    used = 0
+    for turn in reversed(turns[-max_turns:] if max_turns > 0 else []):
+        cost = estimate_tokens(format_turns([turn])) + 1
+        if window and used + cost > token_budget:
+            break
+        window.append(turn)
+        used += cost
+    window.reverse()
+    return window
+
+
+def build_prompt(system_prompt: str, summary: str, window: List[dict], user_message: str) -> str:
+    # The system prompt is usually sent as the model's system instruction instead
+    parts = [system_prompt] if system_prompt else []
+    if summary:
+        parts.append(f"Summary of the earlier conversation:\n{summary}")
+    if window:
+        parts.append(f"Most recent conversation turns:\n{format_turns(window)}")
+    parts.append(f"Patient's new message: \"{user_message}\"\n\nAI:")
+    return '\n\n'.join(parts)
+
+
+def build_chat_context(ref, uid: str, user_message: str, max_turns: int, token_budget: int,
+                       system_prompt: str = '') -> Tuple[str, dict]:
+    """Return ``(prompt, info)`` for a new patient message.
+
+    ``info`` carries the prompt statistics plus what ``schedule_fold`` needs
+    to decide whether older turns should be summarized.
+    """
+    record = ref.child(SUMMARY_NODE).child(uid).get() or {}
+    through = record.get('through', -1)
+    recent = chat_store.recent_turns(ref, uid, max_turns)
+    unsummarized = [t for i, t in enumerate(recent) if _ordinal(t, through + 1 + i) > through]
+    window = select_window(unsummarized, max_turns, token_budget)
+    summary = record.get('summary', '')
+    prompt = build_prompt(system_prompt, summary, window, user_message)
+    newest = _ordinal(recent[-1], len(recent) - 1) if recent else -1
+    info = {
+        'promptTokens': estimate_tokens(prompt),
+        'promptChars': len(prompt),
+        'verbatimTurns': len(window),
+        'summaryTokens': estimate_tokens(summary) if summary else 0,
+        'summarizedThrough': through,
+        'historyTurns': newest + 1,
+        # Turns that did not make it into the prompt and are not summarized yet
+        'droppedTurns': len(unsummarized) - len(window),
+    }
+    prompt_stats.record(info)
+    return prompt, info
+
+
+def fold_backlog(info: dict, newest_ordinal: int, max_turns: int, fold_batch: int) -> int:
+    """How many of the oldest unsummarized turns should be folded now (0 = none)."""
+    through = info.get('summarizedThrough', -1)
+    unsummarized = newest_ordinal - through
+    if unsummarized < max_turns and not info.get('droppedTurns'):
+        return 0
+    # Fold down to ``max_turns - fold_batch`` verbatim turns so folds happen in batches
+    keep = max(1, max_turns - fold_batch)
+    return min(MAX_FOLD_TURNS, max(unsummarized - keep, info.get('droppedTurns', 0), 1))
+
+
+def fold_turns(ref, model, uid: str, count: int) -> Optional[dict]:
+    """Fold the ``count`` oldest unsummarized turns into the stored summary."""
+    summary_ref = ref.child(SUMMARY_NODE).child(uid)
+    record = summary_ref.get() or {}
+    through_key = record.get('throughKey')
+    query = ref.child(chat_store.CHATS_NODE).child(uid).order_by_key()
+    if through_key:
+        query = query.start_at(through_key)
+    items = chat_store.ordered_items(query.limit_to_first(count + 1).get())
+    items = [(k, t) for k, t in items if k != through_key][:count]
+    if not items:
+        return None
+    previous = record.get('summary') or '(none yet)'
+    prompt = (f"{SUMMARY_INSTRUCTIONS}\n\nExisting summary:\n{previous}\n\n"
+              f"New turns:\n{format_turns([t for _, t in items])}\n\nUpdated summary:")
+    summary = model.generate_content(prompt).text.strip()
+    last_key, last_turn = items[-1]
+    updated = {
+        'summary': summary,
+        'through': _ordinal(last_turn, record.get('through', -1) + len(items)),
+        'throughKey': last_key,
+        'updated': chat_store.SERVER_TIMESTAMP,
+    }
+    summary_ref.set(updated)
+    return updated
+
+
+def schedule_fold(ref, model, uid: str, info: dict, newest_ordinal: int,
+                  max_turns: int, fold_batch: int) -> bool:
+    """Queue a background fold if the unsummarized backlog is large enough."""
+    count = fold_backlog(info, newest_ordinal, max_turns, fold_batch)
+    if not count:
+        return False
+    with _folding_lock:
+        if uid in _folding:
+            return False
+        _folding.add(uid)
+
+    def run():
+        try:
+            fold_turns(ref, model, uid, count)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with _folding_lock:
+                _folding.discard(uid)
+
+    _fold_executor.submit(run)
+    return True
+
+
+class PromptStats:
+    """Thread-safe aggregate of prompt sizes, bucketed by conversation length."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    @staticmethod
+    def bucket_label(turns: int) -> str:
+        low = 0
+        for high in LENGTH_BUCKETS:
+            if turns < high:
+                return f'{low}-{high - 1}'
+            low = high
+        return f'{low}+'
+
+    def record(self, info: dict) -> None:
+        label = self.bucket_label(info.get('historyTurns', 0))
+        tokens = info.get('promptTokens', 0)
+        with self._lock:
+            b = self._buckets.setdefault(label, {'prompts': 0, 'totalTokens': 0, 'maxTokens': 0})
+            b['prompts'] += 1
+            b['totalTokens'] += tokens
+            b['maxTokens'] = max(b['maxTokens'], tokens)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = {}
+            for label, b in self._buckets.items():
+                out[label] = {
+                    'prompts': b['prompts'],
+                    'avgTokens': round(b['totalTokens'] / b['prompts'], 1),
+                    'maxTokens': b['maxTokens'],
+                }
+            return out
+
+
+prompt_stats = PromptStats()
@@ -0,0 +1,129 @@
+"""Incremental reads of a doctor-patient thread under ``direct_messages/<patient_uid>``.
+
+Clients pass back the cursor of the last message they hold as ``since``:
+
+* a push id (e.g. ``-Nabc...``) returns messages with a later key; push ids
+  are generated in chronological order, so no index is needed;
+* a millisecond timestamp returns messages with ``timestamp >= since``
+  (inclusive; clients de-duplicate by ``id``).  This needs
+  ``".indexOn": "timestamp"`` on ``direct_messages/$patient`` (see
+  database.rules.json).
+
+Without ``since`` the newest ``limit`` messages are returned.
+
+``send`` also copies each message to ``direct_messages_latest/<patient_uid>``
+in the same write; the message hub listens there, so its listener starts from
+one small record per thread instead of downloading every thread.
+"""
+
+import hashlib
+import random
+import threading
+import time
+from typing import List, Optional, Tuple
+
+MESSAGES_NODE = 'direct_messages'
+LATEST_NODE = 'direct_messages_latest'
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+_random = random.SystemRandom()
+# Last key handed out by new_key in this process: (milliseconds, suffix digits)
+_last_push = (0, [])
+_push_lock = threading.Lock()
+
+
+def _stamp(timestamp_ms: int) -> str:
+    stamp = ''
+    for _ in range(8):
+        stamp = PUSH_CHARS[timestamp_ms % 64] + stamp
+        timestamp_ms //= 64
+    return stamp
+
+
+def push_key(timestamp_ms: int, rng: random.Random = _random) -> str:
+    """A push-id style key: sorts by ``timestamp_ms``, then by a random suffix."""
+    return _stamp(timestamp_ms) + ''.join(rng.choice(PUSH_CHARS) for _ in range(12))
+
+
+def new_key() -> str:
+    """A push id as the Firebase SDKs make them: later keys sort later, also within one millisecond."""
+    global _last_push
+    with _push_lock:
+        now = int(time.time() * 1000)
+        last_ms, digits = _last_push
+        if now <= last_ms:
+            # Same millisecond (or the clock stepped back): increment the previous suffix
+            now, digits = last_ms, list(digits)
+            i = len(digits) - 1
+            while i >= 0 and digits[i] == len(PUSH_CHARS) - 1:
+                digits[i] = 0
+                i -= 1
+            if i >= 0:
+                digits[i] += 1
+        else:
+            digits = [_random.randrange(len(PUSH_CHARS)) for _ in range(12)]
+        _last_push = (now, digits)
+    return _stamp(now) + ''.join(PUSH_CHARS[d] for d in digits)
+
+
+def send(ref, patient_uid: str, message: dict) -> str:
+    """Store ``message`` in the thread and as the thread's latest, in one update; returns its key."""
+    key = new_key()
+    ref.update({
+        f'{MESSAGES_NODE}/{patient_uid}/{key}': message,
+        f'{LATEST_NODE}/{patient_uid}': dict(message, id=key),
+    })
+    return key
+
+
+def normalize_messages(raw) -> List[dict]:
+    """Messages as a list sorted by timestamp, each tagged with its ``id``."""
+    # Be defensive: result can be dict keyed by push-id or a list
+    if isinstance(raw, dict):
+        items = raw.items()
+    elif isinstance(raw, list):
+        items = ((str(i), msg) for i, msg in enumerate(raw))
+    else:
+        items = ()
+    message_list = []
+    for key, msg in items:
+        if isinstance(msg, dict):
+            msg = dict(msg, id=key)
+            msg.setdefault('timestamp', 0)
+            message_list.append(msg)
+    # Sort ascending by timestamp, push ids break ties in creation order
+    message_list.sort(key=lambda m: (m.get('timestamp', 0), m['id']))
+    return message_list
+
+
+def is_timestamp(cursor: str) -> bool:
+    return cursor.isdigit()
+
+
+def fetch_messages(ref, patient_uid: str, since: Optional[str] = None,
+                   limit: Optional[int] = None) -> Tuple[List[dict], Optional[str]]:
+    """Return ``(messages, cursor)``; ``cursor`` is the largest key returned, to pass back as ``since``."""
+    thread = ref.child(MESSAGES_NODE).child(patient_uid)
+    if since and is_timestamp(since):
+        query = thread.order_by_child('timestamp').start_at(int(since))
+        query = query.limit_to_first(limit) if limit else query
+        messages = normalize_messages(query.get())
+    elif since:
+        # start_at is inclusive; fetch one extra to make up for the cursor row. The page is cut in
+        # key order, since that is the order the next request continues in
+        query = thread.order_by_key().start_at(since)
+        query = query.limit_to_first(limit + 1) if limit else query
+        messages = sorted((m for m in normalize_messages(query.get()) if m['id'] != since), key=lambda m: m['id'])
+        messages = normalize_messages({m['id']: m for m in (messages[:limit] if limit else messages)})
+    elif limit:
+        messages = normalize_messages(thread.order_by_key().limit_to_last(limit).get())
+    else:
+        messages = normalize_messages(thread.get())
+    # The largest key, not the newest timestamp: a ``since`` push id continues in key order, and
+    # keys and timestamps disagree when a client clock is off or data was imported
+    cursor = max((m['id'] for m in messages), default=None) or since
+    return messages, cursor
+
+
+def etag_for(patient_uid: str, since: Optional[str], messages: List[dict]) -> str:
+    ids = ','.join(m['id'] for m in messages)
+    return hashlib.sha1(f'{patient_uid}|{since or ""}|{ids}'.encode('utf-8')).hexdigest()
@@ -0,0 +1,605 @@
+"""In-process stand-ins for Firebase and Gemini, for benchmarks and local runs.
+
+* ``FakeStore`` / ``FakeReference`` mimic the parts of the firebase_admin
+  RTDB ``Reference``/``Query`` API the app uses: get (incl. shallow), set,
+  update (multi-path), push, delete, transaction, ordered and ranged queries,
+  and ``listen`` with put events.  Server timestamps are resolved on write.
+* ``FakeAuth`` replaces ``admin_auth`` user creation, bulk import and
+  ID-token verification; ``IdentityToolkitServer`` serves
+  ``accounts:signInWithPassword`` and the Secure Token refresh endpoint over
+  local HTTP, so the app's real ``http_client`` code path is exercised.
+* ``FakeGenerativeModel`` answers ``generate_content`` (plain or streamed)
+  after a configurable latency with a configurable amount of text.
+
+``install()`` patches ``firebase_admin`` and ``google.generativeai`` and points
+the Identity Toolkit URLs at the local server.  It must run before ``config``
+or ``app`` is imported.
+"""
+
+import collections
+import copy
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qs
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+SERVER_TIMESTAMP = {'.sv': 'timestamp'}
+
+
+def _split(path: str):
+    return [p for p in str(path).strip('/').split('/') if p]
+
+
+def _resolve(value):
+    """Stored form of a written value: server timestamps filled in, lists as dicts, nulls dropped."""
+    if isinstance(value, dict):
+        if value == SERVER_TIMESTAMP:
+            return int(time.time() * 1000)
+        value = {str(k): _resolve(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        value = {str(i): _resolve(v) for i, v in enumerate(value)}
+    else:
+        return value
+    return {k: v for k, v in value.items() if v is not None and v != {}}
+
+
+def _export(value):
+    """What a read returns: dicts with mostly sequential integer keys come back as lists, like RTDB."""
+    if isinstance(value, dict):
+        if not value:
+            return None
+        keys = list(value)
+        if all(k.isdigit() for k in keys):
+            highest = max(int(k) for k in keys)
+            if len(keys) * 2 > highest + 1:
+                return [_export(value.get(str(i))) for i in range(highest + 1)]
+        return {k: _export(v) for k, v in value.items()}
+    return copy.deepcopy(value)
+
+
+class FakeStore:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.root = {}
+        self.calls = collections.Counter()
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._push_counter = itertools.count()
+
+    def _wait(self, op: str) -> None:
+        self.calls[op] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _node(self, parts, create: bool = False):
+        node = self.root
+        for part in parts:
+            if not isinstance(node, dict):
+                return None
+            if part not in node:
+                if not create:
+                    return None
+                node[part] = {}
+            node = node[part]
+        return node
+
+    def read(self, parts):
+        with self._lock:
+            return copy.deepcopy(self._node(parts))
+
+    def write(self, parts, value) -> None:
+        with self._lock:
+            self._write(parts, value)
+        self._notify(parts)
+
+    def _write(self, parts, value) -> None:
+        value = _resolve(value)
+        if not parts:
+            self.root = value if isinstance(value, dict) else {}
+            return
+        parent = self._node(parts[:-1], create=True)
+        if value is None or value == {}:
+            parent.pop(parts[-1], None)
+        else:
+            parent[parts[-1]] = value
+        # Like RTDB, drop parents left empty
+        for depth in range(len(parts) - 1, 0, -1):
+            if self._node(parts[:depth]) != {}:
+                break
+            self._node(parts[:depth - 1]).pop(parts[depth - 1], None)
+
+    def write_many(self, base, updates: dict) -> None:
+        paths = [base + _split(path) for path in updates]
+        for a in paths:
+            for b in paths:
+                if a is not b and b[:len(a)] == a:
+                    raise ValueError('Multi-location update paths must not overlap.')
+        with self._lock:
+            for parts, value in zip(paths, updates.values()):
+                self._write(parts, value)
+        for parts in paths:
+            self._notify(parts)
+
+    def push_id(self) -> str:
+        now = int(time.time() * 1000)
+        stamp = ''
+        for _ in range(8):
+            stamp = PUSH_CHARS[now % 64] + stamp
+            now //= 64
+        n = next(self._push_counter)
+        tail = ''
+        for _ in range(12):
+            tail = PUSH_CHARS[n % 64] + tail
+            n //= 64
+        return stamp + tail
+
+    def _notify(self, parts) -> None:
+        if not self._listeners:
+            return
+        path = '/' + '/'.join(parts)
+        data = _export(self.read(parts))
+        for base, callback in list(self._listeners):
+            if path == base or path.startswith(base.rstrip('/') + '/'):
+                callback('put', path[len(base.rstrip('/')):] or '/', data)
+
+
+class FakeEvent:
+    def __init__(self, event_type: str, path: str, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class FakeListenerRegistration:
+    def __init__(self, store: FakeStore, entry):
+        self._store = store
+        self._entry = entry
+
+    def close(self) -> None:
+        if self._entry in self._store._listeners:
+            self._store._listeners.remove(self._entry)
+
+
+def _index(key: str, value, order_by: str):
+    """RTDB ordering: null, false, true, numbers, strings, objects; ties by key."""
+    if order_by == '$key':
+        if key.lstrip('-').isdigit():
+            return (3, int(key), key)
+        return (4, key, key)
+    target = value
+    if order_by != '$value':
+        for part in order_by.split('/'):
+            target = target.get(part) if isinstance(target, dict) else None
+    if target is None:
+        return (0, 0, key)
+    if isinstance(target, bool):
+        return (1 if not target else 2, 0, key)
+    if isinstance(target, (int, float)):
+        return (3, target, key)
+    if isinstance(target, str):
+        return (4, target, key)
+    return (5, 0, key)
+
+
+class FakeQuery:
+    def __init__(self, ref: 'FakeReference', order_by: str):
+        self._ref = ref
+        self._order_by = order_by
+        self._start = self._end = self._equal = None
+        self._has_equal = False
+        self._first = self._last = None
+
+    def start_at(self, value):
+        self._start = value
+        return self
+
+    def end_at(self, value):
+        self._end = value
+        return self
+
+    def equal_to(self, value):
+        self._equal, self._has_equal = value, True
+        return self
+
+    def limit_to_first(self, n: int):
+        self._first = n
+        return self
+
+    def limit_to_last(self, n: int):
+        self._last = n
+        return self
+
+    def _bound(self, value):
+        if self._order_by == '$key':
+            return _index(str(value), None, '$key')[:2]
+        return _index('', value, '$value')[:2]
+
+    def get(self):
+        store = self._ref._store
+        store._wait('query')
+        raw = store.read(_split(self._ref.path))
+        if not isinstance(raw, dict):
+            return _export(raw)
+        entries = sorted((_index(k, v, self._order_by), k, v) for k, v in raw.items())
+        out = []
+        for index, key, value in entries:
+            if self._has_equal and index[:2] != self._bound(self._equal):
+                continue
+            if self._start is not None and index[:2] < self._bound(self._start):
+                continue
+            if self._end is not None and index[:2] > self._bound(self._end):
+                continue
+            out.append((key, value))
+        if self._first is not None:
+            out = out[:self._first]
+        if self._last is not None:
+            out = out[-self._last:] if self._last else []
+        return collections.OrderedDict((k, _export(v)) for k, v in out)
+
+
+class FakeReference:
+    def __init__(self, path: str = '/', store: Optional[FakeStore] = None):
+        self.path = '/' + '/'.join(_split(path))
+        self._store = store if store is not None else default_store
+
+    @property
+    def key(self) -> Optional[str]:
+        parts = _split(self.path)
+        return parts[-1] if parts else None
+
+    @property
+    def parent(self) -> Optional['FakeReference']:
+        parts = _split(self.path)
+        return FakeReference('/'.join(parts[:-1]), self._store) if parts else None
+
+    def child(self, path: str) -> 'FakeReference':
+        return FakeReference(self.path.rstrip('/') + '/' + str(path), self._store)
+
+    def get(self, etag: bool = False, shallow: bool = False):
+        self._store._wait('get')
+        value = self._store.read(_split(self.path))
+        if shallow and isinstance(value, dict):
+            value = {k: True for k in value}
+        value = _export(value)
+        if etag:
+            return value, uuid.uuid5(uuid.NAMESPACE_URL, json.dumps(value, sort_keys=True, default=str)).hex
+        return value
+
+    def set(self, value) -> None:
+        self._store._wait('set')
+        self._store.write(_split(self.path), value)
+
+    def update(self, value: dict) -> None:
+        self._store._wait('update')
+        self._store.write_many(_split(self.path), value)
+
+    def push(self, value='') -> 'FakeReference':
+        self._store._wait('push')
+        ref = self.child(self._store.push_id())
+        if value != '':
+            self._store.write(_split(ref.path), value)
+        return ref
+
+    def delete(self) -> None:
+        self._store._wait('delete')
+        self._store.write(_split(self.path), None)
+
+    def transaction(self, transaction_update: Callable):
+        self._store._wait('transaction')
+        with self._store._lock:
+            value = transaction_update(_export(self._store.read(_split(self.path))))
+            self._store._write(_split(self.path), value)
+        self._store._notify(_split(self.path))
+        return value
+
+    def order_by_key(self) -> FakeQuery:
+        return FakeQuery(self, '$key')
+
+    def order_by_value(self) -> FakeQuery:
+        return FakeQuery(self, '$value')
+
+    def order_by_child(self, path: str) -> FakeQuery:
+        return FakeQuery(self, path)
+
+    def listen(self, callback: Callable) -> FakeListenerRegistration:
+        base = self.path
+
+        def deliver(event_type, path, data):
+            callback(FakeEvent(event_type, path, data))
+
+        entry = (base, deliver)
+        callback(FakeEvent('put', '/', _export(self._store.read(_split(base)))))
+        self._store._listeners.append(entry)
+        return FakeListenerRegistration(self._store, entry)
+
+
+default_store = FakeStore()
+
+
+class FakeUser:
+    def __init__(self, uid: str, email: str, password: Optional[str], display_name: Optional[str] = None):
+        self.uid = uid
+        self.email = email
+        self.password = password
+        self.display_name = display_name
+        # Set for users loaded with import_users; only PBKDF2_SHA256 can be checked at sign-in
+        self.password_hash = None
+        self.password_salt = None
+        self.hash_config = None
+
+    def check_password(self, password: str) -> bool:
+        if self.password_hash is None:
+            return self.password == password
+        config = self.hash_config or {}
+        if config.get('hashAlgorithm') != 'PBKDF2_SHA256':
+            return False
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), self.password_salt or b'',
+                                     max(1, config.get('rounds', 1)))
+        return hmac.compare_digest(digest, self.password_hash)
+
+
+class FakeAuth:
+    """User accounts and ID tokens for ``admin_auth`` and the Identity Toolkit server."""
+
+    def __init__(self, latency: float = 0.0, token_lifetime: int = 3600):
+        self.latency = latency
+        self.token_lifetime = token_lifetime
+        self.users = {}
+        self.uids_by_email = {}
+        self.tokens = {}
+        self.refresh_tokens = {}
+        self._lock = threading.Lock()
+
+    def create_user(self, email: str, password: str, display_name: Optional[str] = None, uid: Optional[str] = None,
+                    **kwargs) -> FakeUser:
+        from firebase_admin import auth as admin_auth
+        with self._lock:
+            if email in self.uids_by_email:
+                raise admin_auth.EmailAlreadyExistsError('The user with the provided email already exists.',
+                                                         None, None)
+            user = FakeUser(uid or uuid.uuid4().hex[:28], email, password, display_name)
+            self.users[user.uid] = user
+            self.uids_by_email[email] = user.uid
+        return user
+
+    def import_users(self, users, hash_alg=None):
+        """Bulk upsert by uid, like ``admin_auth.import_users`` (which skips uniqueness checks too)."""
+        from firebase_admin import auth as admin_auth
+        if len(users) > 1000:
+            raise ValueError('Users must be a non-empty list with no more than 1000 elements.')
+        config = hash_alg.to_dict() if hash_alg is not None else None
+        errors = []
+        with self._lock:
+            for index, record in enumerate(users):
+                if record.password_hash is not None and config is None:
+                    errors.append({'index': index, 'message': 'hash_alg is required for password hashes'})
+                    continue
+                previous = self.users.get(record.uid)
+                if previous is not None and self.uids_by_email.get(previous.email) == record.uid:
+                    del self.uids_by_email[previous.email]
+                user = FakeUser(record.uid, record.email, None, record.display_name)
+                user.password_hash = record.password_hash
+                user.password_salt = record.password_salt
+                user.hash_config = config
+                self.users[user.uid] = user
+                if user.email:
+                    self.uids_by_email[user.email] = user.uid
+        return admin_auth.UserImportResult({'error': errors}, len(users))
+
+    def get_user_by_email(self, email: str) -> FakeUser:
+        from firebase_admin import auth as admin_auth
+        user = self.users.get(self.uids_by_email.get(email))
+        if user is None:
+            raise admin_auth.UserNotFoundError(f'No user record found for the provided email: {email}.')
+        return user
+
+    def update_user(self, uid: str, **kwargs) -> FakeUser:
+        user = self.users[uid]
+        with self._lock:
+            if 'email' in kwargs and kwargs['email'] != user.email:
+                self.uids_by_email.pop(user.email, None)
+                self.uids_by_email[kwargs['email']] = uid
+            for field in ('password', 'display_name', 'email'):
+                if field in kwargs:
+                    setattr(user, field, kwargs[field])
+            if 'password' in kwargs:
+                user.password_hash = None
+        return user
+
+    def issue_token(self, uid: str) -> dict:
+        id_token = 'fake-id-' + uuid.uuid4().hex
+        refresh_token = 'fake-refresh-' + uuid.uuid4().hex
+        now = time.time()
+        user = self.users.get(uid)
+        with self._lock:
+            self.tokens[id_token] = {'uid': uid, 'email': user.email if user else None,
+                                     'iat': int(now), 'exp': int(now + self.token_lifetime)}
+            self.refresh_tokens[refresh_token] = uid
+        return {'idToken': id_token, 'refreshToken': refresh_token, 'expiresIn': str(self.token_lifetime)}
+
+    def sign_in(self, email: str, password: str) -> Optional[dict]:
+        user = self.users.get(self.uids_by_email.get(email))
+        if user is None or not user.check_password(password or ''):
+            return None
+        return dict(self.issue_token(user.uid), localId=user.uid, email=email)
+
+    def verify_id_token(self, id_token: str, *args, **kwargs) -> dict:
+        from firebase_admin import auth as admin_auth
+        if self.latency:
+            time.sleep(self.latency)
+        claims = self.tokens.get(id_token)
+        if claims is None or claims['exp'] < time.time():
+            raise admin_auth.InvalidIdTokenError('Invalid or expired ID token.')
+        return dict(claims)
+
+
+class IdentityToolkitServer:
+    """Local HTTP stand-in for the Identity Toolkit and Secure Token REST endpoints."""
+
+    def __init__(self, auth: FakeAuth, latency: float = 0.0):
+        self.auth = auth
+        self.latency = latency
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+                path = self.path.split('?', 1)[0]
+                if path.endswith('accounts:signInWithPassword'):
+                    payload = json.loads(body or '{}')
+                    result = server.auth.sign_in(payload.get('email'), payload.get('password'))
+                    if result is None:
+                        return self._reply(400, {'error': {'code': 400, 'message': 'INVALID_LOGIN_CREDENTIALS'}})
+                    return self._reply(200, result)
+                if path.endswith('/token'):
+                    form = {k: v[0] for k, v in parse_qs(body).items()}
+                    uid = server.auth.refresh_tokens.get(form.get('refresh_token'))
+                    if uid is None:
+                        return self._reply(400, {'error': {'code': 400, 'message': 'INVALID_REFRESH_TOKEN'}})
+                    issued = server.auth.issue_token(uid)
+                    return self._reply(200, {'id_token': issued['idToken'], 'refresh_token': issued['refreshToken'],
+                                             'expires_in': issued['expiresIn'], 'user_id': uid})
+                self._reply(404, {'error': {'code': 404, 'message': 'NOT_FOUND'}})
+
+            def _reply(self, status: int, payload: dict) -> None:
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='identity-toolkit', daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = 0
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text: str, usage: Optional[FakeUsage] = None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class FakeStreamResponse:
+    def __init__(self, chunks, usage: FakeUsage, delay: float):
+        self._chunks = chunks
+        self._delay = delay
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if self._delay:
+                time.sleep(self._delay)
+            yield FakeResponse(chunk)
+
+
+class FakeGenerativeModel:
+    """``GenerativeModel`` replacement; class attributes configure every instance."""
+
+    latency = 0.0
+    output_chars = 400
+    stream_chunks = 8
+    # Optional ``reply(model_name, prompt) -> str``; defaults to filler text (JSON for analysis prompts)
+    reply: Optional[Callable[[str, str], str]] = None
+    calls = collections.Counter()
+
+    def __init__(self, model_name: str = 'gemini-pro', system_instruction=None, **kwargs):
+        self.model_name = model_name if '/' in model_name else f'models/{model_name}'
+        self.system_instruction = system_instruction
+
+    def _text(self, prompt: str) -> str:
+        if self.reply is not None:
+            return type(self).reply(self.model_name, prompt)
+        filler = ('lorem ipsum dolor sit amet ' * (self.output_chars // 27 + 1))[:self.output_chars]
+        if 'Patient chat history (JSON)' in prompt:
+            return json.dumps({'summary': filler, 'highlights': [], 'criticalFlags': []})
+        return filler
+
+    def generate_content(self, prompt, stream: bool = False, **kwargs):
+        FakeGenerativeModel.calls[self.model_name] += 1
+        prompt = str(prompt)
+        text = self._text(prompt)
+        instruction = len(str(self.system_instruction or ''))
+        usage = FakeUsage((len(prompt) + instruction) // 4, len(text) // 4)
+        if not stream:
+            if self.latency:
+                time.sleep(self.latency)
+            return FakeResponse(text, usage)
+        size = max(1, len(text) // max(1, self.stream_chunks))
+        chunks = [text[i:i + size] for i in range(0, len(text), size)] or ['']
+        return FakeStreamResponse(chunks, usage, self.latency / len(chunks))
+
+    def count_tokens(self, contents):
+        return FakeUsage(len(str(contents)) // 4, 0)
+
+
+class Installed:
+    def __init__(self, store: FakeStore, auth: FakeAuth, identity_toolkit: IdentityToolkitServer):
+        self.store = store
+        self.auth = auth
+        self.identity_toolkit = identity_toolkit
+
+
+def install(rtdb_latency: float = 0.0, auth_latency: float = 0.0, llm_latency: float = 0.0,
+            llm_output_chars: int = 400) -> Installed:
+    """Patch firebase_admin and google.generativeai with the fakes above (before importing ``app``)."""
+    import firebase_admin
+    from firebase_admin import auth as admin_auth, credentials, db
+    import google.generativeai as genai
+
+    store = default_store
+    store.latency = rtdb_latency
+    auth = FakeAuth(latency=auth_latency)
+    identity_toolkit = IdentityToolkitServer(auth, latency=auth_latency)
+
+    for name, value in {
+        'FIREBASE_API_KEY': 'fake-api-key', 'FIREBASE_AUTH_DOMAIN': 'localhost',
+        'FIREBASE_DATABASE_URL': 'https://fake.firebaseio.test', 'FIREBASE_PROJECT_ID': 'fake-project',
+        'FIREBASE_PRIVATE_KEY': 'fake', 'FIREBASE_CLIENT_EMAIL': 'fake@localhost',
+        'GEMINI_API_KEY': 'fake', 'FLASK_SECRET_KEY': 'fake-secret',
+    }.items():
+        os.environ.setdefault(name, value)
+    os.environ['IDENTITY_TOOLKIT_URL'] = identity_toolkit.url
+    os.environ['SECURETOKEN_URL'] = identity_toolkit.url
+
+    credentials.Certificate = lambda *args, **kwargs: object()
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    db.reference = lambda path='/', app=None, url=None: FakeReference(path, store)
+    admin_auth.create_user = auth.create_user
+    admin_auth.get_user_by_email = auth.get_user_by_email
+    admin_auth.update_user = auth.update_user
+    admin_auth.import_users = auth.import_users
+    admin_auth.verify_id_token = auth.verify_id_token
+
+    FakeGenerativeModel.latency = llm_latency
+    FakeGenerativeModel.output_chars = llm_output_chars
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = FakeGenerativeModel
+    return Installed(store, auth, identity_toolkit)
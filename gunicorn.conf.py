@@ -0,0 +1,84 @@
+"""Gunicorn settings; render.yaml starts the app with ``gunicorn -c gunicorn.conf.py app:app``.
+
+WEB_WORKER_CLASS picks the execution mode:
+
+* ``gthread`` (default): WEB_THREADS OS threads per worker. Every in-flight
+  Gemini, RTDB or Identity Toolkit call holds one of them. The admission
+  limits for chat, synchronous analyses, cohort runs and live message streams
+  are derived from WEB_THREADS so that together they leave at least one
+  thread for the cheap routes.
+* ``gevent`` (opt-in): cooperative workers. Outbound I/O yields to other
+  requests, so a worker can keep hundreds of slow LLM calls and SSE streams
+  open at once. Gemini is switched to its REST transport, since gRPC does not
+  cooperate with gevent's monkey patching, and the per-process limits below
+  are raised. Not everything yields, though: the search index (sqlite3) and
+  the shared quota files of GEMINI_RATE_STATE_DIR (``fcntl.flock``) block the
+  whole worker while they run. Use gevent only with the search index in memory
+  or small, and without GEMINI_RATE_STATE_DIR.
+
+Importing the app creates no clients (see clients.py), so workers boot in
+about a second and serve pages that need neither Firebase nor Gemini right
+away; each worker then imports those SDKs in a background thread, ahead of the
+first login or chat. With WEB_PRELOAD=1 (ignored under gevent, whose monkey
+patching must come before these imports) the master imports the app and the
+SDKs once and workers fork with them loaded: less memory per worker and fast
+respawns, but the first boot waits for the imports. Either way each worker
+opens its own connections. Required settings are checked once the master is
+up, so a missing variable stops the deploy instead of failing requests.
+"""
+
+import os
+import threading
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+threads = int(os.environ.get('WEB_THREADS', '8'))
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', '1000'))
+timeout = 120
+preload_app = os.environ.get('WEB_PRELOAD', '0') == '1' and worker_class != 'gevent'
+
+if worker_class == 'gevent':
+    # Read by config.py when each worker imports the app
+    os.environ.setdefault('GEMINI_TRANSPORT', 'rest')
+    os.environ.setdefault('LLM_CHAT_CONCURRENCY', '200')
+    os.environ.setdefault('LLM_ANALYSIS_CONCURRENCY', '20')
+    os.environ.setdefault('MESSAGE_STREAM_MAX_CLIENTS', '500')
+    os.environ.setdefault('HTTP_POOL_SIZE', '50')
+    # A waiting poll only parks a greenlet here
+    os.environ.setdefault('ANALYSIS_JOB_MAX_WAIT', '20')
+else:
+    # One thread stays free for cheap routes, one each goes to a cohort run and a Pro analysis call;
+    # of the rest a third serves message streams (none below 6 threads: browsers poll instead) and
+    # the remainder chat. 8 threads: 4 chats, 1 analysis, 1 cohort run, 1 stream.
+    shared = max(1, threads - 3)
+    os.environ.setdefault('COHORT_MAX_RUNS', '1')
+    os.environ.setdefault('LLM_ANALYSIS_CONCURRENCY', '1')
+    os.environ.setdefault('MESSAGE_STREAM_MAX_CLIENTS', str(shared // 3))
+    os.environ.setdefault('LLM_CHAT_CONCURRENCY', str(max(1, shared - shared // 3)))
+    os.environ.setdefault('HTTP_POOL_SIZE', str(threads))
+
+
+def when_ready(server):
+    import config
+    config.validate()
+    if not config.metrics_token and not config.metrics_public:
+        server.log.warning('METRICS_TOKEN is not set; /metrics will answer 401')
+    if worker_class == 'gevent' and config.gemini_rate_state_dir:
+        server.log.warning('GEMINI_RATE_STATE_DIR uses blocking file locks, which stall gevent workers')
+    if worker_class != 'gevent':
+        held = (config.llm_chat_concurrency + config.llm_analysis_concurrency + config.cohort_max_runs
+                + config.message_stream_max_clients)
+        if held >= threads:
+            server.log.warning('Chat, analysis, cohort and message-stream limits add up to %d of %d threads; '
+                               'cheap routes can be starved', held, threads)
+    if preload_app:
+        import clients
+        clients.import_sdks()
+        server.log.info('SDKs preloaded: %s', clients.report())
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        import clients
+        threading.Thread(target=clients.import_sdks, name='import-sdks', daemon=True).start()
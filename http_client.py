@@ -0,0 +1,76 @@
+"""Shared HTTP client for outbound REST calls (Identity Toolkit, Secure Token).
+
+One ``requests.Session`` per process keeps TLS connections alive between
+logins, every call gets connect/read timeouts, and failures are retried a
+bounded number of times with jittered exponential backoff (honouring
+``Retry-After``).  Idempotent requests are retried after read timeouts and
+429/5xx answers; POSTs (sign-up, sign-in) only when they cannot have been
+processed: the connection failed, or the server answered 429.
+"""
+
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Answers that mean the request was refused unprocessed, so any method may be resent
+REFUSED_STATUSES = (429,)
+
+
+class _Retry(Retry):
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        # Read timeouts on non-idempotent methods are never retried: urllib3 checks allowed_methods
+        if not (status_code in REFUSED_STATUSES or self._is_method_retryable(method)):
+            return False
+        return bool(self.total and self.status_forcelist and status_code in self.status_forcelist)
+
+
+class HttpClient:
+    def __init__(self, pool_size: int = 4, connect_timeout: float = 3.05, read_timeout: float = 10,
+                 retries: int = 2, backoff: float = 0.3):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = _Retry(
+            total=retries,
+            backoff_factor=backoff,
+            backoff_jitter=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """The process-wide client, created on first use (i.e. after gunicorn forks)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from config import http_pool_size, http_connect_timeout, http_read_timeout, http_retries
+                _client = HttpClient(pool_size=http_pool_size, connect_timeout=http_connect_timeout,
+                                     read_timeout=http_read_timeout, retries=http_retries)
+    return _client
@@ -0,0 +1,190 @@
+"""A small bounded background job queue with de-duplication and long-polling.
+
+Jobs are identified by a random id and grouped by a caller-chosen ``key``:
+submitting a key that already has a queued or running job returns that job
+instead of starting another one.  Finished jobs are kept for ``keep_finished``
+seconds so clients can still collect the result.
+
+``sweep``, when given, runs on a worker thread at the first submit and then at
+most every ``sweep_interval`` seconds, to clean up after jobs this queue no
+longer knows about (e.g. records mirrored by a process that has since exited).
+"""
+
+import collections
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class QueueFull(Exception):
+    """Raised by ``JobQueue.submit`` when no more jobs can be accepted."""
+
+
+class Job:
+    def __init__(self, key: str, info: Optional[dict] = None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.info = dict(info or {})
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def to_dict(self, include_result: bool = True) -> dict:
+        out = {
+            'jobId': self.id,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'info': self.info,
+        }
+        if self.error:
+            out['error'] = self.error
+        if include_result and self.status == DONE:
+            out['result'] = self.result
+        return out
+
+
+class JobQueue:
+    def __init__(self, max_workers: int = 2, max_queued: int = 50, keep_finished: float = 600,
+                 on_update: Optional[Callable[[Job], None]] = None,
+                 on_expire: Optional[Callable[[Job], None]] = None, name: str = 'jobs',
+                 sweep: Optional[Callable[[], None]] = None, sweep_interval: float = 600):
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self.on_update = on_update
+        self.on_expire = on_expire
+        self.sweep = sweep
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = {}
+        self._durations = collections.deque(maxlen=500)
+        self._counts = collections.Counter()
+
+    def submit(self, key: str, fn: Callable[[], object], info: Optional[dict] = None) -> Tuple[Job, bool]:
+        """Queue ``fn`` under ``key``; returns ``(job, created)``."""
+        with self._lock:
+            expired = self._expire()
+            sweep = self.sweep is not None and time.time() >= self._next_sweep
+            if sweep:
+                self._next_sweep = time.time() + self.sweep_interval
+            job = self._active.get(key)
+            created = job is None
+            if not created:
+                self._counts['deduplicated'] += 1
+            else:
+                queued = sum(1 for j in self._active.values() if j.status == QUEUED)
+                if queued >= self.max_queued:
+                    self._counts['rejected'] += 1
+                    raise QueueFull(f'{queued} jobs already queued')
+                job = Job(key, info)
+                self._jobs[job.id] = job
+                self._active[key] = job
+                self._counts['submitted'] += 1
+        for old in expired:
+            self._notify(old, self.on_expire)
+        if sweep:
+            self._executor.submit(self._run_sweep)
+        if created:
+            self._notify(job)
+            self._executor.submit(self._run, job, fn)
+        return job, created
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Block up to ``timeout`` seconds for the job to finish (long-poll)."""
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.wait(timeout)
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = list(self._active.values())
+            durations = sorted(self._durations)
+            counts = dict(self._counts)
+        out = {
+            'queued': sum(1 for j in active if j.status == QUEUED),
+            'running': sum(1 for j in active if j.status == RUNNING),
+            'maxQueued': self.max_queued,
+            'counts': counts,
+        }
+        if durations:
+            out['durationSeconds'] = {
+                'count': len(durations),
+                'avg': round(sum(durations) / len(durations), 3),
+                'p50': round(durations[len(durations) // 2], 3),
+                'p95': round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 3),
+                'max': round(durations[-1], 3),
+            }
+        return out
+
+    def _run(self, job: Job, fn: Callable[[], object]) -> None:
+        job.status = RUNNING
+        job.started = time.time()
+        self._notify(job)
+        try:
+            job.result = fn()
+            job.status = DONE
+        except Exception as e:
+            traceback.print_exc()
+            job.error = e.__class__.__name__
+            job.status = ERROR
+        job.finished = time.time()
+        with self._lock:
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+            self._durations.append(job.duration)
+            self._counts['completed' if job.status == DONE else 'failed'] += 1
+        self._notify(job)
+        job._done.set()
+
+    def _run_sweep(self) -> None:
+        try:
+            self.sweep()
+        except Exception:
+            traceback.print_exc()
+
+    def _notify(self, job: Job, callback: Optional[Callable[[Job], None]] = None) -> None:
+        callback = callback or self.on_update
+        if callback is None:
+            return
+        try:
+            callback(job)
+        except Exception:
+            traceback.print_exc()
+
+    def _expire(self) -> list:
+        cutoff = time.time() - self.keep_finished
+        stale = [j for j in self._jobs.values() if j.finished is not None and j.finished < cutoff]
+        for job in stale:
+            del self._jobs[job.id]
+        return stale
@@ -0,0 +1,260 @@
+"""Quota-aware scheduling of Gemini calls.
+
+Every ``generate_content`` call goes through a ``Scheduler`` which
+
+* enforces requests-per-minute and tokens-per-minute token buckets per
+  model, either in memory (one process) or in a small JSON state file guarded
+  by ``fcntl.flock`` so that all gunicorn workers on a host share one budget;
+* hands out capacity by priority class, so a queued patient chat is always
+  admitted before queued background summaries or clinician analyses;
+* retries 429/503 answers a bounded number of times with jittered
+  exponential backoff.
+
+``Scheduler.wrap(model, priority)`` returns an object with the same
+``generate_content`` signature, so any model-like object (including a fake
+in tests) can be scheduled.
+"""
+
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+INTERACTIVE = 0
+BACKGROUND = 1
+ANALYSIS = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background', ANALYSIS: 'analysis'}
+
+RETRY_STATUS_CODES = (429, 503)
+RETRY_ERROR_NAMES = ('ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable')
+
+
+class Overloaded(Exception):
+    """No capacity within the queue timeout, or the model kept answering 429/503."""
+
+    def __init__(self, message: str, retry_after: float = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_retryable(error: Exception) -> bool:
+    code = getattr(error, 'code', None)
+    if isinstance(code, int) and code in RETRY_STATUS_CODES:
+        return True
+    return type(error).__name__ in RETRY_ERROR_NAMES
+
+
+def estimate_tokens(prompt) -> int:
+    return (len(str(prompt)) + 3) // 4
+
+
+class RateLimiter:
+    """Requests and tokens per minute for one model.
+
+    With ``state_path`` the bucket levels live in a file shared by every
+    process on the host; otherwise they are kept in memory.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, state_path: Optional[str] = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state = {'requests': float(rpm), 'tokens': float(tpm), 'updated': time.time()}
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rpm <= 0 and self.tpm <= 0
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        if not self.state_path:
+            with self._lock:
+                yield self._state
+            return
+        import fcntl
+        with self._lock, open(self.state_path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                state = json.loads(raw) if raw else dict(self._state)
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state: dict, now: float) -> None:
+        elapsed = max(0.0, now - state['updated'])
+        if self.rpm > 0:
+            state['requests'] = min(float(self.rpm), state['requests'] + elapsed * self.rpm / 60)
+        if self.tpm > 0:
+            state['tokens'] = min(float(self.tpm), state['tokens'] + elapsed * self.tpm / 60)
+        state['updated'] = now
+
+    def try_acquire(self, tokens: int) -> float:
+        """Take one request and ``tokens`` tokens; returns 0, or seconds until they could be taken."""
+        if self.unlimited:
+            return 0.0
+        if self.tpm > 0:
+            tokens = min(tokens, self.tpm)
+        with self._locked_state() as state:
+            self._refill(state, time.time())
+            wait = 0.0
+            if self.rpm > 0 and state['requests'] < 1:
+                wait = max(wait, (1 - state['requests']) * 60 / self.rpm)
+            if self.tpm > 0 and state['tokens'] < tokens:
+                wait = max(wait, (tokens - state['tokens']) * 60 / self.tpm)
+            if wait == 0.0:
+                if self.rpm > 0:
+                    state['requests'] -= 1
+                if self.tpm > 0:
+                    state['tokens'] -= tokens
+            return wait
+
+    def adjust_tokens(self, delta: int) -> None:
+        """Correct the token bucket once the real usage is known (may go into debt)."""
+        if self.tpm <= 0 or not delta:
+            return
+        with self._locked_state() as state:
+            self._refill(state, time.time())
+            state['tokens'] = min(float(self.tpm), state['tokens'] - delta)
+
+
+class _ModelQueue:
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+        self.cond = threading.Condition()
+        self.waiters = []
+
+
+class Scheduler:
+    def __init__(self, queue_timeout: float = 20, max_retries: int = 3, backoff: float = 1.0,
+                 expected_output_tokens: int = 500):
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.expected_output_tokens = expected_output_tokens
+        self._queues = {}
+        self._seq = itertools.count()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def set_limits(self, model_name: str, rpm: int = 0, tpm: int = 0, state_dir: Optional[str] = None) -> None:
+        state_path = None
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+            state_path = os.path.join(state_dir, f"{model_name.replace('/', '_')}.json")
+        self._queues[model_name] = _ModelQueue(RateLimiter(rpm, tpm, state_path))
+
+    def _queue(self, model_name: str) -> _ModelQueue:
+        if model_name not in self._queues:
+            self._queues[model_name] = _ModelQueue(RateLimiter())
+        return self._queues[model_name]
+
+    def _count(self, model_name: str, priority: int, **increments) -> None:
+        key = (model_name, PRIORITY_NAMES.get(priority, str(priority)))
+        with self._stats_lock:
+            entry = self._stats.setdefault(key, {'requests': 0, 'retries': 0, 'throttled': 0,
+                                                 'failures': 0, 'waitSeconds': 0.0, 'queued': 0})
+            for name, value in increments.items():
+                entry[name] += value
+
+    def acquire(self, model_name: str, priority: int, tokens: int) -> float:
+        """Block until the model has capacity for this call; returns the time spent waiting."""
+        q = self._queue(model_name)
+        started = time.time()
+        deadline = started + self.queue_timeout
+        ticket = (priority, next(self._seq))
+        self._count(model_name, priority, queued=1)
+        with q.cond:
+            heapq.heappush(q.waiters, ticket)
+            try:
+                while True:
+                    wait = None
+                    if q.waiters[0] == ticket:
+                        wait = q.limiter.try_acquire(tokens)
+                        if wait == 0:
+                            return time.time() - started
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._count(model_name, priority, throttled=1)
+                        raise Overloaded(f'{model_name}: no capacity within {self.queue_timeout}s',
+                                         retry_after=max(1, round(wait or 5)))
+                    q.cond.wait(min(wait, remaining) if wait else remaining)
+            finally:
+                q.waiters.remove(ticket)
+                heapq.heapify(q.waiters)
+                q.cond.notify_all()
+                self._count(model_name, priority, queued=-1, waitSeconds=time.time() - started)
+
+    def _sleep_before_retry(self, attempt: int) -> None:
+        delay = self.backoff * (2 ** attempt)
+        time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+    def _record_usage(self, model_name: str, response, estimated: int) -> None:
+        usage = getattr(response, 'usage_metadata', None)
+        total = getattr(usage, 'total_token_count', None) if usage is not None else None
+        if isinstance(total, int) and total:
+            self._queue(model_name).limiter.adjust_tokens(total - estimated)
+
+    def generate(self, model, priority: int, prompt, **kwargs):
+        model_name = getattr(model, 'model_name', None) or type(model).__name__
+        estimated = estimate_tokens(prompt) + self.expected_output_tokens
+        attempt = 0
+        while True:
+            self.acquire(model_name, priority, estimated)
+            self._count(model_name, priority, requests=1)
+            try:
+                response = model.generate_content(prompt, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    self._count(model_name, priority, failures=1)
+                    raise
+                if attempt >= self.max_retries:
+                    self._count(model_name, priority, failures=1)
+                    raise Overloaded(f'{model_name}: still rate limited after {attempt} retries') from e
+                self._count(model_name, priority, retries=1)
+                self._sleep_before_retry(attempt)
+                attempt += 1
+                continue
+            if not kwargs.get('stream'):
+                self._record_usage(model_name, response, estimated)
+            return response
+
+    def wrap(self, model, priority: int) -> 'ScheduledModel':
+        return ScheduledModel(self, model, priority)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            out = {}
+            for (model_name, priority), entry in self._stats.items():
+                row = dict(entry, waitSeconds=round(entry['waitSeconds'], 3))
+                out.setdefault(model_name, {})[priority] = row
+        for model_name, q in self._queues.items():
+            out.setdefault(model_name, {})['limits'] = {'rpm': q.limiter.rpm, 'tpm': q.limiter.tpm,
+                                                       'shared': bool(q.limiter.state_path)}
+        return out
+
+
+class ScheduledModel:
+    """A model whose ``generate_content`` calls go through a ``Scheduler``."""
+
+    def __init__(self, scheduler: Scheduler, model, priority: int):
+        self.scheduler = scheduler
+        self.model = model
+        self.priority = priority
+
+    def generate_content(self, prompt, **kwargs):
+        return self.scheduler.generate(self.model, self.priority, prompt, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
@@ -0,0 +1,164 @@
+"""Per-process fan-out of new direct messages to SSE subscribers.
+
+Each worker opens a single listener on ``direct_messages_latest`` (lazily,
+when the first browser subscribes), where every send also writes the thread's
+newest message, and routes each new message to the queues of the browsers
+watching that patient's thread, so idle tabs cost no RTDB reads.
+
+RTDB streaming sends the whole node as a ``put`` at ``/`` when the listener
+connects (and again after it reconnects): one message per thread, not the
+threads themselves.  The first snapshot only records the newest key per
+thread so that nothing is delivered twice; after a reconnect, a watched
+thread whose newest key moved on is caught up through ``backfill``, since
+several messages may have arrived while the listener was down.
+"""
+
+import queue
+import threading
+from typing import Callable, Dict, List, Optional
+
+
+class Subscription:
+    def __init__(self, hub: 'MessageHub', thread_id: str, maxsize: int = 100):
+        self.hub = hub
+        self.thread_id = thread_id
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout: float) -> Optional[dict]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self)
+
+
+class MessageHub:
+    def __init__(self, ref, max_subscribers: int = 100,
+                 backfill: Optional[Callable[[str, str], List[dict]]] = None):
+        self.ref = ref
+        self.max_subscribers = max_subscribers
+        # ``backfill(thread_id, after_key)`` -> messages after that key, each with its ``id``
+        self.backfill = backfill
+        self._lock = threading.Lock()
+        # Guards the listener registration; separate from _lock, which the listener's callbacks take
+        self._listen_lock = threading.Lock()
+        self._subscribers: Dict[str, List[Subscription]] = {}
+        self._last_key: Dict[str, str] = {}
+        self._registration = None
+        self._synced = False
+        self.delivered = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def subscribe(self, thread_id: str) -> Optional[Subscription]:
+        """Register interest in one thread; ``None`` when the process is at capacity.
+
+        Raises if the RTDB listener cannot be opened.
+        """
+        with self._lock:
+            if sum(len(subs) for subs in self._subscribers.values()) >= self.max_subscribers:
+                return None
+            sub = Subscription(self, thread_id)
+            self._subscribers.setdefault(thread_id, []).append(sub)
+        try:
+            self._ensure_listening()
+        except Exception:
+            # Otherwise the slot stays taken by a stream that never started
+            self.unsubscribe(sub)
+            raise
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.thread_id, [])
+            if sub in subs:
+                subs.remove(sub)
+            if not subs:
+                self._subscribers.pop(sub.thread_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'threads': len(self._subscribers),
+                'subscribers': sum(len(subs) for subs in self._subscribers.values()),
+                'maxSubscribers': self.max_subscribers,
+                'listening': self._is_listening(),
+                'delivered': self.delivered,
+            }
+
+    def close(self) -> None:
+        with self._listen_lock:
+            registration, self._registration = self._registration, None
+        if registration is not None:
+            registration.close()
+
+    def _is_listening(self) -> bool:
+        thread = getattr(self._registration, '_thread', None)
+        return self._registration is not None and (thread is None or thread.is_alive())
+
+    def _ensure_listening(self) -> None:
+        with self._listen_lock:
+            if self._is_listening():
+                return
+            self._registration = self.ref.listen(self._on_event)
+
+    def _on_event(self, event) -> None:
+        parts = [p for p in (event.path or '/').split('/') if p]
+        data = event.data
+        if event.event_type == 'patch' and isinstance(data, dict):
+            for sub_path, value in data.items():
+                self._apply(parts + [p for p in sub_path.split('/') if p], value)
+        else:
+            self._apply(parts, data)
+
+    def _apply(self, parts: List[str], data) -> None:
+        if not parts:
+            # Snapshot on (re)connect: the first one only sets the starting point
+            for thread_id, latest in (data or {}).items() if isinstance(data, dict) else ():
+                if self._synced:
+                    self._catch_up(thread_id, latest)
+                else:
+                    self._absorb(thread_id, [latest], deliver=False)
+            self._synced = True
+        elif len(parts) == 1:
+            # One send: the thread's new latest message
+            self._absorb(parts[0], [data], deliver=True)
+
+    def _catch_up(self, thread_id: str, latest) -> None:
+        last = self._last_key.get(thread_id)
+        with self._lock:
+            watched = thread_id in self._subscribers
+        if watched and last and self.backfill is not None and isinstance(latest, dict) \
+                and str(latest.get('id', '')) > last:
+            try:
+                self._absorb(thread_id, self.backfill(thread_id, last), deliver=True)
+                return
+            except Exception:
+                pass
+        self._absorb(thread_id, [latest], deliver=True)
+
+    def _absorb(self, thread_id: str, messages: List, deliver: bool) -> None:
+        last = self._last_key.get(thread_id, '')
+        new = sorted((m for m in messages if isinstance(m, dict) and str(m.get('id', '')) > last),
+                     key=lambda m: m['id'])
+        if not new:
+            return
+        self._last_key[thread_id] = new[-1]['id']
+        if not deliver:
+            return
+        with self._lock:
+            subs = list(self._subscribers.get(thread_id, ()))
+        for msg in new:
+            payload = dict(msg)
+            for sub in subs:
+                try:
+                    sub.queue.put_nowait(payload)
+                    self.delivered += 1
+                except queue.Full:
+                    # A stalled client; it will catch up through Last-Event-ID on reconnect
+                    pass
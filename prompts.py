@@ -0,0 +1,204 @@
+"""Static prompt prefixes sent as ``system_instruction`` instead of per request.
+
+``PromptFile`` keeps a prompt file in memory and reloads it when its mtime
+changes (checked at most every ``check_interval`` seconds).
+
+``InstructedModel`` is a model-like object whose system instruction comes
+from a ``PromptFile``.  The underlying ``GenerativeModel`` is only rebuilt
+when the prompt changes.  With ``cache_ttl`` set, the instruction is stored
+once as a Gemini context cache; its TTL is renewed while the model is in use
+and it is recreated after it expires.  If the cache cannot be created (for
+example because the prompt is below the model's minimum cacheable size) the
+plain system instruction is used.  No Gemini client is touched until the
+first call (see ``clients.gemini``).
+
+Token usage of every call is recorded and logged on ``llm.usage``.
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import clients
+
+usage_log = logging.getLogger('llm.usage')
+
+
+def enable_usage_log() -> None:
+    """Print one line per model call (prompt, cached and output tokens) to stderr."""
+    if not usage_log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+        usage_log.addHandler(handler)
+    usage_log.setLevel(logging.INFO)
+    usage_log.propagate = False
+
+
+class PromptFile:
+    def __init__(self, path: str, fallback: str = '', check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.version = 0
+        self._text = fallback
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return
+            with open(self.path, 'r', encoding='utf-8') as f:
+                text = f.read().strip()
+        except OSError:
+            # Keep serving the last good text (or the fallback)
+            return
+        self._mtime = mtime
+        self._text = text
+        self.version += 1
+
+    @property
+    def text(self) -> str:
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            with self._lock:
+                if now - self._checked >= self.check_interval:
+                    self._checked = now
+                    self._load()
+        return self._text
+
+
+class InstructedModel:
+    def __init__(self, model_name: str, prompt: Optional[PromptFile] = None, cache_ttl: int = 0):
+        self.prompt = prompt
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        self._version = None
+        self._model = None
+        self._cache = None
+        self._cached_model = None
+        self._cache_expires = 0.0
+        self._cache_failed = False
+        self._renewing = False
+        self._usage = {'calls': 0, 'promptTokens': 0, 'cachedTokens': 0, 'outputTokens': 0}
+        self._base_name = model_name
+        # As GenerativeModel names it, without building one yet
+        self.model_name = model_name if '/' in model_name else f'models/{model_name}'
+
+    def _instruction(self) -> Optional[str]:
+        return (self.prompt.text if self.prompt else '') or None
+
+    def _current(self):
+        with self._lock:
+            instruction = self._instruction()
+            version = self.prompt.version if self.prompt else 0
+            stale = None
+            if version != self._version:
+                stale, self._cache, self._cached_model = self._cache, None, None
+                self._model = clients.gemini().GenerativeModel(self._base_name, system_instruction=instruction)
+                self._version = version
+                self._cache_failed = False
+            renew = None
+            if instruction and self.cache_ttl > 0 and not self._cache_failed and not self._renewing:
+                now = time.time()
+                if self._cache is not None and now >= self._cache_expires:
+                    self._cache = self._cached_model = None
+                if self._cache is None or self._cache_expires - now <= self.cache_ttl / 2:
+                    # Single flight: this caller renews, the others keep using what is there
+                    self._renewing = True
+                    renew = (version, self._cache, self._model.model_name, instruction)
+            model = self._cached_model or self._model
+        # Cache calls are network round trips; none of them runs under the lock
+        if stale is not None:
+            self._delete_cache(stale)
+        if renew is not None:
+            model = self._renew_cache(*renew) or model
+        return model
+
+    def _renew_cache(self, version, cache, model_name: str, instruction: str):
+        """Extend ``cache``, or create a new one; returns the model to use, or None to keep the current one."""
+        started = time.time()
+        ttl = datetime.timedelta(seconds=self.cache_ttl)
+        cached_model = None
+        failed = False
+        try:
+            if cache is not None:
+                try:
+                    cache.update(ttl=ttl)
+                except Exception as e:
+                    usage_log.warning('%s: could not renew context cache: %s', self.model_name, e)
+                    cache = None
+            if cache is None:
+                genai = clients.gemini()
+                cache = genai.caching.CachedContent.create(model=model_name, system_instruction=instruction, ttl=ttl)
+                cached_model = genai.GenerativeModel.from_cached_content(cache)
+        except Exception as e:
+            cache = None
+            failed = True
+            usage_log.warning('%s: context cache unavailable, sending the system instruction: %s',
+                              self._base_name, e)
+        with self._lock:
+            self._renewing = False
+            if version != self._version:
+                # The prompt changed meanwhile; a cache created for the old one is of no use
+                stale = cache if cached_model is not None else None
+                cache = cached_model = None
+            else:
+                stale = None
+                if failed:
+                    self._cache = self._cached_model = None
+                    self._cache_failed = True
+                elif cached_model is not None:
+                    self._cache, self._cached_model = cache, cached_model
+                if cache is not None:
+                    self._cache_expires = started + self.cache_ttl
+                cached_model = self._cached_model
+        if stale is not None:
+            self._delete_cache(stale)
+        return cached_model
+
+    @staticmethod
+    def _delete_cache(cache) -> None:
+        try:
+            cache.delete()
+        except Exception:
+            pass
+
+    def _record(self, response) -> None:
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+        cached_tokens = getattr(usage, 'cached_content_token_count', 0) or 0
+        output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+        with self._lock:
+            self._usage['calls'] += 1
+            self._usage['promptTokens'] += prompt_tokens
+            self._usage['cachedTokens'] += cached_tokens
+            self._usage['outputTokens'] += output_tokens
+        usage_log.info('%s prompt=%d cached=%d output=%d', self.model_name,
+                       prompt_tokens, cached_tokens, output_tokens)
+
+    def _stream(self, response):
+        for chunk in response:
+            yield chunk
+        # Usage metadata is complete once the stream is exhausted
+        self._record(response)
+
+    def generate_content(self, prompt, **kwargs):
+        response = self._current().generate_content(prompt, **kwargs)
+        if kwargs.get('stream'):
+            return self._stream(response)
+        self._record(response)
+        return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._usage, promptVersion=self._version,
+                        contextCache=self._cache is not None,
+                        cacheExpiresIn=max(0, round(self._cache_expires - time.time())) if self._cache else 0)
@@ -0,0 +1,102 @@
+"""Doctor -> patient roster index kept at ``doctors/<doctor_uid>/patients``.
+
+Each entry is ``{patient_uid: {"fullname": ...}}`` so the dashboard can be
+rendered from the index alone.  Every linkage change writes the patient's
+``linkedDoctorUID`` and the roster entry (and removes the entry from a
+previous doctor) in one atomic multi-path update.
+
+Doctors whose patients were linked before the index existed get their roster
+built on first use from the old ``users`` queries; ``rosterBuilt`` marks that
+this has happened.
+
+``linkedDoctorUID`` stays the source of truth: a linkage written without this
+module (console edit, old client) leaves a stale entry behind, so the patients
+a doctor is about to see are checked with ``linked_roster``.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+DOCTORS_NODE = 'doctors'
+USERS_NODE = 'users'
+ROSTER_CHILD = 'patients'
+BUILT_FLAG = 'rosterBuilt'
+
+
+def roster_entry(user_record: Optional[dict]) -> dict:
+    user_record = user_record or {}
+    name = user_record.get('fullname') or user_record.get('username') or user_record.get('email') or ''
+    return {'fullname': name}
+
+
+def link_updates(patient_uid: str, doctor_uid: str, user_record: Optional[dict] = None,
+                 previous_doctor_uid: Optional[str] = None) -> dict:
+    """Multi-path update (relative to the root) linking a patient to a doctor."""
+    updates = {
+        f'{USERS_NODE}/{patient_uid}/linkedDoctorUID': doctor_uid,
+        f'{DOCTORS_NODE}/{doctor_uid}/{ROSTER_CHILD}/{patient_uid}': roster_entry(user_record),
+    }
+    if previous_doctor_uid and previous_doctor_uid != doctor_uid:
+        updates[f'{DOCTORS_NODE}/{previous_doctor_uid}/{ROSTER_CHILD}/{patient_uid}'] = None
+    return updates
+
+
+def link_patient(ref, patient_uid: str, doctor_uid: str, user_record: Optional[dict] = None,
+                 previous_doctor_uid: Optional[str] = None) -> None:
+    ref.update(link_updates(patient_uid, doctor_uid, user_record, previous_doctor_uid))
+
+
+def build_roster(ref, doctor_uid: str) -> Dict[str, dict]:
+    """Backfill the roster from ``users`` with a single multi-path update."""
+    users = ref.child(USERS_NODE)
+    patients = users.order_by_child('linkedDoctorUID').equal_to(doctor_uid).get() or {}
+    # Patients that signed up with the doctor's invite code but were never linked
+    invite_code = ref.child(DOCTORS_NODE).child(doctor_uid).child('inviteCode').get()
+    via_code = {}
+    if invite_code:
+        via_code = users.order_by_child('invite_code').equal_to(invite_code).get() or {}
+
+    updates = {f'{DOCTORS_NODE}/{doctor_uid}/{BUILT_FLAG}': True}
+    roster = {}
+    for uid, record in list(patients.items()) + list(via_code.items()):
+        if not isinstance(record, dict) or uid in roster:
+            continue
+        linked = record.get('linkedDoctorUID')
+        if linked and linked != doctor_uid:
+            continue
+        roster[uid] = roster_entry(record)
+        updates.update(link_updates(uid, doctor_uid, record))
+    ref.update(updates)
+    return roster
+
+
+def linked_doctor(ref, patient_uid: str) -> Optional[str]:
+    return ref.child(USERS_NODE).child(patient_uid).child('linkedDoctorUID').get()
+
+
+def linked_roster(ref, doctor_uid: str, patients: Dict[str, dict], patient_uids: Optional[Iterable[str]] = None,
+                  workers: int = 8) -> Dict[str, dict]:
+    """``patients`` without the entries whose ``linkedDoctorUID`` no longer names the doctor.
+
+    Only ``patient_uids`` are checked when given (e.g. the patients on one page of
+    results).  Stale entries are removed from the index in one update.
+    """
+    uids = list(patients) if patient_uids is None else [uid for uid in set(patient_uids) if uid in patients]
+    if not uids:
+        return patients
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(uids))), thread_name_prefix='roster') as pool:
+        stale = {uid for uid, linked in zip(uids, pool.map(lambda uid: linked_doctor(ref, uid), uids))
+                 if linked != doctor_uid}
+    if not stale:
+        return patients
+    ref.update({f'{DOCTORS_NODE}/{doctor_uid}/{ROSTER_CHILD}/{uid}': None for uid in stale})
+    return {uid: entry for uid, entry in patients.items() if uid not in stale}
+
+
+def get_roster(ref, doctor_uid: str) -> Dict[str, dict]:
+    """The doctor's roster, building it first if it predates the index."""
+    # One read of the doctor record: a few fields plus the roster itself
+    doctor = ref.child(DOCTORS_NODE).child(doctor_uid).get() or {}
+    if not doctor.get(BUILT_FLAG):
+        return build_roster(ref, doctor_uid)
+    return doctor.get(ROSTER_CHILD) or {}
@@ -0,0 +1,275 @@
+"""Full-text search over patient chats and doctor-patient messages (SQLite FTS5).
+
+One row per chat turn and per direct message:
+
+    docs(id, patient, kind, key, ts, author, body, reply)   + docs_fts(body, reply)
+
+``kind`` is ``chat`` (``body`` is the patient's message, ``reply`` the
+assistant's answer, ranked lower) or ``message`` (``body`` is the direct
+message, ``author`` is ``patient`` or ``doctor``).  ``key`` is the turn's
+ordinal or the message's push id, so adding the same item twice is a no-op.
+
+The index is kept current two ways:
+
+* write-through: the app adds each turn and message right after storing it;
+* catch-up: before a search, patients not synced for ``sync_interval``
+  seconds read only the RTDB children after the last key seen
+  (``order_by_key().start_at``), so writes from other workers or scripts show
+  up within that interval.  The first search over a roster builds it.
+
+With a file path several worker processes on a host share one index (WAL
+mode); ``:memory:`` gives each process its own.  Queries are scoped by the
+caller to a list of patient uids, i.e. the doctor's roster.
+
+Query syntax: words (all must match; stemmed, so "worried" finds "worry"),
+``"quoted phrases"`` and ``prefix*``.  Results are ranked by bm25, newest
+first on ties, and can be filtered by kind, patient and time range.
+"""
+
+import datetime
+import html
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+import chat_store
+import direct_messages
+
+KINDS = ('chat', 'message')
+MAX_OFFSET = 1000
+# bm25 weights of the body and reply columns
+BODY_WEIGHT = 1.0
+REPLY_WEIGHT = 0.3
+SNIPPET_TOKENS = 16
+# Snippet highlight markers, replaced by <mark> after escaping
+MARK_OPEN, MARK_CLOSE = '\x02', '\x03'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    patient TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    ts INTEGER NOT NULL DEFAULT 0,
+    author TEXT NOT NULL DEFAULT '',
+    body TEXT NOT NULL DEFAULT '',
+    reply TEXT NOT NULL DEFAULT '',
+    UNIQUE (patient, kind, key)
+);
+CREATE INDEX IF NOT EXISTS docs_patient_ts ON docs (patient, ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+    body, reply, content='docs', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS docs_ai AFTER INSERT ON docs BEGIN
+    INSERT INTO docs_fts (rowid, body, reply) VALUES (new.id, new.body, new.reply);
+END;
+CREATE TRIGGER IF NOT EXISTS docs_ad AFTER DELETE ON docs BEGIN
+    INSERT INTO docs_fts (docs_fts, rowid, body, reply) VALUES ('delete', old.id, old.body, old.reply);
+END;
+CREATE TABLE IF NOT EXISTS sync (
+    patient TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    last_key TEXT,
+    synced REAL NOT NULL,
+    PRIMARY KEY (patient, kind)
+);
+"""
+
+QUERY_RE = re.compile(r'"([^"]*)"?|(\S+)')
+WORD_RE = re.compile(r'\w+')
+
+
+def build_match(query: str) -> Optional[str]:
+    """An FTS5 MATCH expression for ``query``; every term is quoted, so operators in input are inert."""
+    parts = []
+    for phrase, word in QUERY_RE.findall(query or ''):
+        if phrase:
+            words = WORD_RE.findall(phrase.lower())
+            if words:
+                parts.append('"' + ' '.join(words) + '"')
+            continue
+        words = WORD_RE.findall(word.lower())
+        parts.extend(f'"{w}"' for w in words)
+        if words and word.endswith('*'):
+            parts[-1] += '*'
+    return ' '.join(parts) or None
+
+
+def _millis(value) -> int:
+    """Epoch milliseconds of a stored timestamp (number, or ISO string in old records); 0 if unknown."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            when = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return 0
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=datetime.timezone.utc)
+        return int(when.timestamp() * 1000)
+    return 0
+
+
+def _text(value) -> str:
+    # Stored messages are HTML-escaped by the app; index what the user typed
+    return html.unescape(str(value or ''))
+
+
+def _snippet(raw: str) -> str:
+    """HTML-safe snippet with matches wrapped in <mark>."""
+    return html.escape(raw).replace(MARK_OPEN, '<mark>').replace(MARK_CLOSE, '</mark>')
+
+
+class SearchIndex:
+    def __init__(self, path: str = ':memory:', sync_interval: float = 300.0, sync_workers: int = 8):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.sync_workers = sync_workers
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._counts = Counter()
+        with self._lock:
+            if path != ':memory:':
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(SCHEMA)
+
+    def _insert(self, rows: List[tuple]) -> int:
+        if not rows:
+            return 0
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                # rowcount leaves out the trigger's FTS rows and ignored duplicates
+                added = self._db.executemany(
+                    'INSERT OR IGNORE INTO docs (patient, kind, key, ts, author, body, reply) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', rows).rowcount
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        self._counts['indexed'] += added
+        return added
+
+    def add_chat_turn(self, patient: str, ordinal: int, user_message: str, ai_message: str,
+                      timestamp=None) -> None:
+        ts = _millis(timestamp) if timestamp is not None else int(time.time() * 1000)
+        self._insert([(patient, 'chat', str(ordinal), ts, 'patient', _text(user_message), _text(ai_message))])
+
+    def add_message(self, patient: str, key: str, author_uid: str, message: str, timestamp=None) -> None:
+        ts = _millis(timestamp) if timestamp is not None else int(time.time() * 1000)
+        author = 'patient' if author_uid == patient else 'doctor'
+        self._insert([(patient, 'message', key, ts, author, _text(message), '')])
+
+    def _cursor(self, patient: str, kind: str) -> Tuple[Optional[str], float]:
+        with self._lock:
+            row = self._db.execute('SELECT last_key, synced FROM sync WHERE patient = ? AND kind = ?',
+                                   (patient, kind)).fetchone()
+        return (row[0], row[1]) if row else (None, 0.0)
+
+    def _set_cursor(self, patient: str, kind: str, last_key: Optional[str]) -> None:
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO sync (patient, kind, last_key, synced) VALUES (?, ?, ?, ?)',
+                             (patient, kind, last_key, time.time()))
+
+    def sync_patient(self, ref, patient: str) -> int:
+        """Index the chat turns and messages stored after the last synced keys; returns how many were new."""
+        added = 0
+        for kind, node in (('chat', chat_store.CHATS_NODE), ('message', direct_messages.MESSAGES_NODE)):
+            last_key, _ = self._cursor(patient, kind)
+            source = ref.child(node).child(patient)
+            raw = source.order_by_key().start_at(last_key).get() if last_key else source.get()
+            items = chat_store.ordered_items(raw)
+            rows = []
+            for key, item in items:
+                if kind == 'chat':
+                    rows.append((patient, kind, str(item.get('ordinal', key)), _millis(item.get('timestamp')),
+                                 'patient', _text(item.get('user')), _text(item.get('ai'))))
+                else:
+                    author = 'patient' if item.get('from') == patient else 'doctor'
+                    rows.append((patient, kind, key, _millis(item.get('timestamp')), author,
+                                 _text(item.get('message')), ''))
+            added += self._insert(rows)
+            self._set_cursor(patient, kind, items[-1][0] if items else last_key)
+        self._counts['synced'] += 1
+        return added
+
+    def refresh(self, ref, patients: Iterable[str]) -> int:
+        """Catch up patients not synced within ``sync_interval``; returns how many were synced."""
+        cutoff = time.time() - self.sync_interval
+        with self._lock:
+            synced = dict(self._db.execute(
+                "SELECT patient, MIN(synced) FROM sync GROUP BY patient HAVING COUNT(*) = ?", (len(KINDS),)))
+        stale = [p for p in patients if synced.get(p, 0.0) < cutoff]
+        if not stale:
+            return 0
+        with ThreadPoolExecutor(max_workers=max(1, min(self.sync_workers, len(stale))),
+                                thread_name_prefix='search-sync') as pool:
+            list(pool.map(lambda p: self.sync_patient(ref, p), stale))
+        return len(stale)
+
+    def forget_patient(self, patient: str) -> None:
+        """Drop a patient's documents, e.g. after their history was rewritten; the next search re-reads it."""
+        with self._lock:
+            self._db.execute('DELETE FROM docs WHERE patient = ?', (patient,))
+            self._db.execute('DELETE FROM sync WHERE patient = ?', (patient,))
+
+    def search(self, patients: Iterable[str], query: str, kind: Optional[str] = None,
+               since_ms: Optional[int] = None, until_ms: Optional[int] = None,
+               limit: int = 20, offset: int = 0) -> Tuple[List[dict], int]:
+        """``(results, total)`` for ``query`` within ``patients``, best match first."""
+        match = build_match(query)
+        patients = list(patients)
+        if not match or not patients:
+            return [], 0
+        where = ['docs_fts MATCH ?', 'd.patient IN (SELECT value FROM json_each(?))']
+        params = [match, json.dumps(patients)]
+        if kind:
+            where.append('d.kind = ?')
+            params.append(kind)
+        if since_ms is not None:
+            where.append('d.ts >= ?')
+            params.append(since_ms)
+        if until_ms is not None:
+            where.append('d.ts < ?')
+            params.append(until_ms)
+        condition = ' AND '.join(where)
+        offset = max(0, min(offset, MAX_OFFSET))
+        with self._lock:
+            total = self._db.execute(
+                f'SELECT COUNT(*) FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid WHERE {condition}',
+                params).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT d.patient, d.kind, d.key, d.ts, d.author, "
+                f"snippet(docs_fts, -1, ?, ?, '…', {SNIPPET_TOKENS}), bm25(docs_fts, ?, ?) AS score "
+                f"FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid WHERE {condition} "
+                f"ORDER BY score, d.ts DESC LIMIT ? OFFSET ?",
+                [MARK_OPEN, MARK_CLOSE, BODY_WEIGHT, REPLY_WEIGHT] + params + [limit, offset]).fetchall()
+        self._counts['searches'] += 1
+        results = [{
+            'patientUid': patient,
+            'kind': kind,
+            'key': key,
+            'timestamp': ts or None,
+            'author': author,
+            'snippet': _snippet(snippet),
+            'score': round(-score, 3),
+        } for patient, kind, key, ts, author, snippet, score in rows]
+        return results, total
+
+    def stats(self) -> dict:
+        with self._lock:
+            docs = dict(self._db.execute('SELECT kind, COUNT(*) FROM docs GROUP BY kind').fetchall())
+            patients = self._db.execute('SELECT COUNT(DISTINCT patient) FROM sync').fetchone()[0]
+        return {
+            'documents': {kind: docs.get(kind, 0) for kind in KINDS},
+            'patients': patients,
+            'indexed': self._counts['indexed'],
+            'syncs': self._counts['synced'],
+            'searches': self._counts['searches'],
+        }
@@ -0,0 +1,370 @@
+"""Synthetic doctors, patients, chats and direct messages in bulk (``seed_demo.py --bulk``).
+
+Everything is derived from ``--seed``: uids, emails, roster assignment, chat
+lengths and texts, timestamps and message keys.  Each entity draws from its
+own ``random.Random``, so a given seed always produces the same data no
+matter how work is split across threads or runs.  That makes every unit of
+work idempotent, and resuming is just skipping the units listed as done in
+the state file:
+
+* auth: ``admin_auth.import_users`` batches of up to 1000 accounts, passwords
+  as PBKDF2-SHA256 hashes;
+* data: ranges of ``chunk_size`` patients, each written with multi-path
+  updates of at most ``max_update_bytes`` (user record, roster entry, chat
+  turns plus ``chat_meta`` in the ``chat_store`` layout, direct messages).
+
+Doctor records are written first, one field per path, so roster entries
+under ``doctors/<uid>/patients`` can be written by any chunk.
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import chat_store
+import direct_messages
+import roster
+
+IMPORT_BATCH_LIMIT = 1000
+DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+DAY_MS = 24 * 3600 * 1000
+
+FIRST_NAMES = ('Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Riley', 'Casey', 'Jamie', 'Avery', 'Quinn',
+               'Maya', 'Noah', 'Lena', 'Omar', 'Priya', 'Diego', 'Hana', 'Ivan', 'Zoe', 'Kofi')
+LAST_NAMES = ('Smith', 'Garcia', 'Chen', 'Okafor', 'Novak', 'Patel', 'Silva', 'Kim', 'Müller', 'Haddad',
+              'Rossi', 'Nguyen', 'Cohen', 'Larsen', 'Ahmed', 'Dubois', 'Tanaka', 'Walker', 'Mendes', 'Ivanova')
+OPENERS = ('', 'Hi. ', 'Hello again. ', 'Honestly, ', 'So, ', 'Not sure how to say this, but ')
+FEELINGS = (
+    "I've been feeling anxious most of the day",
+    "I felt calm after my walk this morning",
+    "I'm exhausted and couldn't sleep well",
+    "work has been really stressful this week",
+    "I had a good day and felt hopeful",
+    "I keep worrying about my family",
+    "I feel lonely in the evenings",
+    "I was angry at myself after the meeting",
+    "I'm proud that I went to the gym",
+    "my headaches are back and I feel tense",
+    "I feel a bit better than yesterday",
+    "I was surprised how relaxed I felt at dinner",
+)
+DETAILS = ('', '.', ' 😔', ' 😊', '. Any advice?', ', not sure why.', '. It comes and goes.',
+           ' and my appetite is low.', '. The breathing exercise helped a little 🙂')
+URGENT = ("I feel hopeless and I can't cope anymore.", "Sometimes I think everyone would be better off dead.",
+          "I had a panic attack on the bus and felt unsafe.")
+REPLIES = (
+    "Thank you for telling me. What do you think triggered it?",
+    "That sounds hard. Have you been able to rest at all?",
+    "It's great that you noticed that. What helped the most?",
+    "Let's try a short breathing exercise together: in for four, hold for four, out for six.",
+    "How would you rate it from 1 to 10 right now?",
+    "It might help to keep a short journal of when this happens.",
+    "I'm glad you reached out. Would it help to talk to your doctor about this?",
+)
+URGENT_REPLY = ("I'm really sorry you're feeling this way. You deserve support right now. If you are in danger, "
+                "please call your local emergency number, and consider contacting your doctor today.")
+DOCTOR_MESSAGES = ("How have you been since our last session?", "Please keep tracking your sleep this week.",
+                   "Remember to take your medication with food.", "Let's schedule a check-in for Thursday.",
+                   "I read your notes, thank you for sharing them.")
+PATIENT_MESSAGES = ("Thank you, doctor.", "Sleep was a bit better this week.", "Can we move the appointment?",
+                    "I tried the exercise, it helped a little.", "I have been feeling low again.")
+
+
+class Plan:
+    """Parameters that determine the generated data; stored in the state file to detect mismatches."""
+
+    FIELDS = ('seed', 'doctors', 'patients', 'turns', 'turns_distribution', 'messages',
+              'messages_distribution', 'days', 'urgent_rate', 'domain', 'end_ms', 'hash_rounds')
+
+    def __init__(self, seed: int, doctors: int, patients: int, turns: float, turns_distribution: str,
+                 messages: float, messages_distribution: str, days: int, urgent_rate: float, domain: str,
+                 end_ms: int, hash_rounds: int):
+        self.seed = seed
+        self.doctors = doctors
+        self.patients = patients
+        self.turns = turns
+        self.turns_distribution = turns_distribution
+        self.messages = messages
+        self.messages_distribution = messages_distribution
+        self.days = days
+        self.urgent_rate = urgent_rate
+        self.domain = domain
+        self.end_ms = end_ms
+        self.hash_rounds = hash_rounds
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def rng(self, *parts) -> random.Random:
+        return random.Random(':'.join(str(p) for p in (self.seed,) + parts))
+
+    def uid(self, kind: str, index: int) -> str:
+        return f'bulk{self.seed}-{kind}{index:07d}'
+
+    def email(self, kind: str, index: int) -> str:
+        return f'{kind}{index:07d}.s{self.seed}@{self.domain}'
+
+    def invite_code(self, doctor_index: int) -> str:
+        return f'B{self.seed}D{doctor_index}'
+
+    def doctor_of(self, patient_index: int) -> int:
+        return self.rng('assign', patient_index).randrange(self.doctors)
+
+
+def sample_count(rng: random.Random, mean: float, distribution: str) -> int:
+    """A non-negative count with the given mean, capped at 20x the mean."""
+    if mean <= 0:
+        return 0
+    if distribution == 'fixed':
+        value = mean
+    elif distribution == 'uniform':
+        value = rng.uniform(0, 2 * mean)
+    elif distribution == 'exponential':
+        value = rng.expovariate(1 / mean)
+    elif distribution == 'lognormal':
+        # sigma = 1, mu chosen so the mean is ``mean``
+        value = rng.lognormvariate(math.log(mean) - 0.5, 1.0)
+    else:
+        raise ValueError(f'Unknown distribution: {distribution}')
+    return int(min(round(value), 20 * mean))
+
+
+def _timestamps(rng: random.Random, count: int, plan: Plan) -> List[int]:
+    """``count`` sorted times in the last ``days`` days, grouped into sessions of a few minutes."""
+    start = plan.end_ms - plan.days * DAY_MS
+    times = []
+    while len(times) < count:
+        at = rng.randrange(start, plan.end_ms)
+        for _ in range(min(count - len(times), rng.randint(1, 6))):
+            times.append(min(at, plan.end_ms - 1))
+            at += rng.randint(20, 400) * 1000
+    return sorted(times)
+
+
+def password_hash(plan: Plan, uid: str, password: str) -> Tuple[bytes, bytes]:
+    salt = hashlib.sha256(f'{plan.seed}:{uid}'.encode('utf-8')).digest()[:16]
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, plan.hash_rounds), salt
+
+
+def doctor_updates(plan: Plan) -> Dict[str, object]:
+    updates = {}
+    for d in range(plan.doctors):
+        uid = plan.uid('doctor', d)
+        updates[f'{roster.DOCTORS_NODE}/{uid}/email'] = plan.email('doctor', d)
+        updates[f'{roster.DOCTORS_NODE}/{uid}/inviteCode'] = plan.invite_code(d)
+        # Every patient is written with a roster entry, so the roster never needs a rebuild
+        updates[f'{roster.DOCTORS_NODE}/{uid}/{roster.BUILT_FLAG}'] = True
+    return updates
+
+
+def patient_data(plan: Plan, index: int) -> Tuple[Dict[str, object], dict]:
+    """``(updates, counts)`` for one patient: record, roster entry, chat and direct messages."""
+    uid = plan.uid('patient', index)
+    doctor_index = plan.doctor_of(index)
+    doctor_uid = plan.uid('doctor', doctor_index)
+    rng = plan.rng('patient', index)
+    record = {
+        'fullname': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+        'email': plan.email('patient', index),
+        'invite_code': plan.invite_code(doctor_index),
+        'linkedDoctorUID': doctor_uid,
+    }
+    updates = {
+        f'{roster.USERS_NODE}/{uid}': record,
+        f'{roster.DOCTORS_NODE}/{doctor_uid}/{roster.ROSTER_CHILD}/{uid}': roster.roster_entry(record),
+    }
+
+    turn_count = sample_count(rng, plan.turns, plan.turns_distribution)
+    turns = []
+    for ordinal, at in enumerate(_timestamps(rng, turn_count, plan)):
+        if rng.random() < plan.urgent_rate:
+            user, ai = rng.choice(URGENT), URGENT_REPLY
+        else:
+            user = rng.choice(OPENERS) + rng.choice(FEELINGS) + rng.choice(DETAILS)
+            ai = rng.choice(REPLIES)
+        turns.append({'user': user, 'ai': ai, 'ordinal': ordinal, 'timestamp': at})
+    # Same layout as chat_store.replace_turns: ordinals as keys plus the counter
+    updates[f'{chat_store.CHATS_NODE}/{uid}'] = turns or None
+    updates[f'{chat_store.META_NODE}/{uid}'] = {'count': len(turns), 'format': 'append'}
+
+    message_count = sample_count(rng, plan.messages, plan.messages_distribution)
+    thread = {}
+    for at in _timestamps(rng, message_count, plan):
+        from_doctor = rng.random() < 0.5
+        text = rng.choice(DOCTOR_MESSAGES if from_doctor else PATIENT_MESSAGES)
+        thread[direct_messages.push_key(at, rng)] = {'from': doctor_uid if from_doctor else uid, 'message': text, 'timestamp': at}
+    updates[f'{direct_messages.MESSAGES_NODE}/{uid}'] = thread or None
+    return updates, {'patients': 1, 'turns': len(turns), 'messages': len(thread)}
+
+
+def split_updates(updates: Dict[str, object], max_bytes: int) -> Iterator[Tuple[Dict[str, object], int]]:
+    """Multi-path updates of at most ``max_bytes`` of JSON each (a single larger path goes alone)."""
+    batch, size = {}, 0
+    for path, value in updates.items():
+        item_size = len(json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')) + len(path)
+        if batch and size + item_size > max_bytes:
+            yield batch, size
+            batch, size = {}, 0
+        batch[path] = value
+        size += item_size
+    if batch:
+        yield batch, size
+
+
+def with_retries(fn: Callable, attempts: int = 4, backoff: float = 0.5):
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(backoff * (2 ** attempt))
+
+
+class State:
+    """Completed units, persisted as JSON after each one so an interrupted run can resume."""
+
+    def __init__(self, path: Optional[str], plan: Plan, restart: bool = False):
+        self.path = path
+        self.done = {'auth': set(), 'chunks': set()}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path) and not restart:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('plan') != plan.to_dict():
+                raise ValueError(f'{path} was written for different parameters; use --restart or another --state')
+            self.done = {kind: set(saved.get(kind, [])) for kind in self.done}
+
+    def is_done(self, kind: str, unit: int) -> bool:
+        return unit in self.done[kind]
+
+    def mark(self, kind: str, unit: int, plan: Plan) -> None:
+        with self._lock:
+            self.done[kind].add(unit)
+            if not self.path:
+                return
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(dict({k: sorted(v) for k, v in self.done.items()}, plan=plan.to_dict()), f)
+            os.replace(tmp, self.path)
+
+
+class Report:
+    """Per-phase counters and wall time."""
+
+    def __init__(self):
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, **counts) -> None:
+        with self._lock:
+            totals = self.phases.setdefault(phase, {'seconds': 0.0})
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+
+    def lines(self) -> List[str]:
+        out = []
+        for phase, totals in self.phases.items():
+            seconds = totals['seconds'] or 1e-9
+            rates = ', '.join(
+                f"{totals[k]} {k} ({totals[k] / seconds:.0f}/s)" for k in
+                ('users', 'failed', 'doctors', 'patients', 'turns', 'messages', 'writes') if totals.get(k))
+            mb = totals.get('bytes', 0) / 1e6
+            extra = f', {mb:.1f} MB ({mb / seconds:.1f} MB/s)' if mb else ''
+            skipped = f", {totals['skipped']} units skipped (done earlier)" if totals.get('skipped') else ''
+            out.append(f'  {phase}: {totals["seconds"]:.1f}s, {rates or "nothing to do"}{extra}{skipped}')
+        return out
+
+
+def import_accounts(plan: Plan, password: str, state: State, report: Report, workers: int,
+                    batch_size: int = IMPORT_BATCH_LIMIT) -> None:
+    from firebase_admin import auth as admin_auth
+
+    accounts = [('doctor', d) for d in range(plan.doctors)] + [('patient', p) for p in range(plan.patients)]
+    batch_size = max(1, min(batch_size, IMPORT_BATCH_LIMIT))
+    batches = [accounts[i:i + batch_size] for i in range(0, len(accounts), batch_size)]
+    hash_alg = admin_auth.UserImportHash.pbkdf2_sha256(rounds=plan.hash_rounds)
+
+    def run(unit: int) -> None:
+        records = []
+        for kind, index in batches[unit]:
+            uid = plan.uid(kind, index)
+            digest, salt = password_hash(plan, uid, password)
+            name = f'Dr. {LAST_NAMES[index % len(LAST_NAMES)]}' if kind == 'doctor' else None
+            records.append(admin_auth.ImportUserRecord(uid, email=plan.email(kind, index), display_name=name,
+                                                       password_hash=digest, password_salt=salt))
+        result = with_retries(lambda: admin_auth.import_users(records, hash_alg=hash_alg))
+        report.add('auth', users=result.success_count, failed=result.failure_count)
+        for error in result.errors[:3]:
+            print(f'  import failed for {records[error.index].email}: {error.reason}')
+        if not result.failure_count:
+            state.mark('auth', unit, plan)
+
+    _run_units('auth', len(batches), run, state, report, workers)
+
+
+def write_data(plan: Plan, state: State, report: Report, workers: int, chunk_size: int,
+               max_update_bytes: int) -> None:
+    from firebase_admin import db
+
+    def write(phase: str, updates: Dict[str, object]) -> None:
+        for batch, size in split_updates(updates, max_update_bytes):
+            with_retries(lambda: db.reference('/').update(batch))
+            report.add(phase, writes=1, bytes=size)
+
+    started = time.perf_counter()
+    write('doctors', doctor_updates(plan))
+    report.add('doctors', doctors=plan.doctors, seconds=time.perf_counter() - started)
+
+    chunks = math.ceil(plan.patients / max(1, chunk_size))
+
+    def run(unit: int) -> None:
+        updates = {}
+        totals = {'patients': 0, 'turns': 0, 'messages': 0}
+        for index in range(unit * chunk_size, min(plan.patients, (unit + 1) * chunk_size)):
+            patient_updates, counts = patient_data(plan, index)
+            updates.update(patient_updates)
+            for key, value in counts.items():
+                totals[key] += value
+        write('data', updates)
+        report.add('data', **totals)
+        state.mark('chunks', unit, plan)
+
+    _run_units('chunks', chunks, run, state, report, workers, phase='data')
+
+
+def _run_units(kind: str, count: int, run: Callable[[int], None], state: State, report: Report,
+               workers: int, phase: Optional[str] = None) -> None:
+    phase = phase or kind
+    pending = [unit for unit in range(count) if not state.is_done(kind, unit)]
+    if len(pending) < count:
+        report.add(phase, skipped=count - len(pending))
+    started = time.perf_counter()
+    finished = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(run, unit) for unit in pending]
+        for future in as_completed(futures):
+            future.result()
+            finished += 1
+            if finished % 10 == 0 or finished == len(pending):
+                print(f'  {phase}: {finished}/{len(pending)} units', flush=True)
+    report.add(phase, seconds=time.perf_counter() - started)
+
+
+def load_offline(store, path: str) -> None:
+    """Put an earlier ``dump_offline`` back into the stand-in database, to resume an offline run."""
+    with open(path) as f:
+        store.write([], json.load(f))
+
+
+def dump_offline(store, path: str) -> None:
+    """Write the stand-in database as an RTDB JSON export (importable with the console or CLI)."""
+    with open(path, 'w') as f:
+        json.dump(store.read([]), f, ensure_ascii=False)
+
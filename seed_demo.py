@@ -1,14 +1,25 @@
 import argparse
+import datetime
+import os
 import sys
+import time
 from typing import Optional, Tuple
 
-from config import firebase_config, firebase_admin_config  # ensures env is loaded/validated
-
 import firebase_admin
 from firebase_admin import credentials, auth as admin_auth, db
 
+import chat_store
+import roster
+import seed_bulk
+
 
 def initialize_firebase_if_needed() -> None:
+    # Imported here so --offline can put stand-in settings in place first
+    import config
+    from config import firebase_config, firebase_admin_config
+
+    config.validate()
+
     if not firebase_admin._apps:
         cred = credentials.Certificate(firebase_admin_config)
         firebase_admin.initialize_app(cred, {
@@ -55,7 +66,11 @@ def ensure_patient_record(patient_uid: str, email: str, invite_code: str, linked
     if linked_doctor_uid:
         base['linkedDoctorUID'] = linked_doctor_uid
     base.update(data)  # do not erase existing fields if present
-    users_ref.child(patient_uid).set(base)
+    # User record and the doctor's roster entry are written together
+    updates = {f'users/{patient_uid}': base}
+    if base.get('linkedDoctorUID'):
+        updates[f"doctors/{base['linkedDoctorUID']}/{roster.ROSTER_CHILD}/{patient_uid}"] = roster.roster_entry(base)
+    db.reference('/').update(updates)
 
 
 def backfill_linkage_via_invite(patient_uid: str, invite_code: str) -> Optional[str]:
@@ -63,7 +78,9 @@ def backfill_linkage_via_invite(patient_uid: str, invite_code: str) -> Optional[
     if not doctors_ref:
         return None
     doctor_uid = list(doctors_ref.keys())[0]
-    db.reference('/users').child(patient_uid).update({'linkedDoctorUID': doctor_uid})
+    record = db.reference('/users').child(patient_uid).get() or {}
+    roster.link_patient(db.reference('/'), patient_uid, doctor_uid, record,
+                        previous_doctor_uid=record.get('linkedDoctorUID'))
     return doctor_uid
 
 
@@ -72,7 +89,7 @@ def seed_sample_chat(patient_uid: str) -> None:
         {"user": "Hi, I have been feeling mild headaches since yesterday.", "ai": "Thanks for sharing. On a scale of 1-10, how intense are they?"},
         {"user": "Maybe a 4. I also didn't sleep well.", "ai": "That can contribute. Stay hydrated and rest today. If it worsens to 7+, consider seeing a doctor."},
     ]
-    db.reference('/chats').child(patient_uid).set(chat)
+    chat_store.replace_turns(db.reference('/'), patient_uid, chat)
 
 
 def seed_direct_message(patient_uid: str, doctor_uid: str) -> None:
@@ -84,19 +101,112 @@ def seed_direct_message(patient_uid: str, doctor_uid: str) -> None:
     })
 
 
+def run_bulk(args) -> int:
+    if args.end_date:
+        end = datetime.datetime.strptime(args.end_date, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+        end_ms = int(end.timestamp() * 1000)
+    else:
+        # Midnight UTC today; pass --end-date to reproduce a dataset on another day
+        end_ms = int(time.time() // 86400 * 86400 * 1000)
+    plan = seed_bulk.Plan(
+        seed=args.seed, doctors=args.doctors, patients=args.patients,
+        turns=args.turns, turns_distribution=args.turns_distribution,
+        messages=args.messages, messages_distribution=args.messages_distribution,
+        days=args.days, urgent_rate=args.urgent_rate, domain=args.domain,
+        end_ms=end_ms, hash_rounds=args.hash_rounds,
+    )
+    try:
+        state = seed_bulk.State(args.state, plan, restart=args.restart)
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 2
+    report = seed_bulk.Report()
+
+    started = time.perf_counter()
+    if not args.skip_auth:
+        print(f'Importing {plan.doctors + plan.patients} accounts...')
+        seed_bulk.import_accounts(plan, args.password, state, report, workers=args.workers,
+                                  batch_size=args.import_batch)
+    print(f'Writing {plan.doctors} doctors and {plan.patients} patients...')
+    seed_bulk.write_data(plan, state, report, workers=args.workers, chunk_size=args.chunk_size,
+                         max_update_bytes=args.max_update_bytes)
+    elapsed = time.perf_counter() - started
+
+    print(f'\nBulk seeding complete in {elapsed:.1f}s:')
+    for line in report.lines():
+        print(line)
+    print(f"  Sample logins: {plan.email('doctor', 0)}, {plan.email('patient', 0)} (password from --password)")
+    return 0 if not report.phases.get('auth', {}).get('failed') else 1
+
+
 def main(argv: Optional[list] = None) -> int:
-    parser = argparse.ArgumentParser(description='Seed demo doctor/patient accounts and data.')
-    parser.add_argument('--doctor-email', required=True)
-    parser.add_argument('--doctor-password', required=True)
-    parser.add_argument('--invite-code', required=True)
-    parser.add_argument('--patient-email', required=True)
-    parser.add_argument('--patient-password', required=True)
+    parser = argparse.ArgumentParser(
+        description='Seed demo doctor/patient accounts and data.',
+        epilog='To target the Firebase emulators, set FIREBASE_AUTH_EMULATOR_HOST and '
+               'FIREBASE_DATABASE_EMULATOR_HOST; firebase_admin picks them up.')
+    parser.add_argument('--doctor-email')
+    parser.add_argument('--doctor-password')
+    parser.add_argument('--invite-code')
+    parser.add_argument('--patient-email')
+    parser.add_argument('--patient-password')
     parser.add_argument('--reset-passwords', action='store_true', help='Force reset passwords if users already exist')
     parser.add_argument('--seed-chat', action='store_true', help='Seed a small sample chat and a direct message')
+    parser.add_argument('--offline', metavar='PATH',
+                        help='Seed in-process stand-ins instead of Firebase and write the database to PATH as JSON')
+
+    bulk = parser.add_argument_group('bulk mode')
+    bulk.add_argument('--bulk', action='store_true', help='Generate many synthetic doctors and patients')
+    bulk.add_argument('--seed', type=int, default=1, help='Same seed, same data (uids, emails, chats)')
+    bulk.add_argument('--doctors', type=int, default=50)
+    bulk.add_argument('--patients', type=int, default=2000)
+    bulk.add_argument('--password', default='Demo-pass1', help='Password of every generated account')
+    bulk.add_argument('--turns', type=float, default=40, help='Mean chat turns per patient')
+    bulk.add_argument('--turns-distribution', choices=seed_bulk.DISTRIBUTIONS, default='lognormal')
+    bulk.add_argument('--messages', type=float, default=10, help='Mean direct messages per patient')
+    bulk.add_argument('--messages-distribution', choices=seed_bulk.DISTRIBUTIONS, default='exponential')
+    bulk.add_argument('--days', type=int, default=90, help='History spans this many days before --end-date')
+    bulk.add_argument('--end-date', help='YYYY-MM-DD (UTC); defaults to today')
+    bulk.add_argument('--urgent-rate', type=float, default=0.01, help='Fraction of turns with urgent language')
+    bulk.add_argument('--domain', default='bulk.example.test', help='Email domain of generated accounts')
+    bulk.add_argument('--hash-rounds', type=int, default=1000, help='PBKDF2-SHA256 rounds for imported passwords')
+    bulk.add_argument('--workers', type=int, default=8, help='Parallel import/write threads')
+    bulk.add_argument('--import-batch', type=int, default=seed_bulk.IMPORT_BATCH_LIMIT,
+                      help='Accounts per import_users call (at most 1000)')
+    bulk.add_argument('--chunk-size', type=int, default=100, help='Patients per unit of work')
+    bulk.add_argument('--max-update-bytes', type=int, default=4_000_000, help='Largest multi-path update')
+    bulk.add_argument('--state', help='Progress file; rerunning with it skips finished units')
+    bulk.add_argument('--restart', action='store_true', help='Ignore the progress in --state')
+    bulk.add_argument('--skip-auth', action='store_true', help='Only write database records')
     args = parser.parse_args(argv)
 
+    if args.bulk:
+        if args.doctors < 1:
+            parser.error('--doctors must be at least 1')
+    else:
+        missing = [name for name in ('doctor_email', 'doctor_password', 'invite_code', 'patient_email',
+                                     'patient_password') if not getattr(args, name)]
+        if missing:
+            parser.error('the following arguments are required: ' +
+                         ', '.join('--' + name.replace('_', '-') for name in missing))
+
+    installed = None
+    if args.offline:
+        import fakes
+        installed = fakes.install()
+        if args.bulk and args.state and not args.restart and os.path.exists(args.state) \
+                and os.path.exists(args.offline):
+            # Finished chunks are skipped on resume, so start from what the earlier runs wrote
+            seed_bulk.load_offline(installed.store, args.offline)
     initialize_firebase_if_needed()
 
+    status = run_bulk(args) if args.bulk else seed_demo(args)
+    if installed:
+        seed_bulk.dump_offline(installed.store, args.offline)
+        print(f'  Database written to {args.offline} ({len(installed.auth.users)} accounts were in memory only)')
+    return status
+
+
+def seed_demo(args) -> int:
     # Create/ensure doctor
     doctor_uid, doctor_created = get_or_create_user(
         email=args.doctor_email,
@@ -0,0 +1,34 @@
+"""Minimal Server-Sent Events framing shared by the streaming endpoints."""
+
+import json
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    # Stop reverse proxies from buffering the stream
+    'X-Accel-Buffering': 'no',
+}
+
+
+def format_event(data, event=None, event_id=None, retry=None) -> str:
+    """Serialize one SSE frame; ``data`` is JSON-encoded unless it is already a string."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    if retry is not None:
+        lines.append(f'retry: {int(retry)}')
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    for line in payload.splitlines() or ['']:
+        lines.append(f'data: {line}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def comment(text='keep-alive') -> str:
+    """An SSE comment frame, ignored by clients; used for heartbeats."""
+    return f': {text}\n\n'
+
+
+def retry(milliseconds: int) -> str:
+    """Tell the browser how long to wait before reconnecting; dispatches no event."""
+    return f'retry: {int(milliseconds)}\n\n'
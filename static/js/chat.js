@@ -44,14 +44,19 @@ document.addEventListener('DOMContentLoaded', () => {
         toggleTypingIndicator(true);
 
         try {
-            const response = await fetch('/chat', {
+            const response = await fetch('/chat/stream', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
                 body: JSON.stringify({ message: message }),
             });
-            const data = await response.json();
-            toggleTypingIndicator(false);
-            appendMessage('ai', data.response || 'Sorry, I encountered an error.');
+            const contentType = response.headers.get('content-type') || '';
+            if (!response.ok || !response.body || !contentType.includes('text/event-stream')) {
+                const data = await response.json();
+                toggleTypingIndicator(false);
+                appendMessage('ai', data.response || data.error || 'Sorry, I encountered an error.');
+                return;
+            }
+            await renderStream(response.body);
         } catch (error) {
             toggleTypingIndicator(false);
             console.error('Error:', error);
@@ -59,6 +64,86 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Render SSE "chunk" events into a single AI bubble as they arrive
+    async function renderStream(body) {
+        const reader = body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let bubble = null;
+        let text = '';
+        let failed = null;
+
+        const handleFrame = (frame) => {
+            let event = 'message';
+            const dataLines = [];
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) dataLines.push(line.slice(5).replace(/^ /, ''));
+            });
+            if (!dataLines.length) return;
+            const payload = JSON.parse(dataLines.join('\n'));
+            if (event === 'chunk') {
+                if (!bubble) {
+                    toggleTypingIndicator(false);
+                    bubble = appendMessage('ai', '').querySelector('.bubble');
+                }
+                text += payload.text;
+                bubble.textContent = text;
+                chatHistory.scrollTop = chatHistory.scrollHeight;
+            } else if (event === 'error') {
+                failed = payload.error || 'Sorry, I encountered an error.';
+            }
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) !== -1) {
+                handleFrame(buffer.slice(0, sep));
+                buffer = buffer.slice(sep + 2);
+            }
+        }
+        toggleTypingIndicator(false);
+        if (failed || !bubble) {
+            appendMessage('ai', failed || 'Sorry, I encountered an error.');
+        }
+    }
+
+    // Cursor for the next older page of history (null once everything is loaded)
+    let olderCursor = null;
+    let loadingOlder = false;
+
+    chatHistory.addEventListener('scroll', () => {
+        if (chatHistory.scrollTop === 0 && olderCursor && !loadingOlder) {
+            loadOlderChat();
+        }
+    });
+
+    async function loadOlderChat() {
+        loadingOlder = true;
+        try {
+            const res = await fetch(`/chat/history?before=${encodeURIComponent(olderCursor)}`, { headers: { 'Accept': 'application/json' } });
+            if (!res.ok) return;
+            const history = await res.json();
+            olderCursor = res.headers.get('X-Next-Before');
+            if (!Array.isArray(history)) return;
+            const previousHeight = chatHistory.scrollHeight;
+            const first = chatHistory.querySelector('.chat-message');
+            history.forEach(item => {
+                if (item.user) chatHistory.insertBefore(buildMessage('user', item.user), first);
+                if (item.ai) chatHistory.insertBefore(buildMessage('ai', item.ai), first);
+            });
+            // Keep the viewport on the message the patient was looking at
+            chatHistory.scrollTop = chatHistory.scrollHeight - previousHeight;
+        } catch (e) {
+            console.error('Failed to load older chat history', e);
+        } finally {
+            loadingOlder = false;
+        }
+    }
+
     async function loadPreviousChat() {
         try {
             const res = await fetch('/chat/history', { headers: { 'Accept': 'application/json' } });
@@ -72,6 +157,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
             const history = await res.json();
+            olderCursor = res.headers.get('X-Next-Before');
             if (Array.isArray(history)) {
                 // Remove any existing non-typing chat messages
                 [...chatHistory.querySelectorAll('.chat-message')]
@@ -87,15 +173,21 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    function appendMessage(sender, text) {
+    function buildMessage(sender, text) {
         const messageElement = document.createElement('div');
         messageElement.classList.add('chat-message', sender);
         const bubble = document.createElement('div');
         bubble.classList.add('bubble');
         bubble.textContent = text;
         messageElement.appendChild(bubble);
+        return messageElement;
+    }
+
+    function appendMessage(sender, text) {
+        const messageElement = buildMessage(sender, text);
         chatHistory.insertBefore(messageElement, document.querySelector('.typing-indicator'));
         chatHistory.scrollTop = chatHistory.scrollHeight;
+        return messageElement;
     }
 
     function toggleTypingIndicator(show) {
@@ -105,11 +197,20 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // Inbox functionality
+    // Inbox functionality: the first load fetches the thread, later loads only what is new
+    let inboxCursor = null;
+    const seenMessageIds = new Set();
+
     async function loadDoctorMessages() {
-        inboxMessages.innerHTML = '<p>Loading messages...</p>';
+        if (seenMessageIds.size === 0) {
+            inboxMessages.innerHTML = '<p>Loading messages...</p>';
+        }
         try {
-            const response = await fetch('/get-direct-messages');
+            const url = inboxCursor
+                ? `/get-direct-messages?since=${encodeURIComponent(inboxCursor)}`
+                : '/get-direct-messages';
+            const response = await fetch(url);
+            if (response.status === 304) return;
             const messages = await response.json();
 
             if (messages.error) {
@@ -117,31 +218,57 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
 
-            if (messages.length === 0) {
+            messages.forEach(renderInboxMessage);
+            inboxCursor = response.headers.get('X-Cursor') || inboxCursor;
+            if (seenMessageIds.size === 0) {
                 inboxMessages.innerHTML = '<p>You have no messages from your doctor.</p>';
-                return;
             }
-
-            inboxMessages.innerHTML = '';
-            messages.forEach(msg => {
-                const msgElement = document.createElement('div');
-                msgElement.classList.add('inbox-message');
-                const date = new Date(msg.timestamp).toLocaleString();
-                msgElement.innerHTML = `
-                    <div class="message-header">
-                        <strong>From: Your Doctor</strong>
-                        <span class="timestamp">${date}</span>
-                    </div>
-                    <p>${msg.message}</p>
-                `;
-                inboxMessages.appendChild(msgElement);
-            });
+            startInboxStream();
         } catch (error) {
             console.error('Error loading doctor messages:', error);
-            inboxMessages.innerHTML = '<p>Could not load messages. Please try again.</p>';
+            if (seenMessageIds.size === 0) {
+                inboxMessages.innerHTML = '<p>Could not load messages. Please try again.</p>';
+            }
         }
     }
     
+    function renderInboxMessage(msg) {
+        if (seenMessageIds.has(msg.id)) return;
+        if (seenMessageIds.size === 0) inboxMessages.innerHTML = '';
+        seenMessageIds.add(msg.id);
+        // The cursor is the largest key seen; keys and timestamps need not agree
+        if (!inboxCursor || msg.id > inboxCursor) inboxCursor = msg.id;
+        const msgElement = document.createElement('div');
+        msgElement.classList.add('inbox-message');
+        const date = new Date(msg.timestamp).toLocaleString();
+        msgElement.innerHTML = `
+            <div class="message-header">
+                <strong>From: Your Doctor</strong>
+                <span class="timestamp">${date}</span>
+            </div>
+            <p>${msg.message}</p>
+        `;
+        inboxMessages.appendChild(msgElement);
+    }
+
+    // Live updates over SSE; if the server turns the stream away, poll instead
+    let inboxStream = null;
+    let inboxPoll = null;
+
+    function startInboxStream() {
+        if (inboxStream || inboxPoll || !window.EventSource) return;
+        // Resume after the newest message already shown, so nothing sent since the fetch is missed
+        // ("0" is the epoch: an empty inbox gets every message)
+        inboxStream = new EventSource(`/direct-messages/stream?lastEventId=${encodeURIComponent(inboxCursor || '0')}`);
+        inboxStream.addEventListener('message', (e) => renderInboxMessage(JSON.parse(e.data)));
+        inboxStream.addEventListener('error', () => {
+            if (inboxStream.readyState === EventSource.CLOSED) {
+                inboxStream = null;
+                inboxPoll = setInterval(loadDoctorMessages, 30000);
+            }
+        });
+    }
+
     // Send message to doctor from inbox tab
     if (sendToDoctorBtn && messageToDoctorInput) {
         sendToDoctorBtn.addEventListener('click', async () => {
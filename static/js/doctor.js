@@ -13,13 +13,16 @@ document.addEventListener('DOMContentLoaded', () => {
             
             patientDetailsContainer.innerHTML = '<div id="patient-details"><p>Loading analysis...</p></div>';
             
+            const requestedUid = currentPatientUid;
             try {
-                const response = await fetch(`/analyze-chats/${currentPatientUid}`);
-                const data = await response.json();
-                if (data.error) throw new Error(data.error);
+                const data = await runAnalysisJob(requestedUid);
+                // The doctor may have clicked another patient while this one was running
+                if (requestedUid !== currentPatientUid) return;
                 
                 renderDashboard(data);
                 attachSendButtonListener();
+                resetThread();
+                loadThread(requestedUid);
 
             } catch (error) {
                 patientDetailsContainer.innerHTML = `<div id="patient-details"><p>Could not load analysis: ${error.message}</p></div>`;
@@ -27,6 +30,180 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     });
 
+    // Roster-wide analysis: progress per patient, then the list is re-ordered most urgent first
+    const analyzeAllBtn = document.getElementById('analyze-all-btn');
+    const cohortProgress = document.getElementById('cohort-progress');
+    let cohortStream = null;
+
+    function triageLevel(t) {
+        if (!t) return '';
+        if (t.maxSeverity >= 70 || t.high > 0) return 'high';
+        if (t.flags > 0 || t.medium >= 20) return 'medium';
+        return '';
+    }
+
+    function renderTriage(rows) {
+        const list = document.querySelector('#patient-list ul');
+        if (!list) return;
+        rows.forEach(row => {
+            const link = list.querySelector(`.patient-link[data-uid="${row.uid}"]`);
+            if (!link) return;
+            let badge = link.querySelector('.triage-badge');
+            if (!badge) {
+                badge = document.createElement('span');
+                link.appendChild(badge);
+            }
+            const t = row.triage;
+            badge.className = `triage-badge ${triageLevel(t)}${row.stale ? ' stale' : ''}`;
+            badge.textContent = t ? (t.flags ? `${t.flags} flag${t.flags > 1 ? 's' : ''}` : `${t.high}% high`) : '–';
+            link.title = t ? (t.topFlag ? `${t.topFlag}: ${t.summary}` : t.summary) : 'Not analysed yet';
+            // Rows arrive sorted, so appending in order re-orders the list
+            list.appendChild(link.closest('li'));
+        });
+    }
+
+    function describeCounts(counts) {
+        const parts = [];
+        if (counts.analyzed) parts.push(`${counts.analyzed} analysed`);
+        if (counts.skipped) parts.push(`${counts.skipped} unchanged`);
+        if (counts.metrics) parts.push(`${counts.metrics} charts only`);
+        if (counts.error) parts.push(`${counts.error} failed`);
+        return parts.join(', ');
+    }
+
+    function runCohortAnalysis() {
+        if (cohortStream || !window.EventSource) return;
+        analyzeAllBtn.disabled = true;
+        cohortProgress.textContent = 'Starting...';
+        cohortStream = new EventSource('/doctor/cohort-analysis');
+        const finish = (text) => {
+            cohortStream.close();
+            cohortStream = null;
+            analyzeAllBtn.disabled = false;
+            cohortProgress.textContent = text;
+        };
+        cohortStream.addEventListener('patient', (e) => {
+            const entry = JSON.parse(e.data);
+            cohortProgress.textContent = `${entry.done} / ${entry.total}: ${entry.name}`;
+        });
+        cohortStream.addEventListener('done', (e) => {
+            const result = JSON.parse(e.data);
+            renderTriage(result.triage);
+            finish(`Done in ${Math.round(result.elapsedMs / 1000)}s: ${describeCounts(result.counts)}`);
+        });
+        // The server closes the stream when it is done; never let the browser restart the whole run
+        cohortStream.onerror = () => {
+            if (cohortStream) finish('The analysis was interrupted or the service is busy. Please try again later.');
+        };
+    }
+
+    async function loadTriage() {
+        try {
+            const response = await fetch('/doctor/triage');
+            if (!response.ok) return;
+            const result = await response.json();
+            if (Array.isArray(result.triage)) renderTriage(result.triage);
+        } catch (error) {
+            console.error('Could not load triage', error);
+        }
+    }
+
+    if (analyzeAllBtn) {
+        analyzeAllBtn.addEventListener('click', runCohortAnalysis);
+        loadTriage();
+    }
+
+    // Search across all patients; snippets come back HTML-escaped with <mark> around matches
+    const searchForm = document.getElementById('search-form');
+    const SEARCH_PAGE_SIZE = 20;
+
+    async function runSearch(page) {
+        const q = document.getElementById('search-input').value.trim();
+        if (!q) return;
+        const params = new URLSearchParams({ q, page, pageSize: SEARCH_PAGE_SIZE });
+        const kind = document.getElementById('search-kind').value;
+        const from = document.getElementById('search-from').value;
+        const to = document.getElementById('search-to').value;
+        if (kind) params.set('kind', kind);
+        if (from) params.set('from', from);
+        if (to) params.set('to', to);
+        try {
+            const response = await fetch(`/doctor/search?${params}`);
+            const result = await response.json();
+            if (!response.ok) throw new Error(result.error);
+            renderSearchResults(result);
+        } catch (error) {
+            patientDetailsContainer.innerHTML = `<div id="patient-details"><p>Search failed: ${error.message}</p></div>`;
+        }
+    }
+
+    function renderSearchResults(result) {
+        currentPatientUid = null;
+        resetThread();
+        destroyCharts();
+        const pages = Math.ceil(result.total / result.pageSize);
+        const items = result.results.map(r => `
+            <div class="inbox-message search-result">
+                <div class="message-header">
+                    <a href="#" class="search-patient" data-uid="${r.patientUid}"><strong>${r.name}</strong></a>
+                    <span class="timestamp">${r.kind === 'chat' ? 'Chat' : (r.author === 'doctor' ? 'Your message' : 'Message')}
+                        ${r.timestamp ? ' · ' + new Date(r.timestamp).toLocaleString() : ''}</span>
+                </div>
+                <p>${r.snippet}</p>
+            </div>`).join('');
+        patientDetailsContainer.innerHTML = `
+            <div id="patient-details">
+                <h3>Search results</h3>
+                <p><small>${result.total} match${result.total === 1 ? '' : 'es'} (${result.tookMs} ms)</small></p>
+                ${items || '<p>No matches.</p>'}
+                <div class="search-pages">
+                    ${result.page > 1 ? '<button class="btn" data-page="prev">Previous</button>' : ''}
+                    ${result.page < pages ? '<button class="btn" data-page="next">Next</button>' : ''}
+                </div>
+            </div>`;
+        patientDetailsContainer.querySelectorAll('.search-patient').forEach(link => {
+            link.addEventListener('click', (e) => {
+                e.preventDefault();
+                const target = document.querySelector(`.patient-link[data-uid="${link.dataset.uid}"]`);
+                if (target) target.click();
+            });
+        });
+        patientDetailsContainer.querySelectorAll('.search-pages button').forEach(button => {
+            button.addEventListener('click', () => runSearch(result.page + (button.dataset.page === 'next' ? 1 : -1)));
+        });
+    }
+
+    if (searchForm) {
+        searchForm.addEventListener('submit', (e) => {
+            e.preventDefault();
+            runSearch(1);
+        });
+        ['search-kind', 'search-from', 'search-to'].forEach(id => {
+            document.getElementById(id).addEventListener('change', () => runSearch(1));
+        });
+    }
+
+    const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+    // Submit an analysis job and poll until it finishes. The server holds each poll at most
+    // ANALYSIS_JOB_MAX_WAIT (1 s under gthread), so polls back off from 0.5 s to 5 s in between.
+    async function runAnalysisJob(patientUid) {
+        const submit = await fetch(`/analyze-chats/${patientUid}/jobs`, { method: 'POST' });
+        let job = await submit.json();
+        if (job.error) throw new Error(job.error);
+        let delay = 500;
+        while (job.status === 'queued' || job.status === 'running') {
+            await sleep(delay);
+            delay = Math.min(delay * 1.5, 5000);
+            if (patientUid !== currentPatientUid) return null;
+            const poll = await fetch(`/analysis-jobs/${job.jobId}?wait=20`);
+            job = await poll.json();
+            if (!poll.ok && job.error) throw new Error(job.error);
+        }
+        if (job.status !== 'done') throw new Error(job.error || 'Analysis failed');
+        return job.result;
+    }
+
     function renderDashboard(data) {
         patientDetailsContainer.innerHTML = `
             <div id="patient-details">
@@ -44,6 +221,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 <div class="chart-card"><h4>Emoji Cloud</h4><div id="emoji-cloud"></div></div>
                 <div id="direct-message-container">
                     <h3>Direct Message</h3>
+                    <div id="direct-message-thread"></div>
                     <textarea id="direct-message-input" placeholder="Write a message..."></textarea>
                     <button id="send-direct-message-btn" class="btn">Send</button>
                 </div>
@@ -148,6 +326,79 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Doctor-patient thread: fetched once, then only messages after the cursor
+    let threadCursor = null;
+    let threadIds = new Set();
+
+    let threadStream = null;
+    let threadPoll = null;
+
+    function resetThread() {
+        threadCursor = null;
+        threadIds = new Set();
+        if (threadStream) {
+            threadStream.close();
+            threadStream = null;
+        }
+        if (threadPoll) {
+            clearInterval(threadPoll);
+            threadPoll = null;
+        }
+    }
+
+    function appendThreadMessage(patientUid, m) {
+        const container = document.getElementById('direct-message-thread');
+        if (!container || threadIds.has(m.id)) return;
+        threadIds.add(m.id);
+        // The cursor is the largest key seen; keys and timestamps need not agree
+        if (!threadCursor || m.id > threadCursor) threadCursor = m.id;
+        const el = document.createElement('div');
+        el.classList.add('inbox-message');
+        const who = m.from === patientUid ? 'Patient' : 'You';
+        el.innerHTML = `<div class="message-header"><strong>${who}</strong><span class="timestamp">${new Date(m.timestamp).toLocaleString()}</span></div><p>${m.message}</p>`;
+        container.appendChild(el);
+    }
+
+    // Live updates for the open thread; the browser resumes with Last-Event-ID on reconnect.
+    // If the server turns the stream away (503 when its streams are all taken), poll the cursor instead.
+    function openThreadStream(patientUid) {
+        if (threadStream || threadPoll) return;
+        if (!window.EventSource) {
+            threadPoll = setInterval(() => loadThread(patientUid), 30000);
+            return;
+        }
+        // Resume after the newest message already shown ("0", the epoch, for an empty thread)
+        threadStream = new EventSource(`/doctor/messages/${patientUid}/stream?lastEventId=${encodeURIComponent(threadCursor || '0')}`);
+        threadStream.addEventListener('message', (e) => {
+            if (patientUid === currentPatientUid) appendThreadMessage(patientUid, JSON.parse(e.data));
+        });
+        threadStream.addEventListener('error', () => {
+            if (threadStream && threadStream.readyState === EventSource.CLOSED) {
+                threadStream = null;
+                if (patientUid === currentPatientUid) {
+                    threadPoll = setInterval(() => loadThread(patientUid), 30000);
+                }
+            }
+        });
+    }
+
+    async function loadThread(patientUid) {
+        try {
+            const url = threadCursor
+                ? `/doctor/messages/${patientUid}?since=${encodeURIComponent(threadCursor)}`
+                : `/doctor/messages/${patientUid}`;
+            const response = await fetch(url);
+            if (response.status === 304 || patientUid !== currentPatientUid) return;
+            const messages = await response.json();
+            if (!Array.isArray(messages)) return;
+            messages.forEach(m => appendThreadMessage(patientUid, m));
+            threadCursor = response.headers.get('X-Cursor') || threadCursor;
+            openThreadStream(patientUid);
+        } catch (error) {
+            console.error('Could not load messages', error);
+        }
+    }
+
     function getChartOptions() { return {}; }
 
     function attachSendButtonListener() {
@@ -167,7 +418,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     const result = await response.json();
                     if (result.success) {
                         messageInput.value = '';
-                        alert('Message sent!');
+                        loadThread(currentPatientUid);
                     } else {
                         throw new Error(result.error);
                     }
@@ -0,0 +1,374 @@
+"""Request and dependency timing, exported in Prometheus text format.
+
+Every request is timed per route (``http_request_duration_seconds``; for
+streamed responses this is the time to the first byte) and every RTDB, auth
+and LLM call made through the wrappers below is timed per dependency and
+operation (``dependency_duration_seconds``).  Both are fixed-bucket
+histograms updated under a lock, cheap enough to leave on.
+
+A ``sample_rate`` fraction of requests also keeps detailed spans (RTDB node,
+prompt and response sizes, ...).  They are written with the JSON access log
+line when access logging is on, and the most recent sampled requests are
+served at ``/metrics/traces`` (only when a metrics token is configured).
+
+Metrics are per process: with several gunicorn workers each scrape sees the
+worker that answered it.
+"""
+
+import bisect
+import collections
+import contextlib
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Iterable, Optional, Tuple
+
+from flask import Response, g, has_request_context, jsonify, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+REF_CALLS = {'get', 'set', 'update', 'push', 'delete', 'transaction', 'listen', 'get_if_changed',
+             'set_if_unchanged'}
+
+access_log = logging.getLogger('access')
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels: Tuple, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            series = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _number(bound) + '"'
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {round(total, 6)}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {count}'
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels: Tuple, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Collected:
+    """Samples read from an existing ``stats()`` at scrape time."""
+
+    def __init__(self, name: str, kind: str, help: str, labelnames: Tuple[str, ...],
+                 collect: Callable[[], Iterable[Tuple[Tuple, float]]]):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labelnames = labelnames
+        self.collect = collect
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for labels, value in self.collect():
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Telemetry:
+    def __init__(self, sample_rate: float = 0.0, access_log_enabled: bool = False, max_spans: int = 50,
+                 keep_traces: int = 100):
+        self.sample_rate = sample_rate
+        self.access_log_enabled = access_log_enabled
+        self.max_spans = max_spans
+        self.requests = Histogram('http_request_duration_seconds', 'Request latency by route.',
+                                  ('method', 'route', 'status'))
+        self.dependencies = Histogram('dependency_duration_seconds', 'Latency of RTDB, auth and LLM calls.',
+                                      ('dependency', 'operation', 'target', 'outcome'))
+        self.llm_chars = Counter('llm_payload_chars_total', 'Characters sent to and received from the LLM.',
+                                 ('model', 'direction'))
+        self.exceptions = Counter('app_exceptions_total', 'Exceptions turned into error responses.',
+                                  ('route', 'type'))
+        self.metrics = [self.requests, self.dependencies, self.llm_chars, self.exceptions]
+        self.traces = collections.deque(maxlen=keep_traces)
+        if access_log_enabled and not access_log.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            access_log.addHandler(handler)
+            access_log.setLevel(logging.INFO)
+            access_log.propagate = False
+
+    def add_collector(self, name: str, kind: str, help: str, labelnames: Tuple[str, ...],
+                      collect: Callable[[], Iterable[Tuple[Tuple, float]]]) -> None:
+        self.metrics.append(Collected(name, kind, help, labelnames, collect))
+
+    def add_histogram(self, name: str, help: str, labelnames: Tuple[str, ...], buckets=DEFAULT_BUCKETS) -> Histogram:
+        histogram = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    # Requests
+
+    def init_app(self, app, token: Optional[str] = None, public: bool = False) -> None:
+        """Time every request and serve ``/metrics`` to bearer ``token``.
+
+        Without a token ``/metrics`` answers 401, unless ``public`` is set or
+        the app runs in debug mode (local development).
+        """
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+        def authorized() -> bool:
+            if not token:
+                return public or app.debug
+            return request.headers.get('Authorization') == f'Bearer {token}'
+
+        def metrics():
+            if not authorized():
+                return jsonify({"error": "Unauthorized"}), 401
+            return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+        def traces():
+            # Traces carry request paths, so they are only served behind the token
+            if not token or not authorized():
+                return jsonify({"error": "Unauthorized"}), 401
+            return jsonify(list(self.traces))
+
+        app.add_url_rule('/metrics', 'metrics', metrics)
+        app.add_url_rule('/metrics/traces', 'metrics_traces', traces)
+
+    def _start_request(self) -> None:
+        g.telemetry_start = time.perf_counter()
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        g.telemetry_spans = [] if sampled else None
+
+    def _finish_request(self, response):
+        start = g.pop('telemetry_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        self.requests.observe((request.method, route, str(response.status_code)), elapsed)
+        spans = g.pop('telemetry_spans', None)
+        if spans is None and not self.access_log_enabled:
+            return response
+        entry = {
+            'ts': round(time.time(), 3),
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'ms': round(elapsed * 1000, 2),
+            'bytes': response.calculate_content_length(),
+            'error': g.pop('telemetry_error', None),
+        }
+        if spans is not None:
+            entry['spans'] = spans
+            self.traces.append(entry)
+        if self.access_log_enabled:
+            access_log.info(json.dumps(entry, default=str))
+        return response
+
+    def record_exception(self) -> None:
+        """Call from an ``except`` block that turns the error into a 5xx response."""
+        traceback.print_exc()
+        error_type = sys.exc_info()[0].__name__ if sys.exc_info()[0] else 'Unknown'
+        route = 'background'
+        if has_request_context():
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            g.telemetry_error = error_type
+        self.exceptions.inc((route, error_type))
+
+    # Spans
+
+    def record_span(self, dependency: str, operation: str, elapsed: float, outcome: str, attrs: dict,
+                    target: str = '') -> None:
+        self.dependencies.observe((dependency, operation, target, outcome), elapsed)
+        if not has_request_context():
+            return
+        spans = g.get('telemetry_spans')
+        if spans is not None and len(spans) < self.max_spans:
+            spans.append(dict(attrs, dependency=dependency, operation=operation, target=target,
+                              outcome=outcome, ms=round(elapsed * 1000, 2)))
+
+    @contextlib.contextmanager
+    def span(self, dependency: str, operation: str, target: str = '', **attrs):
+        """Time a block; the yielded dict can be given more attributes (e.g. response size).
+
+        ``target`` (RTDB node, model name) becomes a metric label, so it must
+        come from a small fixed set; per-call details belong in ``attrs``.
+        """
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield attrs
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            self.record_span(dependency, operation, time.perf_counter() - start, outcome, attrs, target)
+
+    def traced(self, dependency: str, operation: str, fn: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            with self.span(dependency, operation):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def trace_ref(self, ref) -> 'TracedRef':
+        return TracedRef(ref, self)
+
+    def trace_model(self, model) -> 'TracedModel':
+        return TracedModel(model, self)
+
+
+def _top_node(path: str) -> str:
+    parts = [p for p in (path or '').split('/') if p]
+    return parts[0] if parts else '/'
+
+
+def _is_ref_like(value) -> bool:
+    return hasattr(value, 'get') and (hasattr(value, 'order_by_key') or hasattr(value, 'limit_to_first'))
+
+
+class TracedRef:
+    """An RTDB Reference/Query whose reads and writes are timed per top-level node."""
+
+    def __init__(self, target, telemetry: Telemetry, node: Optional[str] = None):
+        self._target = target
+        self._telemetry = telemetry
+        self._node = node if node is not None else _top_node(getattr(target, 'path', ''))
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        if name in REF_CALLS:
+            def timed(*args, **kwargs):
+                with self._telemetry.span('rtdb', name, target=self._node):
+                    result = attr(*args, **kwargs)
+                return self._wrap(result) if name == 'push' else result
+            return timed
+
+        def chained(*args, **kwargs):
+            return self._wrap(attr(*args, **kwargs))
+        return chained
+
+    def _wrap(self, result):
+        if not _is_ref_like(result):
+            return result
+        path = getattr(result, 'path', None)
+        return TracedRef(result, self._telemetry, _top_node(path) if isinstance(path, str) else self._node)
+
+
+def _text_length(response) -> int:
+    try:
+        return len(response.text or '')
+    except Exception:
+        # Blocked or empty candidates have no text
+        return 0
+
+
+class TracedModel:
+    """A model whose ``generate_content`` calls are timed, with prompt and response sizes."""
+
+    def __init__(self, model, telemetry: Telemetry):
+        self._model = model
+        self._telemetry = telemetry
+        self._target = str(getattr(model, 'model_name', type(model).__name__)).split('/')[-1]
+
+    def generate_content(self, prompt, **kwargs):
+        prompt_chars = len(str(prompt))
+        self._telemetry.llm_chars.inc((self._target, 'prompt'), prompt_chars)
+        if kwargs.get('stream'):
+            start = time.perf_counter()
+            try:
+                response = self._model.generate_content(prompt, **kwargs)
+            except BaseException:
+                self._telemetry.record_span('llm', 'stream', time.perf_counter() - start, 'error',
+                                            {'promptChars': prompt_chars}, self._target)
+                raise
+            return self._stream(response, start, prompt_chars)
+        with self._telemetry.span('llm', 'generate', self._target, promptChars=prompt_chars) as attrs:
+            response = self._model.generate_content(prompt, **kwargs)
+            attrs['responseChars'] = _text_length(response)
+        self._telemetry.llm_chars.inc((self._target, 'response'), attrs['responseChars'])
+        return response
+
+    def _stream(self, response, start: float, prompt_chars: int):
+        attrs = {'promptChars': prompt_chars, 'responseChars': 0}
+        outcome = 'ok'
+        try:
+            for chunk in response:
+                attrs['responseChars'] += _text_length(chunk)
+                yield chunk
+        except GeneratorExit:
+            # The client went away mid-stream
+            outcome = 'cancelled'
+            raise
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            self._telemetry.record_span('llm', 'stream', time.perf_counter() - start, outcome, attrs,
+                                        self._target)
+            self._telemetry.llm_chars.inc((self._target, 'response'), attrs['responseChars'])
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
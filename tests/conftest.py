@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakes  # noqa: E402
+
+# Before anything imports app or config: local stand-ins for Firebase, Identity Toolkit and Gemini
+installed = fakes.install()
+
+
+@pytest.fixture(scope='session')
+def _bench():
+    import app
+    import benchmark
+    return benchmark.Bench(app, installed, patients=2, messages=2)
+
+
+@pytest.fixture
+def bench(_bench):
+    """One doctor and two patients with a short chat history each, in a freshly reset fake RTDB."""
+    _bench.seed(4)
+    # The search index outlives the reset store; let it re-read the new histories
+    for uid in _bench.patient_uids:
+        _bench.app_module.search.forget_patient(uid)
+    return _bench
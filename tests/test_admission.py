@@ -0,0 +1,42 @@
+import threading
+
+import admission
+import fakes
+
+
+class SlowModel(fakes.FakeGenerativeModel):
+    def __init__(self, started, release):
+        super().__init__('gemini-2.5-pro')
+        self.started = started
+        self.release = release
+
+    def generate_content(self, prompt, **kwargs):
+        self.started.set()
+        self.release.wait(5)
+        return super().generate_content(prompt, **kwargs)
+
+
+def test_gated_model_only_holds_a_slot_during_the_call():
+    gate = admission.Admission().add_gate('analysis', 1, max_wait=0)
+    started, release = threading.Event(), threading.Event()
+    model = admission.GatedModel(SlowModel(started, release), gate)
+
+    caller = threading.Thread(target=model.generate_content, args=('prompt',))
+    caller.start()
+    started.wait(5)
+    try:
+        assert gate.stats()['inFlight'] == 1
+        try:
+            model.generate_content('another prompt')
+        except admission.Busy:
+            pass
+        else:
+            raise AssertionError('a second call should be turned away')
+        # Attribute access (e.g. model_name, stats) never needs a slot
+        assert model.model_name == 'models/gemini-2.5-pro'
+    finally:
+        release.set()
+        caller.join(5)
+
+    assert gate.stats() == {'maxConcurrent': 1, 'inFlight': 0, 'admitted': 1, 'rejected': 1}
+    assert model.generate_content('third prompt').text
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+import analysis
+import app
+import chat_store
+import fakes
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """A fake model that records the prompts it is given; set ``model.fail`` to make it raise."""
+    model = fakes.FakeGenerativeModel('gemini-pro')
+    model.prompts, model.fail = [], False
+
+    def reply(model_name, prompt):
+        model.prompts.append(prompt)
+        if model.fail:
+            raise RuntimeError('model unavailable')
+        return json.dumps({'summary': f'after {len(model.prompts)} calls', 'highlights': [], 'criticalFlags': []})
+
+    monkeypatch.setattr(fakes.FakeGenerativeModel, 'reply', reply)
+    return model
+
+
+def test_an_unchanged_chat_is_served_from_the_cache(bench, model):
+    uid = bench.patient_uids[0]
+    first, info = analysis.analyze(app.db_ref, model, uid)
+    again, cached = analysis.analyze(app.db_ref, model, uid)
+
+    assert info['mode'] == 'full'
+    assert cached['mode'] == 'cache'
+    # RTDB drops empty lists, so compare what was stored
+    assert again['summary'] == first['summary']
+    assert again['moodTimeline'] == first['moodTimeline']
+    assert len(model.prompts) == 1
+
+
+def test_appended_turns_are_analysed_incrementally(bench, model):
+    uid = bench.patient_uids[0]
+    _, full = analysis.analyze(app.db_ref, model, uid)
+    chat_store.append_turn(app.db_ref, uid, 'My headaches are worse today', 'I am sorry to hear that.')
+
+    data, info = analysis.analyze(app.db_ref, model, uid)
+
+    assert info['mode'] == 'incremental'
+    assert info['newTurns'] == 1
+    assert info['turns'] == full['turns'] + 1
+    assert 'My headaches are worse today' in model.prompts[-1]
+    assert 'only the turns added since the previous analysis' in model.prompts[-1]
+    assert data['summary'] == 'after 2 calls'
+
+
+def test_a_changed_history_is_analysed_again_in_full(bench, model):
+    uid = bench.patient_uids[0]
+    analysis.analyze(app.db_ref, model, uid)
+    chat_store.replace_turns(app.db_ref, uid, [{'user': 'A different start', 'ai': 'Noted.'}])
+
+    _, info = analysis.analyze(app.db_ref, model, uid)
+
+    assert info['mode'] == 'full'
+    assert info['turns'] == 1
+
+
+def test_refresh_ignores_the_cache(bench, model):
+    uid = bench.patient_uids[0]
+    analysis.analyze(app.db_ref, model, uid)
+
+    _, info = analysis.analyze(app.db_ref, model, uid, refresh=True)
+
+    assert info['mode'] == 'full'
+    assert len(model.prompts) == 2
+
+
+def test_charts_are_returned_when_the_model_fails_and_it_is_asked_again(bench, model):
+    uid = bench.patient_uids[0]
+    analysis.analyze(app.db_ref, model, uid)
+    meta = app.db_ref.child(analysis.META_NODE).child(uid).get()
+    chat_store.append_turn(app.db_ref, uid, 'I feel hopeless', 'Please reach out to someone you trust.')
+    model.fail = True
+
+    data, info = analysis.analyze(app.db_ref, model, uid)
+
+    assert info['mode'] == 'metrics'
+    assert info['narrativeError'] == 'RuntimeError'
+    assert data['moodTimeline']
+    assert app.db_ref.child(analysis.META_NODE).child(uid).get()['lastKey'] == meta['lastKey']
+
+    model.fail = False
+    _, retried = analysis.analyze(app.db_ref, model, uid)
+    assert retried['mode'] == 'incremental'
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import analysis
+import app
+
+
+def hold_analyses(monkeypatch):
+    """Keep analysis jobs running until the returned event is set."""
+    release = threading.Event()
+
+    def analyze(ref, model, uid, template='', refresh=False):
+        release.wait(5)
+        return dict(analysis.EMPTY_ANALYSIS), {'mode': 'full' if refresh else 'cache'}
+
+    monkeypatch.setattr(analysis, 'analyze', analyze)
+    return release
+
+
+def test_refresh_is_not_answered_by_a_running_plain_job(bench, monkeypatch):
+    release = hold_analyses(monkeypatch)
+    doctor = bench.client('doctor')
+    uid = bench.patient_uids[0]
+    try:
+        plain = doctor.post(f'/analyze-chats/{uid}/jobs').get_json()
+        again = doctor.post(f'/analyze-chats/{uid}/jobs').get_json()
+        refresh = doctor.post(f'/analyze-chats/{uid}/jobs?refresh=1').get_json()
+    finally:
+        release.set()
+
+    assert again['jobId'] == plain['jobId']
+    assert refresh['jobId'] != plain['jobId']
+
+
+def test_polls_wait_at_most_the_configured_time(bench, monkeypatch):
+    release = hold_analyses(monkeypatch)
+    monkeypatch.setattr(app, 'analysis_job_max_wait', 0.2)
+    doctor = bench.client('doctor')
+    try:
+        job = doctor.post(f'/analyze-chats/{bench.patient_uids[1]}/jobs').get_json()
+        started = time.perf_counter()
+        poll = doctor.get(f"/analysis-jobs/{job['jobId']}?wait=20").get_json()
+        elapsed = time.perf_counter() - started
+    finally:
+        release.set()
+
+    assert poll['status'] in ('queued', 'running')
+    assert elapsed < 2
+
+
+def test_sweep_removes_records_left_by_another_worker(bench):
+    jobs_ref = app.db_ref.child('analysis_jobs')
+    old = time.time() - app.analysis_jobs.keep_finished - app.ANALYSIS_JOB_CLAIM_TTL - 60
+    jobs_ref.child('orphaned').set({'status': 'running', 'created': old, 'finished': None})
+    jobs_ref.child('finished').set({'status': 'done', 'created': old, 'finished': old + 1})
+    jobs_ref.child('recent').set({'status': 'done', 'created': time.time(), 'finished': time.time()})
+    claims_ref = app.db_ref.child('analysis_jobs_active')
+    claims_ref.child('gone').set({'jobId': 'orphaned', 'expires': time.time() - 1})
+    claims_ref.child('live').set({'jobId': 'recent', 'expires': time.time() + 60})
+
+    app.sweep_analysis_jobs()
+
+    assert set(jobs_ref.get() or {}) >= {'recent'}
+    assert not {'orphaned', 'finished'} & set(jobs_ref.get() or {})
+    assert set(claims_ref.get() or {}) == {'live'}
+
+
+def test_job_duration_and_queue_depth_are_exported(bench):
+    doctor = bench.client('doctor')
+    job = doctor.post(f'/analyze-chats/{bench.patient_uids[0]}/jobs').get_json()
+    doctor.get(f"/analysis-jobs/{job['jobId']}?wait=5")
+
+    text = app.app_telemetry.render()
+    assert 'analysis_jobs{state="queued"}' in text
+    assert 'analysis_jobs_total{event="completed"}' in text
+    assert 'analysis_job_duration_seconds_count{status="done"}' in text
@@ -0,0 +1,37 @@
+import benchmark
+import direct_messages
+
+
+def test_seeded_message_keys_follow_their_timestamps(bench):
+    thread = bench.installed.store.read([direct_messages.MESSAGES_NODE, bench.patient_uids[0]])
+
+    by_key = [thread[key]['timestamp'] for key in sorted(thread)]
+    assert by_key == sorted(by_key)
+
+
+def test_polling_from_the_cursor_is_not_modified(bench):
+    patient = bench.client('patient', 0)
+    first = patient.get('/get-direct-messages')
+
+    again = patient.get(f"/get-direct-messages?since={first.headers['X-Cursor']}")
+    repeat = patient.get(f"/get-direct-messages?since={first.headers['X-Cursor']}",
+                         headers={'If-None-Match': again.headers['ETag']})
+
+    assert len(first.get_json()) == bench.messages
+    assert again.get_json() == []
+    assert repeat.status_code == 304
+
+
+def test_every_route_runs_without_errors(bench):
+    for route in benchmark.ROUTES:
+        result = bench.run(route, concurrency=2, total=4)
+        assert result['requests'] == 4
+        assert result['errors'] == 0, (route, result['statuses'])
+
+
+def test_compare_reports_regressions():
+    base = {'route': 'chat', 'concurrency': 1, 'history': 0, 'p95Ms': 10.0, 'rps': 100.0}
+    slower = dict(base, p95Ms=20.0, rps=50.0)
+
+    assert benchmark.compare([base], {'results': [base]}, 0.2) == []
+    assert len(benchmark.compare([slower], {'results': [base]}, 0.2)) == 2
@@ -0,0 +1,17 @@
+def test_patients_do_not_see_context_details(bench):
+    patient = bench.client('patient', 0)
+
+    reply = patient.post('/chat', json={'message': 'Hello'}).get_json()
+    stream = patient.post('/chat/stream', json={'message': 'Hello again'}).get_data(as_text=True)
+
+    assert set(reply) == {'response'}
+    assert 'event: done\ndata: {}' in stream
+    assert patient.get('/chat/context-stats').status_code == 401
+
+
+def test_doctors_see_context_stats(bench):
+    bench.client('patient', 0).post('/chat', json={'message': 'Hello'})
+
+    stats = bench.client('doctor').get('/chat/context-stats').get_json()
+
+    assert stats['byHistoryLength']
@@ -0,0 +1,44 @@
+import app
+import chat_metrics
+
+
+def stored_turn(message, timestamp='2024-05-01T10:00:00Z'):
+    # The form /chat stores: the patient's message goes through sanitize_input (html.escape)
+    return {'user': app.sanitize_input(message), 'ai': 'ok', 'timestamp': timestamp}
+
+
+def test_escaped_apostrophes_still_count_as_high_urgency():
+    turn = stored_turn("I can't go on like this anymore")
+    assert '&#x27;' in turn['user']
+
+    state = chat_metrics.update_state(None, [turn])
+
+    assert state['urgency']['High'] == 1
+    assert state['urgent'][0]['message'] == turn['user']
+    assert 'don' not in state['keywords'] and 'x27' not in state['keywords']
+
+
+def test_escaped_negation_is_applied():
+    state = chat_metrics.update_state(None, [stored_turn("I don't feel happy")])
+
+    # "don't happy" lowers the mood instead of counting as joy
+    assert state['mood'][0][1] == -1.0
+    assert not state['emotions'].get('Joy')
+
+
+def test_incremental_update_matches_one_pass():
+    turns = [stored_turn("I'm worried & can't sleep"), stored_turn('Feeling calm today 😊'),
+             stored_turn("I <really> want to end it all")]
+
+    one_pass = chat_metrics.update_state(None, turns)
+    incremental = chat_metrics.update_state(chat_metrics.update_state(None, turns[:1]), turns[1:])
+
+    assert incremental == one_pass
+    assert one_pass['urgency'] == {'Low': 1, 'Medium': 1, 'High': 1}
+    assert one_pass['emojis'] == {'😊': 1}
+
+
+def test_state_records_scoring_version():
+    state = chat_metrics.update_state(None, [stored_turn('fine')])
+
+    assert state['version'] == chat_metrics.SCORING_VERSION
@@ -0,0 +1,75 @@
+import threading
+
+import chat_store
+
+
+def turns(*texts):
+    return [{'user': text, 'ai': f're: {text}'} for text in texts]
+
+
+def test_legacy_list_gets_ordinals_and_a_counter_on_first_append(bench):
+    ref = bench.app_module.db_ref
+    ref.child(chat_store.CHATS_NODE).child('legacy-patient').set(turns('one', 'two', 'three'))
+
+    ordinal = chat_store.append_turn(ref, 'legacy-patient', 'four', 're: four')
+
+    stored = chat_store.all_turns(ref, 'legacy-patient')
+    assert ordinal == 3
+    assert [t['user'] for t in stored] == ['one', 'two', 'three', 'four']
+    assert [t['ordinal'] for t in stored] == [0, 1, 2, 3]
+    assert ref.child(chat_store.META_NODE).child('legacy-patient').get()['count'] == 4
+
+
+def test_appends_after_push_id_turns_stay_in_order(bench):
+    ref = bench.app_module.db_ref
+    chats = ref.child(chat_store.CHATS_NODE).child('pushed-patient')
+    for i, turn in enumerate(turns('one', 'two')):
+        chats.push(dict(turn, ordinal=i))
+    ref.child(chat_store.META_NODE).child('pushed-patient').set({'count': 2, 'format': 'append'})
+
+    chat_store.append_turn(ref, 'pushed-patient', 'three', 're: three')
+
+    assert [t['user'] for t in chat_store.all_turns(ref, 'pushed-patient')] == ['one', 'two', 'three']
+
+
+def test_key_order_is_ordinal_order_under_concurrent_appends(bench):
+    ref = bench.app_module.db_ref
+    uid = bench.patient_uids[0]
+    threads = [threading.Thread(target=chat_store.append_turn, args=(ref, uid, f'm{i}', 'ok')) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ordinals = [t['ordinal'] for t in chat_store.all_turns(ref, uid)]
+    assert ordinals == list(range(len(ordinals)))
+    assert [t['ordinal'] for t in chat_store.recent_turns(ref, uid, 5)] == ordinals[-5:]
+
+
+def test_replace_turns_resets_history_and_counter(bench):
+    ref = bench.app_module.db_ref
+    uid = bench.patient_uids[0]
+
+    chat_store.replace_turns(ref, uid, turns('a', 'b'))
+    ordinal = chat_store.append_turn(ref, uid, 'c', 're: c')
+
+    assert ordinal == 2
+    assert [(t['user'], t['ordinal']) for t in chat_store.all_turns(ref, uid)] == [('a', 0), ('b', 1), ('c', 2)]
+    assert ref.child(chat_store.META_NODE).child(uid).get()['count'] == 3
+
+
+def test_turns_page_walks_back_to_the_start(bench):
+    ref = bench.app_module.db_ref
+    uid = bench.patient_uids[0]
+    chat_store.replace_turns(ref, uid, turns('a', 'b', 'c'))
+    for text in ('d', 'e', 'f', 'g'):
+        chat_store.append_turn(ref, uid, text, 'ok')
+
+    pages, before = [], None
+    while True:
+        page, before = chat_store.turns_page(ref, uid, 3, before)
+        pages.append([t['user'] for t in page])
+        if before is None:
+            break
+
+    assert pages == [['e', 'f', 'g'], ['b', 'c', 'd'], ['a']]
@@ -0,0 +1,50 @@
+import json
+
+import fakes
+
+
+def events(response):
+    """(event, data) pairs of an SSE response body; closes the response, releasing its admission slot."""
+    with response:
+        body = response.get_data(as_text=True)
+    parsed = []
+    for frame in body.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in frame.splitlines() if ': ' in line)
+        if 'event' in fields:
+            parsed.append((fields['event'], json.loads(fields.get('data', '{}'))))
+    return parsed
+
+
+def test_chunks_are_relayed_and_the_turn_is_stored(bench, monkeypatch):
+    monkeypatch.setattr(fakes.FakeGenerativeModel, 'reply', lambda model, prompt: 'Try a warm bath before bed.')
+    patient = bench.client('patient', 0)
+
+    response = patient.post('/chat/stream', json={'message': 'I cannot sleep'})
+
+    assert response.mimetype == 'text/event-stream'
+    received = events(response)
+    assert [name for name, _ in received[-1:]] == ['done']
+    chunks = [data['text'] for name, data in received if name == 'chunk']
+    assert len(chunks) > 1
+    assert ''.join(chunks) == 'Try a warm bath before bed.'
+    last = patient.get('/chat/history').get_json()[-1]
+    assert last['user'] == 'I cannot sleep'
+    assert last['ai'] == 'Try a warm bath before bed.'
+
+
+def test_a_model_failure_is_an_error_event_and_stores_nothing(bench, monkeypatch):
+    def fail(model, prompt):
+        raise RuntimeError('model unavailable')
+
+    monkeypatch.setattr(fakes.FakeGenerativeModel, 'reply', fail)
+    patient = bench.client('patient', 0)
+    before = patient.get('/chat/history').get_json()
+
+    received = events(patient.post('/chat/stream', json={'message': 'Hello?'}))
+
+    assert [name for name, _ in received] == ['error']
+    assert patient.get('/chat/history').get_json() == before
+
+
+def test_only_patients_may_stream(bench):
+    assert bench.client('doctor').post('/chat/stream', json={'message': 'Hi'}).status_code == 401
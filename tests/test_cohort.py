@@ -0,0 +1,62 @@
+import json
+
+import cohort
+
+
+def events(response):
+    """(event, data) pairs of an SSE response body; closes the response, releasing its admission slot."""
+    with response:
+        body = response.get_data(as_text=True)
+    parsed = []
+    for frame in body.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in frame.splitlines() if ': ' in line)
+        if 'event' in fields:
+            parsed.append((fields['event'], json.loads(fields.get('data', '{}'))))
+    return parsed
+
+
+def test_triage_rows_put_the_most_urgent_first():
+    entries = [
+        {'uid': 'calm', 'status': cohort.SKIPPED, 'triage': {'maxSeverity': 0, 'flags': 0, 'high': 0.1}},
+        {'uid': 'unknown', 'status': cohort.MISSING},
+        {'uid': 'flagged', 'status': cohort.ANALYZED, 'triage': {'maxSeverity': 4, 'flags': 1, 'high': 0}},
+        {'uid': 'worried', 'status': cohort.ANALYZED, 'triage': {'maxSeverity': 0, 'flags': 0, 'high': 0.6}},
+    ]
+
+    rows = cohort.triage_rows(entries, {'flagged': {'fullname': 'Ada'}})
+
+    assert [row['uid'] for row in rows] == ['flagged', 'worried', 'calm', 'unknown']
+    assert rows[0]['name'] == 'Ada'
+    assert rows[1]['name'] == 'worried'
+    assert cohort.counts(entries)[cohort.ANALYZED] == 2
+
+
+def test_cohort_analysis_streams_every_patient_then_skips_unchanged_chats(bench):
+    doctor = bench.client('doctor')
+
+    first = events(doctor.get('/doctor/cohort-analysis'))
+    names = [name for name, _ in first]
+    assert names[0] == 'start' and names[-1] == 'done'
+    patients = [data for name, data in first if name == 'patient']
+    assert sorted(p['uid'] for p in patients) == sorted(bench.patient_uids)
+    assert all(p['status'] == cohort.ANALYZED for p in patients)
+    assert len(first[-1][1]['triage']) == len(bench.patient_uids)
+
+    again = [data for name, data in events(doctor.get('/doctor/cohort-analysis')) if name == 'patient']
+    assert all(p['status'] == cohort.SKIPPED for p in again)
+
+
+def test_triage_reads_only_stored_analyses(bench):
+    doctor = bench.client('doctor')
+    before = doctor.get('/doctor/triage').get_json()
+    assert before['counts'][cohort.MISSING] == len(bench.patient_uids)
+
+    events(doctor.get('/doctor/cohort-analysis'))
+    after = doctor.get('/doctor/triage').get_json()
+
+    assert after['counts'][cohort.SKIPPED] == len(bench.patient_uids)
+    assert not any(row['stale'] for row in after['triage'])
+
+
+def test_only_doctors_may_run_a_cohort_analysis(bench):
+    assert bench.client('patient', 0).get('/doctor/cohort-analysis').status_code == 401
@@ -0,0 +1,53 @@
+import direct_messages
+
+
+def write_thread(bench, messages):
+    uid = bench.patient_uids[0]
+    bench.app_module.db_ref.child(direct_messages.MESSAGES_NODE).child(uid).set(messages)
+    return uid
+
+
+def test_thread_is_returned_by_timestamp_with_a_cursor(bench):
+    write_thread(bench, {'-k1': {'from': 'd', 'message': 'first', 'timestamp': 1000},
+                         '-k2': {'from': 'd', 'message': 'second', 'timestamp': 2000}})
+    patient = bench.client('patient', 0)
+
+    response = patient.get('/get-direct-messages')
+
+    assert [m['message'] for m in response.get_json()] == ['first', 'second']
+    assert response.headers['X-Cursor'] == '-k2'
+
+
+def test_cursor_is_the_largest_key_when_keys_and_timestamps_disagree(bench):
+    # Keys go up while timestamps go down, e.g. messages imported or sent with a skewed clock
+    write_thread(bench, {'-k1': {'from': 'd', 'message': 'a', 'timestamp': 3000},
+                         '-k2': {'from': 'd', 'message': 'b', 'timestamp': 2000},
+                         '-k3': {'from': 'd', 'message': 'c', 'timestamp': 1000}})
+    patient = bench.client('patient', 0)
+
+    first = patient.get('/get-direct-messages?since=-k1')
+    assert [m['message'] for m in first.get_json()] == ['c', 'b']
+    assert first.headers['X-Cursor'] == '-k3'
+
+    again = patient.get(f"/get-direct-messages?since={first.headers['X-Cursor']}")
+    assert again.get_json() == []
+    repeat = patient.get(f"/get-direct-messages?since={first.headers['X-Cursor']}",
+                         headers={'If-None-Match': again.headers['ETag']})
+    assert repeat.status_code == 304
+
+
+def test_limited_page_is_cut_in_key_order(bench):
+    uid = write_thread(bench, {'-k1': {'from': 'd', 'message': 'a', 'timestamp': 3000},
+                               '-k2': {'from': 'd', 'message': 'b', 'timestamp': 2000},
+                               '-k3': {'from': 'd', 'message': 'c', 'timestamp': 1000}})
+
+    page, cursor = direct_messages.fetch_messages(bench.app_module.db_ref, uid, since='-k0', limit=2)
+    rest, _ = direct_messages.fetch_messages(bench.app_module.db_ref, uid, since=cursor, limit=2)
+
+    assert [m['id'] for m in page] == ['-k2', '-k1'] and cursor == '-k2'
+    assert [m['id'] for m in rest] == ['-k3']
+
+
+def test_new_keys_sort_in_creation_order():
+    keys = [direct_messages.new_key() for _ in range(500)]
+    assert sorted(keys) == keys and len(set(keys)) == len(keys)
@@ -0,0 +1,87 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import http_client
+
+
+class Server:
+    """Counts requests and answers each with ``status`` after ``delay`` seconds."""
+
+    def __init__(self, status: int = 200, delay: float = 0.0):
+        self.status, self.delay, self.requests = status, delay, 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self):
+                server.requests += 1
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                time.sleep(server.delay)
+                self.send_response(server.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            do_GET = do_POST = reply
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(**kwargs):
+        servers.append(Server(**kwargs))
+        return servers[-1]
+
+    yield start
+    for s in servers:
+        s.close()
+
+
+def client():
+    return http_client.HttpClient(read_timeout=0.2, retries=2, backoff=0)
+
+
+def test_post_is_not_resent_after_a_read_timeout(server):
+    slow = server(delay=0.5)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client().post(slow.url, json={})
+    time.sleep(0.5)
+    assert slow.requests == 1
+
+
+def test_post_is_not_resent_after_a_server_error(server):
+    failing = server(status=503)
+    assert client().post(failing.url, json={}).status_code == 503
+    assert failing.requests == 1
+
+
+def test_post_is_resent_when_refused_with_429(server):
+    limited = server(status=429)
+    assert client().post(limited.url, json={}).status_code == 429
+    assert limited.requests == 3
+
+
+def test_get_is_retried_after_server_errors_and_timeouts(server):
+    failing = server(status=503)
+    assert client().get(failing.url).status_code == 503
+    assert failing.requests == 3
+
+    slow = server(delay=0.5)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client().get(slow.url)
+    time.sleep(0.5)
+    assert slow.requests == 3
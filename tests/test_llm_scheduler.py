@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+import fakes
+import llm_scheduler
+
+
+class RecordingModel(fakes.FakeGenerativeModel):
+    """Fake model that records prompts in call order and can fail its first calls with a status code."""
+
+    output_chars = 0
+
+    def __init__(self, model_name='gemini-test', fail_with=(), **kwargs):
+        super().__init__(model_name, **kwargs)
+        self.prompts = []
+        self.fail_with = list(fail_with)
+
+    def generate_content(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        if self.fail_with:
+            error = Exception('quota')
+            error.code = self.fail_with.pop(0)
+            raise error
+        return super().generate_content(prompt, **kwargs)
+
+
+def drain(scheduler, model):
+    limiter = scheduler._queue(model.model_name).limiter
+    while limiter.try_acquire(1) == 0:
+        pass
+    return limiter
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.005)
+
+
+def test_queued_chat_is_admitted_before_queued_analysis():
+    scheduler = llm_scheduler.Scheduler(expected_output_tokens=0)
+    model = RecordingModel()
+    scheduler.set_limits(model.model_name, rpm=600)
+    drain(scheduler, model)
+    queued = lambda name: scheduler.stats()[model.model_name].get(name, {}).get('queued', 0)
+
+    analysis = threading.Thread(target=scheduler.wrap(model, llm_scheduler.ANALYSIS).generate_content,
+                                args=('analysis',))
+    analysis.start()
+    wait_until(lambda: queued('analysis') == 1)
+    chat = threading.Thread(target=scheduler.wrap(model, llm_scheduler.INTERACTIVE).generate_content,
+                            args=('chat',))
+    chat.start()
+    analysis.join()
+    chat.join()
+
+    assert model.prompts == ['chat', 'analysis']
+
+
+def test_token_bucket_waits_for_refill():
+    scheduler = llm_scheduler.Scheduler(expected_output_tokens=0)
+    model = RecordingModel()
+    scheduler.set_limits(model.model_name, tpm=6000)  # 100 tokens a second
+    limiter = drain(scheduler, model)
+
+    assert limiter.try_acquire(10) == pytest.approx(0.1, abs=0.02)
+    time.sleep(0.15)
+    assert limiter.try_acquire(10) == 0
+
+    drain(scheduler, model)
+    started = time.perf_counter()
+    scheduler.generate(model, llm_scheduler.INTERACTIVE, 'x' * 40)  # 10 tokens
+    assert time.perf_counter() - started >= 0.08
+    assert scheduler.stats()[model.model_name]['interactive']['waitSeconds'] > 0
+
+
+def test_429_is_retried_with_backoff():
+    scheduler = llm_scheduler.Scheduler(backoff=0.05)
+    model = RecordingModel(fail_with=[429, 429])
+
+    started = time.perf_counter()
+    response = scheduler.generate(model, llm_scheduler.INTERACTIVE, 'hello')
+
+    assert response.text == ''
+    assert len(model.prompts) == 3
+    # Jittered delays of at least half of 0.05 s and 0.1 s
+    assert time.perf_counter() - started >= 0.075
+    assert scheduler.stats()[model.model_name]['interactive']['retries'] == 2
+
+
+def test_429_beyond_max_retries_is_overloaded():
+    scheduler = llm_scheduler.Scheduler(backoff=0.01, max_retries=1)
+    model = RecordingModel(fail_with=[429, 429])
+
+    with pytest.raises(llm_scheduler.Overloaded):
+        scheduler.generate(model, llm_scheduler.INTERACTIVE, 'hello')
+    assert len(model.prompts) == 2
+
+
+def test_overloaded_after_queue_timeout():
+    scheduler = llm_scheduler.Scheduler(queue_timeout=0.1)
+    model = RecordingModel()
+    scheduler.set_limits(model.model_name, rpm=1)
+    drain(scheduler, model)
+
+    with pytest.raises(llm_scheduler.Overloaded) as excinfo:
+        scheduler.generate(model, llm_scheduler.BACKGROUND, 'summary')
+
+    assert excinfo.value.retry_after >= 1
+    assert model.prompts == []
+    assert scheduler.stats()[model.model_name]['background']['throttled'] == 1
+
+
+def test_rate_state_is_shared_through_state_dir(tmp_path):
+    # Two schedulers stand in for two gunicorn workers on one host
+    first = llm_scheduler.Scheduler(queue_timeout=0.1, expected_output_tokens=0)
+    second = llm_scheduler.Scheduler(queue_timeout=0.1, expected_output_tokens=0)
+    model = RecordingModel()
+    for scheduler in (first, second):
+        scheduler.set_limits(model.model_name, rpm=2, state_dir=str(tmp_path))
+
+    first.generate(model, llm_scheduler.INTERACTIVE, 'one')
+    second.generate(model, llm_scheduler.INTERACTIVE, 'two')
+    with pytest.raises(llm_scheduler.Overloaded):
+        first.generate(model, llm_scheduler.INTERACTIVE, 'three')
+
+    assert model.prompts == ['one', 'two']
+    assert second.stats()[model.model_name]['limits']['shared']
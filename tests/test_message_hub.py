@@ -0,0 +1,89 @@
+import direct_messages
+import fakes
+import message_hub
+
+
+class FailingRef:
+    """A reference whose listener cannot be opened the first ``failures`` times."""
+
+    def __init__(self, ref, failures):
+        self.ref = ref
+        self.failures = failures
+
+    def listen(self, callback):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('RTDB unavailable')
+        return self.ref.listen(callback)
+
+
+def test_failed_listen_releases_the_slot():
+    store = fakes.FakeStore()
+    hub = message_hub.MessageHub(FailingRef(fakes.FakeReference('/direct_messages_latest', store), failures=2),
+                                 max_subscribers=2)
+
+    for _ in range(2):
+        try:
+            hub.subscribe('patient-1')
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError('subscribe should raise while RTDB is down')
+
+    assert hub.stats()['subscribers'] == 0
+    sub = hub.subscribe('patient-1')
+    assert sub is not None and hub.stats()['listening']
+    sub.close()
+
+
+def message(text):
+    return {'from': 'doctor-1', 'message': text, 'timestamp': 1}
+
+
+def test_new_message_is_delivered_after_the_initial_snapshot():
+    store = fakes.FakeStore()
+    root = fakes.FakeReference('/', store)
+    direct_messages.send(root, 'patient-1', message('before'))
+    hub = message_hub.MessageHub(root.child(direct_messages.LATEST_NODE))
+
+    sub = hub.subscribe('patient-1')
+    key = direct_messages.send(root, 'patient-1', message('after'))
+
+    msg = sub.get(timeout=1)
+    assert msg['id'] == key and msg['message'] == 'after'
+    assert sub.get(timeout=0.01) is None
+    hub.close()
+
+
+def test_listener_starts_from_the_latest_messages_only():
+    store = fakes.FakeStore()
+    root = fakes.FakeReference('/', store)
+    for n in range(50):
+        direct_messages.send(root, f'patient-{n % 5}', message(f'm{n}'))
+    snapshots = []
+    hub = message_hub.MessageHub(root.child(direct_messages.LATEST_NODE))
+    original = hub._on_event
+    hub._on_event = lambda event: snapshots.append(event.data) or original(event)
+
+    hub.subscribe('patient-1')
+
+    assert len(snapshots[0]) == 5
+    assert all(isinstance(latest, dict) and latest['id'] for latest in snapshots[0].values())
+    hub.close()
+
+
+def test_reconnect_catches_up_on_every_missed_message():
+    store = fakes.FakeStore()
+    root = fakes.FakeReference('/', store)
+    direct_messages.send(root, 'patient-1', message('seen'))
+    hub = message_hub.MessageHub(
+        root.child(direct_messages.LATEST_NODE),
+        backfill=lambda thread_id, since: direct_messages.fetch_messages(root, thread_id, since=since)[0])
+    sub = hub.subscribe('patient-1')
+
+    hub.close()
+    missed = [direct_messages.send(root, 'patient-1', message(f'missed {n}')) for n in range(3)]
+    hub._ensure_listening()
+
+    assert [sub.get(timeout=1)['id'] for _ in missed] == missed
+    hub.close()
@@ -0,0 +1,49 @@
+import threading
+import time
+
+import google.generativeai as genai
+
+import fakes
+import prompts
+
+
+class FakeCache:
+    def update(self, ttl):
+        pass
+
+    def delete(self):
+        pass
+
+
+def test_cache_is_created_once_outside_the_lock(monkeypatch, tmp_path):
+    release = threading.Event()
+    created = []
+
+    def create(model, system_instruction, ttl):
+        release.wait(5)
+        created.append(FakeCache())
+        return created[-1]
+
+    monkeypatch.setattr(genai.caching.CachedContent, 'create', create)
+    monkeypatch.setattr(fakes.FakeGenerativeModel, 'from_cached_content',
+                        staticmethod(lambda cache: fakes.FakeGenerativeModel('cached')), raising=False)
+    prompt_path = tmp_path / 'system.md'
+    prompt_path.write_text('You are a careful listener.')
+    model = prompts.InstructedModel('gemini-test', prompts.PromptFile(str(prompt_path)), cache_ttl=600)
+
+    creator = threading.Thread(target=model.generate_content, args=('first',))
+    creator.start()
+    deadline = time.time() + 2
+    while not model._renewing:
+        assert time.time() < deadline
+        time.sleep(0.005)
+    # Served with the plain system instruction while another caller creates the cache
+    model.generate_content('second')
+    assert model.stats()['calls'] == 1
+    assert not model.stats()['contextCache']
+
+    release.set()
+    creator.join()
+    assert len(created) == 1
+    assert model._current().model_name == 'models/cached'
+    assert model.stats()['contextCache']
@@ -0,0 +1,54 @@
+import app
+import roster
+
+
+def relink(bench, patient_uid, doctor_uid='another-doctor'):
+    """Move a patient without touching the roster, as a console edit would."""
+    app.db_ref.child('users').child(patient_uid).child('linkedDoctorUID').set(doctor_uid)
+
+
+def roster_uids(bench):
+    return set(app.db_ref.child('doctors').child(bench.doctor_uid).child(roster.ROSTER_CHILD).get() or {})
+
+
+def test_legacy_roster_is_built_from_users(bench):
+    doctor_ref = app.db_ref.child('doctors').child(bench.doctor_uid)
+    doctor_ref.child(roster.ROSTER_CHILD).delete()
+    doctor_ref.child(roster.BUILT_FLAG).delete()
+
+    patients = roster.get_roster(app.db_ref, bench.doctor_uid)
+
+    assert set(patients) == set(bench.patient_uids)
+    assert doctor_ref.child(roster.BUILT_FLAG).get() is True
+
+
+def test_a_relinked_patient_is_not_accessible(bench):
+    moved = bench.patient_uids[0]
+    relink(bench, moved)
+    doctor = bench.client('doctor')
+
+    assert doctor.post(f'/analyze-chats/{moved}/jobs').status_code == 403
+    assert doctor.get(f'/doctor/search?q=sleep&patient={moved}').status_code == 403
+    assert moved not in roster_uids(bench)
+
+
+def test_triage_drops_stale_roster_entries(bench):
+    moved, kept = bench.patient_uids
+    relink(bench, moved)
+
+    rows = bench.client('doctor').get('/doctor/triage').get_json()['triage']
+
+    assert [row['uid'] for row in rows] == [kept]
+    assert roster_uids(bench) == {kept}
+
+
+def test_search_leaves_out_stale_roster_entries(bench):
+    for i, uid in enumerate(bench.patient_uids):
+        bench.client('patient', i).post('/chat', json={'message': 'My insomnia is back'})
+    moved = bench.patient_uids[0]
+    relink(bench, moved)
+
+    body = bench.client('doctor').get('/doctor/search?q=insomnia').get_json()
+
+    assert body['total'] >= 1
+    assert {r['patientUid'] for r in body['results']} == {bench.patient_uids[1]}
@@ -0,0 +1,30 @@
+import app
+import clients
+
+
+def broken_index():
+    raise OSError('unable to open database file')
+
+
+def test_chat_and_messages_are_stored_when_the_index_cannot_be_opened(bench, monkeypatch):
+    monkeypatch.setattr(app, 'search', clients.Lazy(broken_index))
+    patient = bench.client('patient', 0)
+    doctor = bench.client('doctor')
+    uid = bench.patient_uids[0]
+
+    assert patient.post('/chat', json={'message': 'I slept badly'}).status_code == 200
+    assert patient.post('/send-message-to-doctor', json={'message': 'Can we talk?'}).status_code == 200
+    assert doctor.post(f'/send-direct-message/{uid}', json={'message': 'Of course'}).status_code == 200
+
+    history = patient.get('/chat/history').get_json()
+    assert history[-1]['user'] == 'I slept badly'
+
+
+def test_written_through_turns_are_searchable(bench):
+    patient = bench.client('patient', 0)
+    patient.post('/chat', json={'message': 'My insomnia is back'})
+
+    results = bench.client('doctor').get('/doctor/search?q=insomnia').get_json()
+
+    assert results['total'] >= 1
+    assert results['results'][0]['patientUid'] == bench.patient_uids[0]
@@ -0,0 +1,61 @@
+import json
+import random
+
+import direct_messages
+import fakes
+import seed_bulk
+import seed_demo
+
+BULK_ARGS = ['--bulk', '--doctors', '2', '--patients', '7', '--chunk-size', '3', '--turns', '3',
+             '--messages', '2', '--end-date', '2024-01-01', '--hash-rounds', '1', '--workers', '2']
+
+
+def plan(**overrides):
+    params = dict(seed=1, doctors=2, patients=5, turns=4, turns_distribution='fixed', messages=3,
+                  messages_distribution='fixed', days=10, urgent_rate=0.1, domain='bulk.test',
+                  end_ms=1_700_000_000_000, hash_rounds=1)
+    params.update(overrides)
+    return seed_bulk.Plan(**params)
+
+
+def test_same_seed_same_data():
+    assert seed_bulk.patient_data(plan(), 3) == seed_bulk.patient_data(plan(), 3)
+    assert seed_bulk.patient_data(plan(), 3) != seed_bulk.patient_data(plan(seed=2), 3)
+
+
+def test_message_keys_sort_by_timestamp():
+    rng = random.Random(0)
+    stamps = [1_700_000_000_000 + n * 1000 for n in range(50)]
+    keys = [direct_messages.push_key(at, rng) for at in stamps]
+    assert sorted(keys) == keys
+
+
+def test_split_updates_respects_the_size_limit():
+    updates = {f'users/u{i}': {'name': 'x' * 50} for i in range(20)}
+    batches = list(seed_bulk.split_updates(updates, 200))
+    assert len(batches) > 1
+    assert all(size <= 200 for _, size in batches)
+    assert {k: v for batch, _ in batches for k, v in batch.items()} == updates
+
+
+def run_offline(installed, monkeypatch, *args):
+    # Every run is a new process with an empty stand-in database
+    with installed.store._lock:
+        installed.store.root = {}
+    monkeypatch.setattr(fakes, 'install', lambda: installed)
+    return seed_demo.main(list(args))
+
+
+def test_resumed_offline_run_keeps_the_earlier_dump(bench, monkeypatch, tmp_path):
+    dump, state = str(tmp_path / 'db.json'), str(tmp_path / 'state.json')
+    args = BULK_ARGS + ['--offline', dump, '--state', state]
+
+    assert run_offline(bench.installed, monkeypatch, *args) == 0
+    with open(dump) as f:
+        first = json.load(f)
+    assert run_offline(bench.installed, monkeypatch, *args) == 0
+    with open(dump) as f:
+        second = json.load(f)
+
+    assert len(first['users']) == 7
+    assert second == first
@@ -0,0 +1,36 @@
+import app
+
+
+def stored_sessions(bench):
+    return bench.installed.store.root.get(app.AUTH_SESSIONS_NODE) or {}
+
+
+def test_refresh_token_stays_on_the_server(bench):
+    patient = bench.client('patient', 0)
+
+    with patient.session_transaction() as cookie:
+        assert 'refresh_token' not in cookie
+        assert cookie['sid']
+    stored = list(stored_sessions(bench).values())
+    assert len(stored) == 1 and stored[0]['refreshToken']
+
+
+def test_expiring_token_is_refreshed_from_the_stored_refresh_token(bench):
+    patient = bench.client('patient', 0)
+    with patient.session_transaction() as cookie:
+        cookie['token_expires'] = 0
+        old_token = cookie['user']
+
+    assert patient.get('/chat/history').status_code == 200
+    with patient.session_transaction() as cookie:
+        assert cookie['user'] != old_token
+        assert cookie['token_expires'] > 0
+
+
+def test_logout_drops_the_stored_refresh_token(bench):
+    patient = bench.client('patient', 0)
+    assert stored_sessions(bench)
+
+    patient.get('/logout')
+
+    assert not stored_sessions(bench)
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+import clients
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_the_app_creates_no_clients():
+    # A fresh interpreter without credentials: the import must not need Firebase or Gemini
+    env = {k: v for k, v in os.environ.items() if not k.startswith(('FIREBASE_', 'GEMINI_'))}
+    code = ('import sys, app, clients; '
+            'assert "firebase_admin" not in sys.modules and "google.generativeai" not in sys.modules; '
+            'assert clients._firebase_pid is None and clients._gemini_pid is None; '
+            'assert repr(app.search) == "<Lazy (not created)>"')
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True)
+
+
+def test_lazy_builds_once_per_process(monkeypatch):
+    built = []
+    lazy = clients.Lazy(lambda: built.append(1) or {'n': len(built)})
+
+    assert lazy.get('n') == 1
+    assert lazy.get('n') == 1
+    monkeypatch.setattr(os, 'getpid', lambda: -1)  # as in a forked worker
+    assert lazy.get('n') == 2
+
+
+def test_gunicorn_serves_the_module_level_app():
+    with open(os.path.join(ROOT, 'render.yaml')) as f:
+        assert 'gunicorn -c gunicorn.conf.py app:app' in f.read()
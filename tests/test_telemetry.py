@@ -0,0 +1,22 @@
+from flask import Flask
+
+import telemetry
+
+
+def metrics_status(headers=None, **init):
+    app = Flask(__name__)
+    telemetry.Telemetry().init_app(app, **init)
+    return app.test_client().get('/metrics', headers=headers).status_code
+
+
+def test_metrics_are_closed_without_a_token():
+    assert metrics_status() == 401
+
+
+def test_metrics_need_the_bearer_token():
+    assert metrics_status(token='s3cret') == 401
+    assert metrics_status({'Authorization': 'Bearer s3cret'}, token='s3cret') == 200
+
+
+def test_metrics_may_be_opened_for_local_development():
+    assert metrics_status(public=True) == 200